@@ -0,0 +1,218 @@
+import argparse
+import datetime
+import logging
+import os
+import threading
+import time
+from decimal import Decimal
+
+import db
+
+# Материализованные представления аналитики (миграция 0007) в порядке обновления
+VIEWS = ('analytics_volume_monthly', 'analytics_funnel_monthly', 'analytics_stage_durations')
+
+# Период обновления представлений фоновым потоком, с; 0 - только по команде/cron
+REFRESH_INTERVAL = float(os.getenv("ANALYTICS_REFRESH_INTERVAL", 0))
+# Ключ advisory-блокировки: одно представление обновляет только один процесс
+LOCK_KEY = 7283402
+
+logger = logging.getLogger(__name__)
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _fetch_dicts(cur):
+    columns = [desc[0] for desc in cur.description]
+    return [{column: _json_value(value) for column, value in zip(columns, row)}
+            for row in cur.fetchall()]
+
+
+def parse_month(value):
+    """Месяц вида ГГГГ-ММ -> первое число месяца; пустое значение -> None"""
+    if not value:
+        return None
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m").date()
+    except ValueError:
+        raise ValueError(f"Некорректный месяц {value}, ожидается ГГГГ-ММ")
+
+
+def _month_range(date_from, date_to):
+    conditions = []
+    params = []
+    if date_from:
+        conditions.append("month >= %s")
+        params.append(date_from)
+    if date_to:
+        conditions.append("month <= %s")
+        params.append(date_to)
+    return ("WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+
+def volume_by_month(date_from=None, date_to=None):
+    """Заведенные и подписанные сделки и их суммы по месяцам и валютам"""
+    where, params = _month_range(date_from, date_to)
+    with db.connect_db() as conn, conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT month, currency, deals_created, amount_created, deals_signed, amount_signed
+            FROM analytics_volume_monthly
+            {where}
+            ORDER BY month, currency
+        """, params)
+        return _fetch_dicts(cur)
+
+
+def funnel(date_from=None, date_to=None, by_manager=False):
+    """Воронка сделка менеджера -> эксперт -> одобрение -> подписание, по месяцам
+    или по менеджерам за период"""
+    where, params = _month_range(date_from, date_to)
+    if by_manager:
+        group = "f.id_manager, u.full_name"
+        columns = "f.id_manager, u.full_name AS manager_name"
+        order = "manager_deals DESC"
+    else:
+        group = "f.month"
+        columns = "f.month"
+        order = "f.month"
+    with db.connect_db() as conn, conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT {columns},
+                   SUM(f.manager_deals) AS manager_deals,
+                   SUM(f.expert_deals) AS expert_deals,
+                   SUM(f.approved) AS approved,
+                   SUM(f.signed) AS signed
+            FROM analytics_funnel_monthly f
+            LEFT JOIN users u ON u.id = f.id_manager
+            {where}
+            GROUP BY {group}
+            ORDER BY {order}
+        """, params)
+        rows = _fetch_dicts(cur)
+
+    for row in rows:
+        total = row['manager_deals']
+        row['to_expert_rate'] = round(row['expert_deals'] / total, 4) if total else None
+        row['signed_rate'] = round(row['signed'] / total, 4) if total else None
+    return rows
+
+
+def stage_durations(date_from=None, date_to=None):
+    """Средние и медианные сроки от передачи эксперту до кредитного комитета и от комитета
+    до отгрузки, в днях, по месяцам передачи"""
+    where, params = _month_range(date_from, date_to)
+    with db.connect_db() as conn, conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT month, deals,
+                   with_committee, avg_days_to_committee, median_days_to_committee,
+                   with_shipping, avg_days_to_shipping, median_days_to_shipping
+            FROM analytics_stage_durations
+            {where}
+            ORDER BY month
+        """, params)
+        return _fetch_dicts(cur)
+
+
+def refresh_status():
+    """Время последнего обновления каждого представления"""
+    with db.connect_db() as conn, conn.cursor() as cur:
+        cur.execute("SELECT view_name, refreshed_at, duration_ms FROM analytics_refreshes "
+                    "ORDER BY view_name")
+        return _fetch_dicts(cur)
+
+
+def refresh_views(max_age=None, concurrently=True):
+    """Обновляет представления, каждое в своей транзакции на отдельном соединении, даже
+    если вызвано внутри запроса. Представление пропускается, если его уже обновляет другой
+    процесс или оно обновлено менее max_age секунд назад; ошибка одного представления
+    не мешает обновить остальные. Возвращает [(имя, длительность в мс)] обновленных."""
+    refreshed = []
+    for number, view in enumerate(VIEWS):
+        try:
+            duration = _refresh_view(number, view, max_age, concurrently)
+        except Exception:
+            logger.exception("Ошибка обновления представления %s", view)
+            continue
+        if duration is not None:
+            logger.info("Представление %s обновлено за %.1f мс", view, duration)
+            refreshed.append((view, duration))
+    return refreshed
+
+
+def _refresh_view(number, view, max_age, concurrently):
+    # Блокировка транзакционная и снимается при фиксации обновления этого представления
+    with db.separate_unit_of_work(statement_timeout=0), db.connect_db() as conn, conn.cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s, %s)", (LOCK_KEY, number))
+        if not cur.fetchone()[0]:
+            return None
+        if max_age is not None:
+            cur.execute("""
+                SELECT 1 FROM analytics_refreshes
+                WHERE view_name = %s AND refreshed_at > now() - %s * interval '1 second'
+            """, (view, max_age))
+            if cur.fetchone():
+                return None
+
+        started = time.perf_counter()
+        # CONCURRENTLY не блокирует чтение представления на время обновления
+        cur.execute(f"REFRESH MATERIALIZED VIEW {'CONCURRENTLY ' if concurrently else ''}{view}")
+        duration = round((time.perf_counter() - started) * 1000, 3)
+        cur.execute("""
+            INSERT INTO analytics_refreshes (view_name, refreshed_at, duration_ms)
+            VALUES (%s, now(), %s)
+            ON CONFLICT (view_name) DO UPDATE
+            SET refreshed_at = EXCLUDED.refreshed_at, duration_ms = EXCLUDED.duration_ms
+        """, (view, duration))
+    return duration
+
+
+_scheduler_pid = None
+_scheduler_lock = threading.Lock()
+
+
+def _scheduler_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            # Несколько процессов приложения: обновляет тот, кто первым взял блокировку,
+            # остальные видят свежее время обновления и пропускают представление
+            refresh_views(max_age=interval / 2)
+        except Exception:
+            logger.exception("Ошибка обновления аналитики")
+
+
+def ensure_scheduler():
+    """Запускает фоновое обновление представлений в текущем процессе, если задан
+    ANALYTICS_REFRESH_INTERVAL; повторные вызовы ничего не делают"""
+    global _scheduler_pid
+    if REFRESH_INTERVAL <= 0 or _scheduler_pid == os.getpid():
+        return
+    with _scheduler_lock:
+        if _scheduler_pid == os.getpid():
+            return
+        threading.Thread(target=_scheduler_loop, args=(REFRESH_INTERVAL,),
+                         name="analytics-refresh", daemon=True).start()
+        _scheduler_pid = os.getpid()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Обновление материализованных представлений аналитики (например, из cron)")
+    parser.add_argument("--max-age", type=float,
+                        help="не обновлять представления, обновленные менее N секунд назад")
+    parser.add_argument("--blocking", action="store_true",
+                        help="обновлять без CONCURRENTLY (быстрее, но блокирует чтение)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    for view, duration in refresh_views(args.max_age, concurrently=not args.blocking):
+        print(f"{view}: {duration:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
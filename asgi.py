@@ -0,0 +1,228 @@
+"""Приложение в режиме ASGI: uvicorn asgi:app --workers 4
+
+Частые чтения (/deals, /deal/<id>, /expert/deals, /clients) обрабатываются асинхронно
+через asyncpg: пока запрос ждет базу, процесс обслуживает другие. Остальные маршруты,
+а также старые ссылки ?page=N, обслуживает то же приложение Flask в пуле потоков.
+"""
+import asyncio
+import inspect
+import io
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from flask import render_template, request
+
+import db_async
+import main
+
+# Потоков для синхронных маршрутов Flask в одном процессе
+WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", 16))
+
+flask_app = main.app
+_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix="wsgi")
+
+# Запрос asyncpg прерван по бюджету маршрута (TimeoutError) или statement_timeout сервера
+flask_app.register_error_handler(TimeoutError, main.query_canceled)
+if db_async.asyncpg is not None:
+    flask_app.register_error_handler(db_async.asyncpg.QueryCanceledError, main.query_canceled)
+
+
+@main.login_required
+@main.statement_timeout(3000)
+async def show_deals():
+    try:
+        filters, sort, descending, cursor = main.parse_deal_list(request.args)
+        # Оценка числа сделок, страница и менеджеры для фильтра - параллельно
+        total_deals, page, managers = await asyncio.gather(
+            db_async.estimate_deals_count(filters),
+            db_async.get_deals_keyset(main.DEALS_PER_PAGE, cursor, filters, sort, descending),
+            db_async.get_users_by_role('manager'))
+    except ValueError as e:
+        return str(e), 400
+    return main.render_keyset_page('show_deals.html', page,
+                                   main.deal_list_context(total_deals, managers))
+
+
+@main.login_required
+@main.statement_timeout(1000)
+async def view_deal(deal_id):
+    deal = await db_async.get_deal_details(deal_id)
+    if not deal:
+        return "Сделка не найдена", 404
+    return render_template('view_deal.html', deal=deal, can_transfer=True)
+
+
+@main.login_required
+@main.statement_timeout(3000)
+async def expert_deals():
+    try:
+        filters, sort, descending, cursor, expert_id = main.parse_expert_deal_list(request.args)
+        total_deals, page, managers, experts = await asyncio.gather(
+            db_async.estimate_expert_deals_count(expert_id, filters),
+            db_async.get_expert_deals_keyset(main.DEALS_PER_PAGE, cursor, expert_id, filters,
+                                             sort, descending),
+            db_async.get_users_by_role('manager'),
+            db_async.get_users_by_role('expert'))
+    except ValueError as e:
+        return str(e), 400
+    return main.render_keyset_page('expert_deals.html', page,
+                                   main.expert_deal_list_context(total_deals, managers, experts))
+
+
+@main.login_required
+@main.statement_timeout(2000)
+async def show_clients():
+    query, page = main.parse_client_search(request.args)
+    clients, total = await db_async.search_clients(query, page, main.CLIENTS_PER_PAGE)
+    return main.render_clients(query, page, clients, total)
+
+
+# (путь, обработчик, параметры запроса, с которыми запрос уходит во Flask)
+ROUTES = [
+    (re.compile(r"/deals"), show_deals, ('page',)),
+    (re.compile(r"/deal/(?P<deal_id>\d+)"), view_deal, ()),
+    (re.compile(r"/expert/deals"), expert_deals, ('page',)),
+    (re.compile(r"/clients"), show_clients, ()),
+]
+
+
+def _match(scope):
+    if scope['method'] not in ('GET', 'HEAD'):
+        return None, None
+    for pattern, handler, sync_args in ROUTES:
+        match = pattern.fullmatch(scope['path'])
+        if not match:
+            continue
+        args = parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True)
+        if any(name in sync_args for name, _ in args):
+            return None, None
+        return handler, {name: int(value) for name, value in match.groupdict().items()}
+    return None, None
+
+
+def _environ(scope, body=b''):
+    """WSGI-окружение запроса: по нему Flask разбирает параметры, cookie, сессию и форму"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        key = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def _dispatch(handler, kwargs, scope, send):
+    # Контекст запроса Flask дает обработчику session, request и шаблоны, а хуки
+    # before/after_request и сохранение сессии работают так же, как в режиме WSGI
+    with flask_app.request_context(_environ(scope)):
+        try:
+            try:
+                rv = flask_app.preprocess_request()
+                if rv is None:
+                    rv = handler(**kwargs)
+                    if inspect.isawaitable(rv):
+                        rv = await rv
+            except Exception as e:
+                # Обработчики ошибок приложения (errorhandler), как в full_dispatch_request
+                rv = flask_app.handle_user_exception(e)
+            response = flask_app.finalize_request(rv)
+        except Exception as e:
+            response = flask_app.handle_exception(e)
+        body = b'' if scope['method'] == 'HEAD' else response.get_data()
+        headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                   for name, value in response.headers.to_wsgi_list()]
+
+    await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _run_wsgi(environ, loop, send):
+    """Выполняет запрос приложением Flask в потоке пула; ответ отдается по частям, поэтому
+    выгрузки не собираются в памяти целиком"""
+    def send_from_thread(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    response_start = {}
+
+    def start_response(status, headers, exc_info=None):
+        response_start.update({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in headers],
+        })
+
+    result = flask_app(environ, start_response)
+    try:
+        started = False
+        for chunk in result:
+            if not chunk:
+                continue
+            if not started:
+                send_from_thread(response_start)
+                started = True
+            if environ['REQUEST_METHOD'] != 'HEAD':
+                send_from_thread({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        if not started:
+            send_from_thread(response_start)
+        send_from_thread({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+
+async def _fallback(scope, receive, send):
+    body = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        body.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_executor, _run_wsgi, _environ(scope, b''.join(body)), loop, send)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await db_async.close_pool()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+
+    if scope['type'] != 'http':
+        return
+    handler, kwargs = _match(scope)
+    if handler is not None:
+        return await _dispatch(handler, kwargs, scope, send)
+    return await _fallback(scope, receive, send)
@@ -1,7 +1,212 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
 from werkzeug.security import generate_password_hash, check_password_hash
 
+import db
+
+# Хэширование и проверка паролей выполняются в отдельных процессах: вычисление хэша
+# занимает десятки и сотни миллисекунд процессора, и волна входов не должна отнимать
+# его у остальных запросов. Процессов и ожидающих проверок - ограниченное число.
+
+# Метод и стоимость в формате werkzeug: scrypt:32768:8:1, pbkdf2:sha256:600000.
+# Хэши, посчитанные с другими параметрами, пересчитываются при успешном входе.
+HASH_METHOD = os.getenv("AUTH_HASH_METHOD", "scrypt:32768:8:1")
+# Процессов хэширования у каждого процесса приложения; 0 - считать в потоке запроса
+AUTH_WORKERS = int(os.getenv("AUTH_WORKERS", 1))
+# Сколько проверок может одновременно выполняться и ждать очереди
+AUTH_QUEUE = int(os.getenv("AUTH_QUEUE", 0)) or max(AUTH_WORKERS, 1) * 4
+# Сколько секунд запрос ждет места в очереди и результата
+AUTH_TIMEOUT = float(os.getenv("AUTH_TIMEOUT", 10))
+AUTH_START_METHOD = os.getenv("AUTH_START_METHOD", "spawn")
+
+# Задержка после неудачных входов: первые AUTH_FREE_ATTEMPTS ошибок без задержки,
+# дальше AUTH_BACKOFF_BASE * 2^n секунд, но не больше AUTH_BACKOFF_MAX. Счетчик
+# сбрасывается успешным входом или через AUTH_BACKOFF_RESET секунд без ошибок.
+AUTH_FREE_ATTEMPTS = int(os.getenv("AUTH_FREE_ATTEMPTS", 3))
+AUTH_BACKOFF_BASE = float(os.getenv("AUTH_BACKOFF_BASE", 1))
+AUTH_BACKOFF_MAX = float(os.getenv("AUTH_BACKOFF_MAX", 300))
+AUTH_BACKOFF_RESET = float(os.getenv("AUTH_BACKOFF_RESET", 900))
+AUTH_BACKOFF_USERS = int(os.getenv("AUTH_BACKOFF_USERS", 10000))
+
+
+class AuthBusy(ValueError):
+    """Проверка пароля не выполнена: очередь проверок заполнена"""
+
+
+class LoginThrottled(ValueError):
+    """Вход временно запрещен после неудачных попыток"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Слишком много неудачных попыток входа, повторите через "
+                         f"{int(retry_after) + 1} с")
+        self.retry_after = retry_after
+
+
+_executor = None
+_executor_pid = None
+_slots = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Пул процессов и ограничитель очереди текущего процесса (после fork - новые)"""
+    global _executor, _executor_pid, _slots
+    if _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor_pid != os.getpid():
+                _executor = None
+                if AUTH_WORKERS > 0:
+                    _executor = ProcessPoolExecutor(
+                        max_workers=AUTH_WORKERS,
+                        mp_context=multiprocessing.get_context(AUTH_START_METHOD))
+                _slots = threading.BoundedSemaphore(AUTH_QUEUE)
+                _executor_pid = os.getpid()
+    return _executor, _slots
+
+
+def _run(fn, *args):
+    executor, slots = _get_executor()
+    if not slots.acquire(timeout=AUTH_TIMEOUT):
+        raise AuthBusy("Сервер занят проверкой паролей, повторите вход позже")
+    if executor is None:
+        try:
+            return fn(*args)
+        finally:
+            slots.release()
+    try:
+        future = executor.submit(fn, *args)
+    except BaseException:
+        slots.release()
+        raise
+    # Место освобождается, когда хэш действительно посчитан (или задача отменена), а не
+    # когда запрос перестал ждать: иначе после тайм-аутов в пуле копились бы задачи
+    future.add_done_callback(lambda _: slots.release())
+    try:
+        return future.result(timeout=AUTH_TIMEOUT)
+    except FutureTimeout:
+        raise AuthBusy("Сервер занят проверкой паролей, повторите вход позже")
+    except BrokenProcessPool:
+        # Процесс хэширования завершился аварийно - следующий вызов создаст пул заново
+        shutdown()
+        raise AuthBusy("Проверка пароля не выполнена, повторите вход")
+
+
+def shutdown():
+    """Останавливает процессы хэширования текущего процесса"""
+    global _executor, _executor_pid
+    with _executor_lock:
+        executor = _executor if _executor_pid == os.getpid() else None
+        _executor = None
+        _executor_pid = None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
 def hash_password(password):
-    return generate_password_hash(password)
+    return _run(generate_password_hash, password, HASH_METHOD)
+
 
 def verify_password(hashed_password, password):
-    return check_password_hash(hashed_password, password)
\ No newline at end of file
+    return _run(check_password_hash, hashed_password, password)
+
+
+_current_method = {}
+
+
+def current_method():
+    """Метод и параметры хэша в том виде, в каком werkzeug пишет их в начало хэша"""
+    method = _current_method.get(HASH_METHOD)
+    if method is None:
+        # werkzeug дополняет параметры по умолчанию (scrypt -> scrypt:32768:8:1),
+        # поэтому берем их из настоящего хэша
+        method = _current_method[HASH_METHOD] = hash_password('').split('$', 1)[0]
+    return method
+
+
+def needs_rehash(hashed_password):
+    return hashed_password.split('$', 1)[0] != current_method()
+
+
+def warm_up():
+    """Запускает процессы хэширования и проверяет AUTH_HASH_METHOD до первого входа"""
+    current_method()
+
+
+_failures = OrderedDict()  # имя -> (число неудачных попыток, время последней)
+_failures_lock = threading.Lock()
+
+
+def _delay(failures):
+    if failures < AUTH_FREE_ATTEMPTS:
+        return 0.0
+    # Степень ограничена до умножения: 2 ** n при тысячах неудач не помещается во float
+    exponent = min(failures - AUTH_FREE_ATTEMPTS, 32)
+    return min(AUTH_BACKOFF_BASE * 2 ** exponent, AUTH_BACKOFF_MAX)
+
+
+def reserve_attempt(username):
+    """Учитывает попытку входа как неудачную до проверки пароля, если задержка после
+    прежних попыток истекла, иначе запрещает вход. Проверка и учет выполняются под одной
+    блокировкой: параллельные попытки под одним именем видят друг друга и задерживаются
+    так же, как последовательные."""
+    now = time.monotonic()
+    with _failures_lock:
+        failures, last = _failures.pop(username, (0, 0))
+        if failures and now - last > AUTH_BACKOFF_RESET:
+            failures = 0
+        wait = last + _delay(failures) - now if failures else 0
+        if wait > 0:
+            _failures[username] = (failures, last)
+        else:
+            _failures[username] = (failures + 1, now)
+        while len(_failures) > AUTH_BACKOFF_USERS:
+            _failures.popitem(last=False)
+    if wait > 0:
+        raise LoginThrottled(wait)
+
+
+def cancel_attempt(username):
+    """Возвращает попытку, пароль в которой так и не был проверен"""
+    with _failures_lock:
+        item = _failures.get(username)
+        if item is not None:
+            _failures[username] = (max(item[0] - 1, 0), item[1])
+
+
+def record_success(username):
+    with _failures_lock:
+        _failures.pop(username, None)
+
+
+def authenticate(username, password):
+    """Пользователь с этим именем и паролем или None. Проверка идет в пуле процессов;
+    хэш, посчитанный с прежними параметрами, заменяется новым."""
+    username = username or ''
+    reserve_attempt(username)
+    try:
+        # Пользователь читается в отдельной транзакции: соединение возвращается в пул
+        # до проверки пароля, которая может долго ждать очереди хэширования
+        with db.separate_unit_of_work():
+            user = db.get_user_by_username(username)
+        verified = user is not None and bool(password) and verify_password(user.password_hash, password)
+    except Exception:
+        # Пароль не проверен (очередь занята, ошибка БД) - попытка не считается
+        cancel_attempt(username)
+        raise
+    if not verified:
+        return None
+    record_success(username)
+
+    try:
+        if needs_rehash(user.password_hash):
+            db.update_password_hash(user.id, user.password_hash, hash_password(password))
+    except AuthBusy:
+        # Вход уже подтвержден, хэш будет пересчитан при следующем
+        pass
+    return user
@@ -0,0 +1,102 @@
+"""Пропускная способность проверки паролей при волне входов: входов в секунду всего
+и на один процесс хэширования для разных методов и стоимостей хэша, а также задержка
+обычной работы процесса приложения (рендер страницы) во время волны.
+
+AUTH_WORKERS=0 - проверка в потоках запросов, как до пула процессов.
+
+    python benchmarks/auth.py --method scrypt:32768:8:1 --method pbkdf2:sha256:600000
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+import auth  # noqa: E402
+
+PASSWORD = "correct horse battery staple"
+
+
+def cpu_count():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def page_probe(stop, latencies):
+    """Имитирует запрос другой страницы: ~1 мс работы Python раз в 5 мс"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        sum(i * i for i in range(20000))
+        latencies.append((time.perf_counter() - started) * 1000)
+        time.sleep(0.005)
+
+
+def storm(hashed, logins, concurrency):
+    """Волна входов: logins проверок из concurrency потоков; входов в секунду и задержки
+    имитации соседних запросов в мс"""
+    latencies = []
+    stop = threading.Event()
+    probe = threading.Thread(target=page_probe, args=(stop, latencies))
+    probe.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: auth.verify_password(hashed, PASSWORD),
+                                    range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    probe.join()
+    if not all(results):
+        raise SystemExit("Проверка пароля не прошла")
+    return logins / elapsed, latencies
+
+
+def configure(workers, concurrency):
+    auth.shutdown()
+    auth.AUTH_WORKERS = workers
+    auth.AUTH_QUEUE = concurrency
+    auth.AUTH_TIMEOUT = 600
+    # Процессы запускаются до замера
+    auth.verify_password(generate_password_hash("x", "pbkdf2:sha256:1"), "x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Входов в секунду на ядро при волне входов")
+    parser.add_argument("--method", action="append", dest="methods",
+                        help=f"метод хэша werkzeug, можно несколько; по умолчанию {auth.HASH_METHOD}")
+    parser.add_argument("--workers", type=int, action="append",
+                        help="процессов хэширования, можно несколько; 0 - в потоках запросов")
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=32, help="одновременных входов")
+    args = parser.parse_args()
+
+    cores = cpu_count()
+    methods = args.methods or [auth.HASH_METHOD]
+    workers_list = args.workers or sorted({0, 1, max(cores // 2, 1), cores})
+    print(f"Доступно ядер: {cores}")
+    print(f"{'метод':<24} {'процессов':>9} {'входов/с':>9} {'на ядро':>8} "
+          f"{'страница p50':>13} {'p95, мс':>8}")
+    try:
+        for method in methods:
+            hashed = generate_password_hash(PASSWORD, method)
+            for workers in workers_list:
+                configure(workers, args.concurrency)
+                rate, latencies = storm(hashed, args.logins, args.concurrency)
+                used = min(workers, cores) if workers else min(args.concurrency, cores)
+                p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else None
+                print(f"{method:<24} {workers or 'потоки':>9} {rate:9.1f} {rate / used:8.1f} "
+                      f"{statistics.median(latencies):13.2f} "
+                      f"{p95 if p95 is None else round(p95, 2):>8}")
+    finally:
+        auth.shutdown()
+    print("'На ядро' - входов в секунду на одно ядро, занятое хэшированием.")
+
+
+if __name__ == "__main__":
+    main()
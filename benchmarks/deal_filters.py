@@ -0,0 +1,105 @@
+import argparse
+import datetime
+import itertools
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import deal_filters  # noqa: E402
+import pagination  # noqa: E402
+
+
+def sample_filters():
+    """Берет из базы типичные значения фильтров, чтобы запросы что-то находили"""
+    with db.connect_db() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT status, id_users, currency_contract
+            FROM deals_managers
+            WHERE status IS NOT NULL AND id_users IS NOT NULL AND currency_contract IS NOT NULL
+            ORDER BY id DESC
+            LIMIT 1
+        """)
+        row = cur.fetchone()
+        if row is None:
+            raise SystemExit("В deals_managers нет данных для замера")
+        cur.execute("SELECT percentile_disc(ARRAY[0.4, 0.6]) WITHIN GROUP (ORDER BY amount_financing) "
+                    "FROM deals_managers")
+        amount_min, amount_max = cur.fetchone()[0] or (None, None)
+
+    month = datetime.date.today().replace(day=1)
+    next_month = (month + datetime.timedelta(days=32)).replace(day=1)
+    return {
+        'status': {'status': row[0]},
+        'manager': {'manager': row[1]},
+        'currency': {'currency': row[2]},
+        'ship': {'ship_from': month, 'ship_to': next_month - datetime.timedelta(days=1)},
+        'amount': {'amount_min': amount_min, 'amount_max': amount_max},
+    }
+
+
+def plan_problem(filters, sort, descending):
+    """Чем плох план первой страницы: Seq Scan, полная сортировка или None, если строки
+    идут прямо из индекса. Порядок берется из pagination.keyset_clause, как в списке."""
+    conditions, params = deal_filters.where_conditions(filters, deal_filters.DEAL_FILTERS)
+    _, order, _ = pagination.keyset_clause("d.id", None, deal_filters.DEAL_SORTS[sort], descending)
+    with db.connect_db() as conn, conn.cursor() as cur:
+        cur.execute(f"""
+            EXPLAIN SELECT d.id FROM deals_managers d
+            {"WHERE " + " AND ".join(conditions) if conditions else ""}
+            ORDER BY {order} LIMIT 11
+        """, params)
+        plan = "\n".join(row[0] for row in cur.fetchall())
+    if "Seq Scan on deals_managers" in plan:
+        return "SEQ SCAN"
+    if re.search(r"->\s+(Incremental )?Sort\b|^Sort\b", plan, re.MULTILINE):
+        return "SORT"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Замер всех сочетаний фильтров списка /deals на заполненной базе "
+                    "(рассчитано на объем порядка 1 млн сделок, см. benchmarks/seed.py)")
+    parser.add_argument("--repeat", type=int, default=20, help="повторов на сочетание")
+    parser.add_argument("--json", help="сохранить результаты в файл")
+    args = parser.parse_args()
+
+    samples = sample_filters()
+    results = []
+    for size in range(len(samples) + 1):
+        for names in itertools.combinations(samples, size):
+            filters = {}
+            for name in names:
+                filters.update(samples[name])
+            for sort, descending in itertools.product(deal_filters.DEAL_SORTS, (True, False)):
+                timings = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    db.get_deals_keyset(10, None, filters, sort, descending)
+                    timings.append((time.perf_counter() - started) * 1000)
+                result = {
+                    'filters': '+'.join(names) or '-',
+                    'sort': f"{sort} {'desc' if descending else 'asc'}",
+                    'p50_ms': round(statistics.median(timings), 3),
+                    'max_ms': round(max(timings), 3),
+                    'problem': plan_problem(filters, sort, descending),
+                }
+                results.append(result)
+                print(f"{result['filters']:<40} {result['sort']:<24} p50 {result['p50_ms']:>9.3f} мс  "
+                      f"max {result['max_ms']:>9.3f} мс  {result['problem'] or 'index'}")
+
+    problems = [result for result in results if result['problem']]
+    print(f"Сочетаний: {len(results)}, без индексного порядка: {len(problems)}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Объем записи при сохранении формы сделки: прежнее обновление всех 22 колонок против
+обновления только изменившихся полей с пропуском сохранений без изменений.
+
+Нагрузка - сохранения формы редактирования, в которых чаще всего не меняется ничего
+или одно поле (--mix задает доли 0, 1, 2 и 5 измененных полей). Для каждого способа
+считаются записанные версии строк (из них HOT - без обновления индексов), объем WAL
+и время. Сделки берутся из базы (например, после benchmarks/seed.py); все изменения
+выполняются в транзакции, которая затем откатывается.
+
+    python benchmarks/deal_updates.py --deals 1000 --saves 5000
+
+MVCC в Postgres записывает новую версию строки целиком при любом UPDATE, даже если
+изменилась одна колонка, поэтому обновление части колонок почти не уменьшает запись на
+одно изменение. Экономия - в сохранениях без изменений (записи нет совсем) и в
+обновлениях, не затрагивающих индексированные колонки: такие чаще остаются HOT.
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import deal_filters  # noqa: E402
+import deal_form  # noqa: E402
+
+
+def form_from_deal(deal):
+    """Поля формы так, как их заполняет шаблон edit_deal.html"""
+    form = {'version': deal_form.version(deal)}
+    for field, convert in deal_form.EDIT_FIELDS.items():
+        value = getattr(deal, field)
+        if field in ('express', 'electric_car'):
+            if value:
+                form[field] = 'on'
+        elif value is None:
+            form[field] = ''
+        elif isinstance(value, datetime.datetime):
+            form[field] = value.strftime('%Y-%m-%dT%H:%M')
+        else:
+            form[field] = str(value)
+    return form
+
+
+def edit(rng, form, count):
+    """Меняет в форме count случайных полей"""
+    form = dict(form)
+    for field in rng.sample(['status', 'amount_financing', 'm_plan_ship', 'description',
+                             'express', 'prepayment', 'contract_term', 'name_agent'], count):
+        if field == 'status':
+            form[field] = rng.choice([s for s in deal_filters.DEAL_STATUSES if s != form[field]])
+        elif field == 'amount_financing':
+            form[field] = str(rng.randrange(10000, 500000))
+        elif field == 'm_plan_ship':
+            form[field] = (datetime.date(2025, 1, 1) + datetime.timedelta(days=rng.randrange(365))).isoformat()
+        elif field == 'express':
+            if form.pop(field, None) is None:
+                form[field] = 'on'
+        elif field == 'contract_term':
+            form[field] = str(rng.choice((12, 24, 36, 48, 60)))
+        else:
+            form[field] = f"Правка {rng.randrange(10 ** 6)}"
+    return form
+
+
+def save_full(deal_id, form):
+    """Как edit_deal до частичных обновлений: все колонки позиционно"""
+    deal = db.get_deal_details(deal_id)
+    data = {key: (value or None) for key, value in form.items()}
+    db.update_deal(
+        deal_id, data.get('date_first_contact'), deal.id_client, data.get('car_brand'),
+        data.get('sales_car'), data.get('skp_or_bl'), data.get('status'),
+        data.get('shipment_or_signing'), data.get('prepayment'), data.get('contract_term'),
+        data.get('currency_contract'), data.get('interest_rate'), data.get('use_number_cert'),
+        data.get('use_date_cert'), data.get('issued_number_cert'), data.get('issued_date_cert'),
+        data.get('express') == 'on', data.get('electric_car') == 'on',
+        data.get('amount_financing'), data.get('m_plan_ship'), data.get('description'),
+        data.get('sales_channel'), data.get('name_agent'),
+    )
+
+
+def save_changes(deal_id, form):
+    """Как edit_deal сейчас: только изменившиеся поля с проверкой версии"""
+    deal = db.get_deal_for_edit(deal_id)
+    changes = deal_form.changes(deal, form)
+    if changes and db.update_deal_fields(deal_id, changes, deal.updated_at) is None:
+        raise SystemExit(f"Сделка {deal_id}: неожиданный конфликт версий")
+
+
+def counters(cur):
+    cur.execute("""
+        SELECT pg_current_wal_insert_lsn(), n_tup_upd, n_tup_hot_upd
+        FROM pg_stat_xact_user_tables WHERE relname = 'deals_managers'
+    """)
+    return cur.fetchone()
+
+
+def run(name, save, deal_ids, plan):
+    """Выполняет сохранения plan [(номер сделки, число измененных полей)] одним способом"""
+    with db.unit_of_work() as uow:
+        uow.rollback_only = True
+        with db.connect_db() as conn, conn.cursor() as cur:
+            # Формы строятся до замера из исходных значений, как открытые пользователями
+            forms = {deal_id: form_from_deal(db.get_deal_for_edit(deal_id)) for deal_id in deal_ids}
+            rng = random.Random(1)
+            before = counters(cur)
+            started = time.perf_counter()
+            for deal_id, count in plan:
+                form = edit(rng, forms[deal_id], count)
+                save(deal_id, form)
+                # Следующее сохранение той же сделки - из формы, открытой после этого
+                forms[deal_id] = form_from_deal(db.get_deal_for_edit(deal_id))
+            elapsed = time.perf_counter() - started
+            after = counters(cur)
+            cur.execute("SELECT pg_wal_lsn_diff(%s, %s)", (after[0], before[0]))
+            wal = float(cur.fetchone()[0])
+    return {
+        'name': name,
+        'rows': after[1] - before[1],
+        'hot': after[2] - before[2],
+        'wal': wal,
+        'elapsed': elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Объем записи при сохранении формы сделки: все колонки против изменившихся")
+    parser.add_argument("--deals", type=int, default=1000, help="сколько сделок редактируется")
+    parser.add_argument("--saves", type=int, default=5000)
+    parser.add_argument("--mix", default="50,35,10,5",
+                        help="доли сохранений с 0, 1, 2 и 5 измененными полями, %%")
+    args = parser.parse_args()
+
+    weights = [float(value) for value in args.mix.split(',')]
+    if len(weights) != 4:
+        raise SystemExit("--mix: ожидаются четыре доли")
+    with db.connect_db() as conn, conn.cursor() as cur:
+        cur.execute("SELECT id FROM deals_managers ORDER BY id DESC LIMIT %s", (args.deals,))
+        deal_ids = [row[0] for row in cur.fetchall()]
+    if not deal_ids:
+        raise SystemExit("В deals_managers нет сделок; заполните базу benchmarks/seed.py")
+
+    rng = random.Random(0)
+    plan = [(rng.choice(deal_ids), rng.choices((0, 1, 2, 5), weights)[0]) for _ in range(args.saves)]
+    print(f"Сохранений: {args.saves}, сделок: {len(deal_ids)}, без изменений: "
+          f"{sum(1 for _, count in plan if not count)}")
+    print(f"{'способ':<22} {'версий строк':>13} {'из них HOT':>11} {'WAL, КБ':>10} "
+          f"{'WAL на сохр., Б':>16} {'мс на сохр.':>12}")
+    for name, save in (("все колонки", save_full), ("изменившиеся поля", save_changes)):
+        result = run(name, save, deal_ids, plan)
+        print(f"{result['name']:<22} {result['rows']:>13} {result['hot']:>11} "
+              f"{result['wal'] / 1024:>10.1f} {result['wal'] / args.saves:>16.0f} "
+              f"{result['elapsed'] * 1000 / args.saves:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import deal_filters  # noqa: E402
+
+# Метка строк, которые создает проверка; по ней они удаляются в конце
+MARKER = "counters-check"
+
+
+def worker(experts, operations, errors):
+    """Случайно создает сделки эксперта, меняет их статус и эксперта, удаляет"""
+    for _ in range(operations):
+        action = random.choice(('insert', 'insert', 'status', 'expert', 'delete'))
+        status = random.choice(deal_filters.EXPERT_DEAL_STATUSES + [None])
+        expert = random.choice(experts + [None])
+        try:
+            with db.unit_of_work(), db.connect_db() as conn, conn.cursor() as cur:
+                if action == 'insert':
+                    cur.execute("INSERT INTO deals_expert (car_brand, status, id_ce) VALUES (%s, %s, %s)",
+                                (MARKER, status, expert))
+                    continue
+                cur.execute("""
+                    SELECT id FROM deals_expert WHERE car_brand = %s
+                    ORDER BY random() LIMIT 1
+                """, (MARKER,))
+                row = cur.fetchone()
+                if row is None:
+                    continue
+                if action == 'status':
+                    cur.execute("UPDATE deals_expert SET status = %s WHERE id = %s", (status, row[0]))
+                elif action == 'expert':
+                    cur.execute("UPDATE deals_expert SET id_ce = %s WHERE id = %s", (expert, row[0]))
+                else:
+                    cur.execute("DELETE FROM deals_expert WHERE id = %s", (row[0],))
+        except Exception as e:
+            errors.append(f"{action}: {e}")
+
+
+def report(stage):
+    mismatches = db.check_expert_counters()
+    if mismatches:
+        print(f"{stage}: счетчики расходятся с таблицей:")
+        for id_ce, status, counted, actual in mismatches:
+            print(f"   эксперт {id_ce}, статус {status!r}: {counted} вместо {actual}")
+    else:
+        print(f"{stage}: счетчики совпадают с таблицей")
+    return not mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Проверка счетчиков deals_expert_counters при параллельных изменениях сделок. "
+                    "Создает и затем удаляет сделки с car_brand = '" + MARKER + "'.")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--operations", type=int, default=500, help="операций на поток")
+    args = parser.parse_args()
+
+    experts = [user.id for user in db.get_users_by_role('expert')]
+    errors = []
+    threads = [threading.Thread(target=worker, args=(experts, args.operations, errors))
+               for _ in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"{args.threads * args.operations} операций за {time.perf_counter() - started:.1f} с, "
+          f"ошибок: {len(errors)}")
+    for error in errors[:10]:
+        print(f"   {error}")
+
+    ok = report("После нагрузки")
+    with db.unit_of_work(), db.connect_db() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM deals_expert WHERE car_brand = %s", (MARKER,))
+    ok = report("После очистки") and ok
+    sys.exit(0 if ok and not errors else 1)
+
+
+if __name__ == "__main__":
+    main()
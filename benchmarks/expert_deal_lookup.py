@@ -0,0 +1,77 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+def grow(cur, rows):
+    """Добавляет rows сделок эксперта, каждая со своей сделкой менеджера"""
+    cur.execute("""
+        WITH managers AS (
+            INSERT INTO deals_managers (car_brand, status, amount_financing, currency_contract)
+            SELECT 'lookup-check', 'Согласование условий', 100000, 'BYN'
+            FROM generate_series(1, %s)
+            RETURNING id
+        )
+        INSERT INTO deals_expert (id_manager_deal, car_brand, status, amount_financing)
+        SELECT id, 'lookup-check', 'На рассмотрении', 100000 FROM managers
+    """, (rows,))
+    cur.execute("ANALYZE deals_expert")
+    cur.execute("ANALYZE deals_managers")
+
+
+def measure(cur, repeat):
+    cur.execute("SELECT min(id), max(id) FROM deals_expert")
+    low, high = cur.fetchone()
+    ids = [low + (high - low) * i // max(repeat - 1, 1) for i in range(repeat)]
+
+    timings = []
+    for deal_id in ids:
+        started = time.perf_counter()
+        # Чтение мимо кэша: замеряем сам запрос
+        db._load_expert_deal_details(deal_id)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    cur.execute("EXPLAIN SELECT 1 FROM deals_expert e "
+                "LEFT JOIN deals_managers m ON e.id_manager_deal = m.id WHERE e.id = %s", (high,))
+    plan = "\n".join(row[0] for row in cur.fetchall())
+    return statistics.median(timings), "Seq Scan" not in plan
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Проверка, что карточка сделки эксперта читается за постоянное время при "
+                    "росте deals_expert. Данные добавляются в транзакции, которая откатывается.")
+    parser.add_argument("--steps", default="1000,10000,100000,1000000",
+                        help="размеры прироста таблицы через запятую")
+    parser.add_argument("--repeat", type=int, default=200, help="чтений на каждом шаге")
+    parser.add_argument("--max-ratio", type=float, default=3.0,
+                        help="допустимое отношение медиан последнего и первого шага")
+    args = parser.parse_args()
+
+    results = []
+    with db.unit_of_work() as uow:
+        uow.rollback_only = True
+        with db.connect_db() as conn, conn.cursor() as cur:
+            total = 0
+            for rows in [int(step) for step in args.steps.split(",")]:
+                grow(cur, rows - total)
+                total = rows
+                p50, indexed = measure(cur, args.repeat)
+                results.append((p50, indexed))
+                print(f"+{total:>9} сделок: p50 {p50:.3f} мс, "
+                      f"{'по индексу' if indexed else 'ПОЛНЫЙ ПРОСМОТР'}")
+
+    ratio = results[-1][0] / results[0][0]
+    ok = all(indexed for _, indexed in results) and ratio <= args.max_ratio
+    print(f"Отношение медиан: {ratio:.2f} (допустимо {args.max_ratio}) - {'OK' if ok else 'ОШИБКА'}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
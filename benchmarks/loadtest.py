@@ -0,0 +1,354 @@
+"""Нагрузочный тест частых страниц: заданное число одновременных клиентов с keep-alive,
+пропускная способность и задержки (p50/p95/p99) по каждому серверу и маршруту.
+
+Сравнение синхронного и асинхронного режимов на одной локальной базе:
+
+    gunicorn -w 4 -b 127.0.0.1:8000 main:app
+    uvicorn asgi:app --workers 4 --port 8001
+    python benchmarks/loadtest.py --username manager --password secret \\
+        --target sync=http://127.0.0.1:8000 --target async=http://127.0.0.1:8001 \\
+        --concurrency 200 --requests 20000
+
+Сравнение с базовой линией на данных benchmarks/seed.py: результаты сохраняются в JSON,
+следующий прогон показывает изменение каждого маршрута относительно сохраненного.
+
+    python benchmarks/seed.py --deals 1000000 --password secret --manifest seed.json
+    python benchmarks/loadtest.py --manifest seed.json --target http://127.0.0.1:8000 \\
+        --json baseline.json
+    python benchmarks/loadtest.py --manifest seed.json --target http://127.0.0.1:8000 \\
+        --json after.json --baseline baseline.json
+
+Маршрут - путь или "МЕТОД путь"; {deal}, {expert_deal} и {client} заменяются случайными
+id из диапазонов манифеста (без манифеста - 1). Последовательность запросов задается
+--random-seed и одинакова от прогона к прогону. POST /create_deal создает сделки.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+DEFAULT_PATHS = ('/deals', '/deal/{deal}', '/expert/deals', '/clients', '/employees',
+                 'POST /create_deal')
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def login(base_url, username, password):
+    """Входит в приложение и возвращает cookie сессии"""
+    data = urllib.parse.urlencode({'username': username, 'password': password}).encode()
+    opener = urllib.request.build_opener(_NoRedirect)
+    try:
+        response = opener.open(base_url + '/login', data, timeout=10)
+    except urllib.error.HTTPError as e:
+        # Успешный вход отвечает редиректом
+        response = e
+    cookie = response.headers.get('Set-Cookie')
+    if response.status != 302 or not cookie:
+        raise SystemExit(f"{base_url}: не удалось войти под {username}")
+    return cookie.split(';', 1)[0]
+
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("сервер закрыл соединение")
+    status = int(status_line.split()[1])
+    length = None
+    chunked = False
+    close = False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        value = value.strip()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'transfer-encoding' and 'chunked' in value.lower():
+            chunked = True
+        elif name == 'connection' and value.lower() == 'close':
+            close = True
+
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length is not None:
+        await reader.readexactly(length)
+    else:
+        await reader.read()
+        close = True
+    return status, close
+
+
+def create_deal_form(rng, manifest):
+    """Форма новой сделки: в половине случаев клиент из манифеста, иначе новый"""
+    clients = manifest.get('clients')
+    if clients and rng.random() < 0.5:
+        unp = f"{int(clients['first_unp']) + rng.randrange(clients['count']):09d}"
+    else:
+        unp = f"9{rng.randrange(10 ** 8):08d}"
+    return {
+        'name_client': f"ООО «Нагрузка-{unp}»", 'unp_client': unp,
+        'date_first_contact': datetime.datetime(2025, 1, 1, 10).isoformat(timespec='minutes'),
+        'car_brand': rng.choice(('Geely', 'Toyota', 'Volkswagen')), 'sales_car': 'Дилер',
+        'skp_or_bl': 'СКП', 'status': 'Согласование условий', 'contract_term': '36',
+        'currency_contract': 'BYN', 'interest_rate': '12.5',
+        'amount_financing': str(rng.randrange(20000, 200000)), 'm_plan_ship': '2025-06-01',
+    }
+
+
+FORMS = {'/create_deal': create_deal_form}
+
+
+def _random_id(rng, manifest, name):
+    ids = manifest.get(name)
+    if not ids or not ids.get('count') or ids.get('first_id') is None:
+        return 1
+    return ids['first_id'] + rng.randrange(ids['count'])
+
+
+def build_requests(paths, total, manifest, seed):
+    """Заранее готовит последовательность запросов: (маршрут, метод, путь, тело)"""
+    rng = random.Random(seed)
+    requests = []
+    for number in range(total):
+        route = paths[number % len(paths)]
+        method, _, path = route.rpartition(' ')
+        method = method or 'GET'
+        path = path.format(deal=_random_id(rng, manifest, 'deals'),
+                           expert_deal=_random_id(rng, manifest, 'expert_deals'),
+                           client=_random_id(rng, manifest, 'clients'))
+        body = b''
+        if method == 'POST':
+            form = FORMS.get(path)
+            body = urllib.parse.urlencode(form(rng, manifest) if form else {}).encode()
+        requests.append((route, method, path, body))
+    return requests
+
+
+async def _client(url, requests, cookie, counter, total, results):
+    parts = urllib.parse.urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    reader = writer = None
+    while True:
+        number = counter[0]
+        if number >= total:
+            break
+        counter[0] += 1
+        route, method, path, body = requests[number % len(requests)]
+        request = (f"{method} {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nCookie: {cookie}\r\n"
+                   f"Connection: keep-alive\r\n")
+        if method != 'GET':
+            request += (f"Content-Type: application/x-www-form-urlencoded\r\n"
+                        f"Content-Length: {len(body)}\r\n")
+        request = (request + "\r\n").encode() + body
+        started = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(request)
+            status, close = await _read_response(reader)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+            status, close = None, True
+        results.append((route, status, time.perf_counter() - started))
+        if close and writer is not None:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def summarize(results, elapsed):
+    """Сводка по всем запросам и по маршрутам: число, ошибки, запросов в секунду, задержки в мс"""
+    def stats(items):
+        latencies = [latency * 1000 for _, status, latency in items if status == 200]
+        return {
+            'requests': len(items),
+            'errors': sum(1 for _, status, _ in items if status != 200),
+            'rps': round(len(items) / elapsed, 1) if elapsed else None,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'mean': statistics.fmean(latencies) if latencies else None,
+        }
+
+    routes = {}
+    for item in results:
+        routes.setdefault(item[0], []).append(item)
+    return {
+        'elapsed': round(elapsed, 3),
+        'total': stats(results),
+        'routes': {path: stats(items) for path, items in routes.items()},
+    }
+
+
+async def run_load(url, requests, cookie, concurrency, total, warmup=0):
+    if warmup:
+        # Прогрев - только чтением, чтобы не создавать лишних сделок
+        reads = [item for item in requests if item[1] == 'GET'] or requests
+        await asyncio.gather(*(_client(url, reads, cookie, [0], warmup // concurrency + 1, [])
+                               for _ in range(min(concurrency, warmup))))
+    counter = [0]
+    results = []
+    started = time.perf_counter()
+    await asyncio.gather(*(_client(url, requests, cookie, counter, total, results)
+                           for _ in range(concurrency)))
+    return summarize(results, time.perf_counter() - started)
+
+
+def _format_ms(value):
+    return f"{value:8.1f}" if value is not None else f"{'-':>8}"
+
+
+def print_report(reports):
+    print(f"{'сервер':<10} {'маршрут':<20} {'запросов':>9} {'ошибок':>7} {'req/s':>9} "
+          f"{'p50, мс':>8} {'p95, мс':>8} {'p99, мс':>8}")
+    for name, report in reports.items():
+        rows = [('все', report['total'])] + sorted(report['routes'].items())
+        for path, stats in rows:
+            print(f"{name:<10} {path:<20} {stats['requests']:>9} {stats['errors']:>7} "
+                  f"{stats['rps']:>9} {_format_ms(stats['p50'])} {_format_ms(stats['p95'])} "
+                  f"{_format_ms(stats['p99'])}")
+
+
+# Сравниваемые показатели: у задержек рост - ухудшение, у пропускной способности - наоборот
+COMPARED = (('rps', -1), ('p50', 1), ('p95', 1), ('p99', 1))
+
+
+def _change(before, after):
+    if before is None or after is None or not before:
+        return None
+    return (after - before) / before * 100
+
+
+def compare(reports, baseline, tolerance):
+    """Печатает изменение каждого маршрута относительно базовой линии; возвращает
+    ухудшения больше tolerance процентов"""
+    regressions = []
+    print(f"\nСравнение с базовой линией ({baseline['meta'].get('time', '?')}), изменение в %:")
+    print(f"{'сервер':<10} {'маршрут':<20} " + " ".join(f"{name:>9}" for name, _ in COMPARED))
+    for name, report in reports.items():
+        base = baseline['targets'].get(name)
+        if base is None:
+            print(f"{name:<10} нет в базовой линии")
+            continue
+        rows = [('все', report['total'], base['total'])] + [
+            (route, stats, base['routes'].get(route)) for route, stats in sorted(report['routes'].items())]
+        for route, stats, before in rows:
+            cells = []
+            for metric, sign in COMPARED:
+                change = _change(before and before[metric], stats[metric])
+                if change is None:
+                    cells.append(f"{'-':>9}")
+                    continue
+                mark = ''
+                if change * sign > tolerance:
+                    mark = '!'
+                    regressions.append((name, route, metric, change))
+                cells.append(f"{change:+8.1f}{mark or ' '}")
+            print(f"{name:<10} {route:<20} " + " ".join(cells))
+    if regressions:
+        print(f"Ухудшений больше {tolerance}%: {len(regressions)} (отмечены !)")
+    return regressions
+
+
+def _revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Пропускная способность и задержки частых страниц при высокой параллельности")
+    parser.add_argument("--target", action="append", required=True,
+                        help="имя=URL сервера, можно несколько: sync=http://127.0.0.1:8000")
+    parser.add_argument("--path", action="append", dest="paths",
+                        help=f"маршрут, можно несколько; по умолчанию {', '.join(DEFAULT_PATHS)}")
+    parser.add_argument("--manifest", help="манифест benchmarks/seed.py: вход и диапазоны id")
+    parser.add_argument("--username", help="по умолчанию - менеджер из манифеста")
+    parser.add_argument("--password", help="по умолчанию - пароль из манифеста")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--warmup", type=int, default=200, help="запросов до замера")
+    parser.add_argument("--random-seed", type=int, default=1, help="зерно последовательности запросов")
+    parser.add_argument("--json", help="сохранить результаты в файл")
+    parser.add_argument("--baseline", help="JSON прежнего прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=10,
+                        help="допустимое ухудшение показателя в процентах")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="завершиться с кодом 1 при ухудшении больше --tolerance")
+    args = parser.parse_args()
+
+    manifest = {}
+    if args.manifest:
+        with open(args.manifest, encoding='utf-8') as f:
+            manifest = json.load(f)
+    username = args.username or manifest.get('users', {}).get('manager')
+    password = args.password or manifest.get('password')
+    if not username or not password:
+        raise SystemExit("Укажите --username и --password или --manifest")
+
+    paths = args.paths or list(DEFAULT_PATHS)
+    requests = build_requests(paths, args.requests, manifest, args.random_seed)
+    reports = {}
+    for target in args.target:
+        name, _, url = target.rpartition('=')
+        name = name or url
+        url = url.rstrip('/')
+        cookie = login(url, username, password)
+        reports[name] = asyncio.run(run_load(url, requests, cookie, args.concurrency, args.requests,
+                                             args.warmup))
+    print_report(reports)
+
+    if args.json:
+        meta = {
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'revision': _revision(),
+            'python': platform.python_version(),
+            'paths': paths,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'warmup': args.warmup,
+            'random_seed': args.random_seed,
+            'seed': manifest.get('seed'),
+            'deals': manifest.get('deals', {}).get('count'),
+        }
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'meta': meta, 'targets': reports}, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(reports, baseline, args.tolerance)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Накладные расходы сбора метрик (metrics.py): стоимость одного наблюдения и время
+запроса страницы входа через тестовый клиент Flask с метриками и без них.
+
+    python benchmarks/metrics.py --requests 5000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import before_render_template, template_rendered  # noqa: E402
+
+import main  # noqa: E402
+import metrics  # noqa: E402
+
+
+def per_call(fn, repeat):
+    """Среднее время вызова в мкс"""
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def _hooks(app):
+    return ((app.before_request_funcs, metrics._before_request),
+            (app.after_request_funcs, metrics._after_request),
+            (app.teardown_request_funcs, metrics._teardown_request))
+
+
+def detach(app):
+    for funcs, fn in _hooks(app):
+        if fn in funcs.get(None, []):
+            funcs[None].remove(fn)
+    before_render_template.disconnect(metrics._template_started, app)
+    template_rendered.disconnect(metrics._template_finished, app)
+
+
+def attach(app):
+    # Как metrics.init_app, но после первого запроса (Flask запрещает регистрацию хуков)
+    for funcs, fn in _hooks(app):
+        funcs.setdefault(None, []).insert(0, fn)
+    before_render_template.connect(metrics._template_started, app)
+    template_rendered.connect(metrics._template_finished, app)
+
+
+def main_():
+    parser = argparse.ArgumentParser(description="Стоимость сбора метрик на горячем пути")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--observations", type=int, default=200000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"Наблюдение запроса к БД:    "
+          f"{per_call(lambda: metrics.observe_query('deal_details', 0.002), args.observations):.3f} мкс")
+    print(f"Наблюдение гистограммы:     "
+          f"{per_call(lambda: metrics.QUERY_DURATION.observe(('x',), 0.002), args.observations):.3f} мкс")
+
+    client = main.app.test_client()
+    request = lambda: client.get('/login')  # noqa: E731
+    # Варианты чередуются по кругам, берется лучший круг - так меньше влияет шум машины
+    best = {}
+    for _ in range(args.rounds):
+        for name, enabled, header in (("без метрик", False, False), ("с метриками", True, False),
+                                      ("и с Server-Timing", True, True)):
+            detach(main.app)
+            if enabled:
+                attach(main.app)
+            metrics.SERVER_TIMING = header
+            elapsed = per_call(request, args.requests)
+            best[name] = min(best.get(name, elapsed), elapsed)
+    base = best["без метрик"]
+    for name, elapsed in best.items():
+        print(f"GET /login {name + ':':<20} {elapsed:8.1f} мкс (+{elapsed - base:.1f})")
+
+
+if __name__ == "__main__":
+    main_()
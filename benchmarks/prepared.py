@@ -0,0 +1,115 @@
+"""Выигрыш от подготовленных запросов (queries.py) на частых запросах: карточки сделок
+и первые страницы списков. Каждый запрос выполняется текстом (разбор и планирование
+на каждом вызове) и через EXECUTE подготовленного запроса на одном соединении; для
+текстового варианта дополнительно показывается время планирования по EXPLAIN ANALYZE.
+
+    python benchmarks/prepared.py --repeat 2000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import deal_filters  # noqa: E402
+import queries  # noqa: E402
+
+
+def sample_ids(cur, table, count):
+    cur.execute(f"SELECT id FROM {table} ORDER BY random() LIMIT %s", (count,))
+    ids = [row[0] for row in cur.fetchall()]
+    if not ids:
+        raise SystemExit(f"В таблице {table} нет строк - заполните базу (seed)")
+    return ids
+
+
+def cases(cur, count, per_page):
+    deal_ids = sample_ids(cur, 'deals_managers', count)
+    expert_deal_ids = sample_ids(cur, 'deals_expert', count)
+    deals_page, deals_params, _ = db.deals_keyset_query(per_page)
+    status_page, status_params, _ = db.deals_keyset_query(
+        per_page, filters={'status': deal_filters.DEAL_STATUSES[0]})
+    expert_page, expert_params, _ = db.expert_deals_keyset_query(per_page)
+    return [
+        ("карточка сделки", db.DEAL_DETAILS_QUERY, lambda: (random.choice(deal_ids),)),
+        ("карточка сделки эксперта", db.EXPERT_DEAL_DETAILS_QUERY,
+         lambda: (random.choice(expert_deal_ids),)),
+        ("список сделок", queries.dynamic("deals_page", deals_page), lambda: deals_params),
+        ("список сделок по статусу", queries.dynamic("deals_page", status_page),
+         lambda: status_params),
+        ("список сделок эксперта", queries.dynamic("expert_deals_page", expert_page),
+         lambda: expert_params),
+    ]
+
+
+def run_text(cur, query, params):
+    cur.execute(query.sql, params)
+    cur.fetchall()
+
+
+def run_prepared(cur, query, params):
+    queries.execute(cur, query, params)
+    cur.fetchall()
+
+
+def timed(run, cur, query, make_params, repeat):
+    """Среднее время одного вызова в мкс, от отправки запроса до получения всех строк"""
+    run(cur, query, make_params())
+    started = time.perf_counter()
+    for _ in range(repeat):
+        run(cur, query, make_params())
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def planning_share(cur, query, make_params, repeat=50):
+    """Среднее время планирования и выполнения на сервере по EXPLAIN ANALYZE, мс"""
+    planning = execution = 0.0
+    for _ in range(repeat):
+        sql = cur.mogrify(query.sql, make_params()).decode()
+        cur.execute("EXPLAIN (ANALYZE, SUMMARY, FORMAT JSON) " + sql)
+        plan = cur.fetchone()[0]
+        plan = plan if isinstance(plan, list) else json.loads(plan)
+        planning += plan[0]["Planning Time"]
+        execution += plan[0]["Execution Time"]
+    return planning / repeat, execution / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Текстовые запросы против подготовленных (PREPARE/EXECUTE) на частых запросах")
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--ids", type=int, default=500, help="сколько случайных сделок опрашивать")
+    parser.add_argument("--per-page", type=int, default=10)
+    args = parser.parse_args()
+
+    pool = db.get_pool()
+    conn = pool.getconn()
+    # Каждый запрос - отдельная транзакция, как у страницы приложения
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            print(f"{'запрос':<28} {'текстом':>12} {'EXECUTE':>12} {'выигрыш':>9} "
+                  f"{'план, мс':>9} {'выполн., мс':>12}")
+            for title, query, make_params in cases(cur, args.ids, args.per_page):
+                text = timed(run_text, cur, query, make_params, args.repeat)
+                prepared = timed(run_prepared, cur, query, make_params, args.repeat)
+                planning, execution = planning_share(cur, query, make_params)
+                print(f"{title:<28} {text:8.1f} мкс {prepared:8.1f} мкс {1 - prepared / text:8.0%} "
+                      f"{planning:9.3f} {execution:12.3f}")
+    finally:
+        conn.autocommit = False
+        pool.putconn(conn)
+
+    print()
+    print("Статистика реестра:")
+    for item in queries.stats()["queries"]:
+        print(f"  {item['name']:<36} вызовов {item['calls']:>7}, подготовок {item['prepares']}, "
+              f"в среднем {item['mean_ms']:.3f} мс, максимум {item['max_ms']:.3f} мс")
+
+
+if __name__ == "__main__":
+    main()
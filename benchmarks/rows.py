@@ -0,0 +1,133 @@
+import argparse
+import datetime
+import os
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rows  # noqa: E402
+
+LIST_COLUMNS = ('id', 'date_first_contact', 'manager_name', 'client_name', 'car_brand', 'status',
+                'amount_financing', 'm_plan_ship')
+DETAIL_COLUMNS = (
+    'id', 'date_first_contact', 'manager_name', 'client_name', 'unp', 'car_brand', 'sales_car',
+    'skp_or_bl', 'status', 'shipment_or_signing', 'prepayment', 'contract_term',
+    'currency_contract', 'interest_rate', 'use_number_cert', 'use_date_cert',
+    'issued_number_cert', 'issued_date_cert', 'express', 'electric_car', 'amount_financing',
+    'm_plan_ship', 'description', 'sales_channel', 'name_agent', 'id_users', 'id_client',
+)
+# Порядок полей, в котором view_deal раньше собирал кортеж для шаблона
+VIEW_TUPLE_FIELDS = (
+    'id', 'date_first_contact', 'manager_name', 'client_name', 'car_brand', 'sales_car',
+    'skp_or_bl', 'status', 'shipment_or_signing', 'prepayment', 'contract_term',
+    'currency_contract', 'interest_rate', 'use_number_cert', 'use_date_cert',
+    'issued_number_cert', 'issued_date_cert', 'express', 'electric_car', 'amount_financing',
+    'm_plan_ship', 'description', 'sales_channel', 'name_agent', 'unp',
+)
+
+
+def _description(columns):
+    # Как cursor.description psycopg2: кортеж на колонку, имя первым элементом
+    return [(name, None, None, None, None, None, None) for name in columns]
+
+
+def _value(name, i):
+    if name == 'id' or name.startswith('id_'):
+        return i
+    if 'date' in name or name == 'm_plan_ship':
+        return datetime.date(2024, 1, 1) + datetime.timedelta(days=i)
+    if name in ('amount_financing', 'interest_rate'):
+        return Decimal(100000 + i)
+    if name in ('express', 'electric_car'):
+        return bool(i % 2)
+    return f"{name} {i}"
+
+
+def fetched(columns, count):
+    return [tuple(_value(name, i) for name in columns) for i in range(count)]
+
+
+def list_as_dicts(description, fetched_rows):
+    columns = [desc[0] for desc in description]
+    return [dict(zip(columns, row)) for row in fetched_rows]
+
+
+def list_as_records(description, fetched_rows):
+    make = rows.record_class(tuple(desc[0] for desc in description))._make
+    return list(map(make, fetched_rows))
+
+
+def detail_before(description, row):
+    """Прежний путь страницы сделки: словарь из строки, копия из кэша, кортеж для шаблона"""
+    columns = [desc[0] for desc in description]
+    deal = dict(zip(columns, row))
+    deal = dict(deal)
+    return tuple(deal[name] for name in VIEW_TUPLE_FIELDS)
+
+
+def detail_after(description, row):
+    return rows.record_class(tuple(desc[0] for desc in description))._make(row)
+
+
+def measure(build, args, repeat):
+    """Время построения одной страницы в мкс, пик выделенной при этом памяти и память,
+    которую занимает готовая страница, в байтах"""
+    build(*args)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        build(*args)
+    elapsed = (time.perf_counter() - started) / repeat * 1e6
+
+    tracemalloc.start()
+    peaks = []
+    for _ in range(100):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        build(*args)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    kept = []
+    before = tracemalloc.get_traced_memory()[0]
+    for _ in range(1000):
+        kept.append(build(*args))
+    retained = (tracemalloc.get_traced_memory()[0] - before) / 1000
+    tracemalloc.stop()
+    return elapsed, min(peaks), retained
+
+
+def report(title, variants, repeat):
+    print(title)
+    print(f"  {'':<28} {'время':>12} {'пик памяти':>14} {'страница':>14}")
+    for name, build, args in variants:
+        elapsed, peak, retained = measure(build, args, repeat)
+        print(f"  {name:<28} {elapsed:8.2f} мкс {peak:9.0f} байт {retained:9.0f} байт")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Стоимость представления строк результата: словари и кортежи против записей rows")
+    parser.add_argument("--per-page", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    list_description = _description(LIST_COLUMNS)
+    list_rows = fetched(LIST_COLUMNS, args.per_page)
+    detail_description = _description(DETAIL_COLUMNS)
+    detail_row = fetched(DETAIL_COLUMNS, 1)[0]
+
+    report(f"Список, {args.per_page} строк x {len(LIST_COLUMNS)} колонок:", [
+        ("словари dict(zip(...))", list_as_dicts, (list_description, list_rows)),
+        ("записи rows.RecordCursor", list_as_records, (list_description, list_rows)),
+    ], args.repeat // 10)
+    report(f"Карточка сделки, {len(DETAIL_COLUMNS)} колонок:", [
+        ("dict + копия + кортеж", detail_before, (detail_description, detail_row)),
+        ("запись rows.RecordCursor", detail_after, (detail_description, detail_row)),
+    ], args.repeat)
+    print("Списки сделок раньше отдавали кортежи psycopg2: запись - тот же кортеж, "
+          "копия строки стоит одного выделения памяти на строку.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import schedule  # noqa: E402
+
+
+def python_totals(amount, annual_rate, months, commission=0.0):
+    """Тот же расчет, что schedule.batch_totals, циклом Python для одной сделки"""
+    rate = annual_rate / 1200
+    balance = amount
+    if rate:
+        pmt = amount * rate / (1 - (1 + rate) ** -months)
+    else:
+        pmt = amount / months
+    flows = [-amount * (1 - commission / 100)]
+    total_interest = 0.0
+    for _ in range(months):
+        interest = balance * rate
+        balance -= pmt - interest
+        total_interest += interest
+        flows.append(pmt)
+
+    monthly = rate or 0.01
+    for _ in range(schedule.IRR_ITERATIONS):
+        value = sum(flow / (1 + monthly) ** t for t, flow in enumerate(flows))
+        derivative = sum(-t * flow / (1 + monthly) ** (t + 1) for t, flow in enumerate(flows))
+        step = value / derivative
+        monthly -= step
+        if abs(step) < schedule.IRR_TOLERANCE:
+            break
+    return pmt, pmt * months, total_interest, (1 + monthly) ** 12 - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Сравнение пакетного расчета графиков (NumPy) с циклом Python по сделкам")
+    parser.add_argument("--deals", type=int, default=5000)
+    parser.add_argument("--commission", type=float, default=1.0)
+    args = parser.parse_args()
+
+    random.seed(1)
+    amounts = [random.uniform(10_000, 500_000) for _ in range(args.deals)]
+    rates = [random.uniform(5, 25) for _ in range(args.deals)]
+    terms = [random.choice((12, 24, 36, 48, 60)) for _ in range(args.deals)]
+
+    started = time.perf_counter()
+    batch = schedule.batch_totals(amounts, rates, terms, commission=args.commission)
+    batch_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    loop = [python_totals(*deal, args.commission) for deal in zip(amounts, rates, terms)]
+    loop_time = time.perf_counter() - started
+
+    max_diff = max(abs(batch['irr'][i] - loop[i][3]) for i in range(args.deals))
+    print(f"Сделок: {args.deals}")
+    print(f"NumPy пакетом: {batch_time * 1000:10.1f} мс")
+    print(f"Цикл Python:   {loop_time * 1000:10.1f} мс")
+    print(f"Ускорение:     {loop_time / batch_time:10.1f}x")
+    print(f"Макс. расхождение IRR: {max_diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""Наполняет локальную базу синтетическими данными для замеров: пользователи всех
+ролей, клиенты с уникальными УНП, сделки менеджеров и записи экспертов по части из них.
+Строки генерируются пачками и загружаются через COPY: генерация идет со скоростью
+порядка 10 тыс. сделок в секунду, и 10 млн сделок загружаются за десятки минут, а не
+за часы построчных INSERT.
+
+Данные воспроизводимы: при одинаковых --seed и объеме получаются те же строки.
+Описание загруженного (имена пользователей, пароль, диапазоны id) сохраняется в
+--manifest; его читает benchmarks/loadtest.py.
+
+    python migrate.py
+    python benchmarks/seed.py --deals 1000000 --password secret --manifest seed.json
+
+Идентификаторы резервируются сдвигом последовательностей, поэтому во время наполнения
+приложение не должно создавать строки в тех же таблицах.
+"""
+import argparse
+import csv
+import datetime
+import io
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+import analytics  # noqa: E402
+import auth  # noqa: E402
+import db  # noqa: E402
+import deal_filters  # noqa: E402
+
+# Строк в одном COPY
+BATCH_SIZE = 50000
+
+USER_COLUMNS = ['id', 'username', 'full_name', 'password_hash', 'role']
+CLIENT_COLUMNS = ['id', 'name', 'unp', 'contact_person', 'contact_phone', 'contact_email',
+                  'created_at', 'updated_at']
+DEAL_COLUMNS = [
+    'id', 'date_first_contact', 'id_users', 'id_client', 'car_brand', 'sales_car', 'skp_or_bl',
+    'status', 'shipment_or_signing', 'prepayment', 'contract_term', 'currency_contract',
+    'interest_rate', 'use_number_cert', 'use_date_cert', 'issued_number_cert', 'issued_date_cert',
+    'express', 'electric_car', 'amount_financing', 'm_plan_ship', 'description', 'sales_channel',
+    'name_agent', 'created_at', 'updated_at',
+]
+EXPERT_DEAL_COLUMNS = [
+    'id', 'id_manager_deal', 'date_appearance', 'id_manager', 'id_client', 'car_brand',
+    'sales_car', 'skp_or_bl', 'shipment_or_signing', 'prepayment', 'contract_term',
+    'currency_contract', 'interest_rate', 'use_number_cert', 'use_date_cert', 'express',
+    'original_or_skan', 'electric_car', 'solution_owner', 'date_for_ce', 'status', 'id_ce',
+    'amount_financing', 'date_credit_committee', 'date_protocol', 'date_signing_contract',
+    'shipping_date', 'expert_comment', 'created_at', 'updated_at',
+]
+
+FIRST_NAMES = ['Александр', 'Дмитрий', 'Сергей', 'Андрей', 'Алексей', 'Максим', 'Иван',
+               'Анна', 'Елена', 'Ольга', 'Татьяна', 'Наталья', 'Мария', 'Юлия']
+LAST_NAMES = ['Иванов', 'Петров', 'Сидоров', 'Козлов', 'Новиков', 'Морозов', 'Волков',
+              'Соколов', 'Лебедев', 'Ковалев', 'Кузнецов', 'Попов', 'Васильев', 'Зайцев']
+COMPANY_FORMS = ['ООО', 'ОАО', 'ЗАО', 'ЧУП', 'ИП', 'УП']
+COMPANY_WORDS = ['Авто', 'Транс', 'Строй', 'Логистик', 'Агро', 'Мед', 'Техно', 'Бел', 'Торг',
+                 'Сервис', 'Инвест', 'Пром', 'Энерго', 'Маш', 'Фуд', 'Лес']
+# (марка, модели, доля электромобилей)
+CARS = [
+    ('Volkswagen', ['Polo', 'Tiguan', 'Passat', 'Crafter'], 0.05),
+    ('Toyota', ['Camry', 'RAV4', 'Land Cruiser', 'Hilux'], 0.02),
+    ('Geely', ['Atlas', 'Coolray', 'Monjaro', 'Tugella'], 0.1),
+    ('Skoda', ['Octavia', 'Kodiaq', 'Superb'], 0.03),
+    ('MAN', ['TGS', 'TGX'], 0.0),
+    ('Tesla', ['Model 3', 'Model Y'], 1.0),
+    ('BMW', ['X5', '5 Series', 'iX3'], 0.2),
+    ('Haval', ['Jolion', 'F7', 'Dargo'], 0.0),
+]
+SALES_CHANNELS = ['Дилер', 'Сайт', 'Повторный клиент', 'Агент', 'Выставка', None]
+# Доли статусов сделок менеджеров и экспертов
+DEAL_STATUS_WEIGHTS = [0.3, 0.1, 0.1, 0.3, 0.2]
+EXPERT_STATUS_WEIGHTS = [0.35, 0.35, 0.15, 0.15]
+CURRENCY_WEIGHTS = [0.6, 0.2, 0.15, 0.05]
+
+
+def reserve_ids(cur, table, count):
+    """Сдвигает последовательность id таблицы на count и возвращает первый id диапазона"""
+    cur.execute("SELECT pg_get_serial_sequence(%s, 'id')", (table,))
+    sequence = cur.fetchone()[0]
+    cur.execute("SELECT nextval(%s)", (sequence,))
+    first = cur.fetchone()[0]
+    cur.execute("SELECT setval(%s, %s)", (sequence, first + count - 1))
+    return first
+
+
+def _value(value):
+    if value is None:
+        return ''
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    return value
+
+
+class Copier:
+    """Накапливает строки CSV и отправляет их в таблицу через COPY пачками"""
+
+    def __init__(self, cur, table, columns):
+        self.cur = cur
+        self.sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.pending = 0
+        self.total = 0
+
+    def add(self, row):
+        self.writer.writerow([_value(value) for value in row])
+        self.pending += 1
+        if self.pending >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        self.buffer.seek(0)
+        self.cur.copy_expert(self.sql, self.buffer)
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.total += self.pending
+        self.pending = 0
+
+
+def _person(rng):
+    return f"{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)}"
+
+
+def _moment(rng, start, days):
+    return start + datetime.timedelta(seconds=rng.randrange(days * 86400))
+
+
+def seed_users(cur, counts, password_hash, rng):
+    """Создает пользователей по ролям; возвращает {роль: [id]} и {роль: имя первого}"""
+    first_id = reserve_ids(cur, 'users', sum(counts.values()))
+    copier = Copier(cur, 'users', USER_COLUMNS)
+    ids = {}
+    logins = {}
+    user_id = first_id
+    for role, count in counts.items():
+        # Повторное наполнение той же базы продолжает нумерацию имен
+        cur.execute("SELECT COUNT(1) FROM users WHERE username LIKE %s", (f"seed\\_{role}\\_%",))
+        offset = cur.fetchone()[0]
+        for number in range(count):
+            username = f"seed_{role}_{offset + number + 1}"
+            copier.add((user_id, username, _person(rng), password_hash, role))
+            ids.setdefault(role, []).append(user_id)
+            logins.setdefault(role, username)
+            user_id += 1
+    copier.flush()
+    return ids, logins
+
+
+def next_unp(cur):
+    """Первый свободный девятизначный УНП после уже занятых"""
+    cur.execute("SELECT MAX(unp::bigint) FROM clients WHERE unp ~ '^[0-9]{9}$'")
+    return max((cur.fetchone()[0] or 0) + 1, 100000001)
+
+
+def seed_clients(cur, count, rng, start):
+    first_id = reserve_ids(cur, 'clients', count)
+    unp = next_unp(cur)
+    if unp + count > 999999999:
+        raise SystemExit("Не хватает девятизначных УНП для такого числа клиентов")
+    copier = Copier(cur, 'clients', CLIENT_COLUMNS)
+    for number in range(count):
+        created = _moment(rng, start, 3 * 365)
+        name = (f"{rng.choice(COMPANY_FORMS)} «{rng.choice(COMPANY_WORDS)}"
+                f"{rng.choice(COMPANY_WORDS).lower()}-{number + 1}»")
+        copier.add((
+            first_id + number, name, f"{unp + number:09d}", _person(rng),
+            f"+375 ({rng.choice((25, 29, 33, 44))}) {rng.randrange(1000000, 9999999)}",
+            f"info{unp + number}@example.by", created, created,
+        ))
+    copier.flush()
+    return first_id, f"{unp:09d}"
+
+
+def deal_row(rng, deal_id, manager_id, client_id, start):
+    brand, models, electric_share = rng.choice(CARS)
+    contact = _moment(rng, start, 3 * 365)
+    currency = rng.choices(deal_filters.CURRENCIES, CURRENCY_WEIGHTS)[0]
+    # Сумма финансирования: в основном десятки тысяч, с длинным хвостом
+    amount = round(rng.lognormvariate(11, 0.8), 2)
+    has_cert = rng.random() < 0.3
+    return (
+        deal_id, contact, manager_id, client_id, brand, rng.choice(models),
+        rng.choice(('СКП', 'БЛ', 'СКП/БЛ', None)),
+        rng.choices(deal_filters.DEAL_STATUSES, DEAL_STATUS_WEIGHTS)[0],
+        rng.choice(('Отгрузка', 'Подписание', None)),
+        rng.choice(('10%', '20%', '30%', 'Без аванса', None)),
+        rng.choice((12, 24, 36, 48, 60)), currency, round(rng.uniform(5, 25), 2),
+        rng.randrange(1, 100000) if has_cert else None,
+        (contact + datetime.timedelta(days=rng.randrange(30))).date() if has_cert else None,
+        rng.randrange(1, 100000) if has_cert else None,
+        (contact + datetime.timedelta(days=rng.randrange(60))).date() if has_cert else None,
+        rng.random() < 0.1, rng.random() < electric_share, amount,
+        (contact + datetime.timedelta(days=rng.randrange(15, 180))).date(),
+        "Синтетическая сделка" if rng.random() < 0.2 else None,
+        rng.choice(SALES_CHANNELS), _person(rng) if rng.random() < 0.15 else None,
+        contact, contact,
+    )
+
+
+def expert_row(rng, expert_deal_id, deal, expert_ids):
+    (deal_id, contact, manager_id, client_id, brand, model, skp_or_bl, _, shipment, prepayment,
+     term, currency, rate, cert_number, cert_date, _, _, express, electric, amount) = deal[:20]
+    appearance = contact + datetime.timedelta(days=rng.randrange(1, 30))
+    status = rng.choices(deal_filters.EXPERT_DEAL_STATUSES, EXPERT_STATUS_WEIGHTS)[0]
+    # Каждая десятая запись еще не назначена эксперту
+    expert_id = rng.choice(expert_ids) if rng.random() < 0.9 else None
+    for_ce = appearance + datetime.timedelta(days=rng.randrange(1, 10))
+    committee = for_ce + datetime.timedelta(days=rng.randrange(1, 20)) if status != 'На рассмотрении' else None
+    approved = status == 'Одобрено'
+    signing = committee + datetime.timedelta(days=rng.randrange(1, 15)) if approved else None
+    shipping = signing + datetime.timedelta(days=rng.randrange(1, 60)) if approved else None
+    return (
+        expert_deal_id, deal_id, appearance, manager_id, client_id, brand, model, skp_or_bl,
+        shipment, prepayment, term, currency, rate, cert_number, cert_date, express,
+        rng.choice(('Оригинал', 'Скан', None)), electric,
+        _person(rng) if committee else None, for_ce, status, expert_id, amount, committee,
+        committee, signing, shipping, "Синтетическая запись" if rng.random() < 0.2 else None,
+        appearance, appearance,
+    )
+
+
+def seed_deals(cur, count, expert_share, rng, start, manager_ids, expert_ids, first_client,
+               clients):
+    """Сделки менеджеров и записи экспертов по доле из них; возвращает первые id"""
+    first_deal = reserve_ids(cur, 'deals_managers', count)
+    expert_count = int(count * expert_share)
+    first_expert = reserve_ids(cur, 'deals_expert', expert_count) if expert_count else None
+    deals = Copier(cur, 'deals_managers', DEAL_COLUMNS)
+    experts = Copier(cur, 'deals_expert', EXPERT_DEAL_COLUMNS)
+    started = time.perf_counter()
+    for number in range(count):
+        # Постоянные клиенты: у каждого сотого клиента - почти треть всех сделок
+        if rng.random() < 0.3:
+            client_id = first_client + rng.randrange(max(clients // 100, 1))
+        else:
+            client_id = first_client + rng.randrange(clients)
+        deal = deal_row(rng, first_deal + number, rng.choice(manager_ids), client_id, start)
+        deals.add(deal)
+        if experts.total + experts.pending < expert_count and \
+                rng.random() < expert_share * 1.05:
+            # Запись эксперта ссылается на сделку, поэтому пачка сделок уходит первой
+            if experts.pending + 1 >= BATCH_SIZE:
+                deals.flush()
+            experts.add(expert_row(rng, first_expert + experts.total + experts.pending, deal,
+                                   expert_ids))
+        if (number + 1) % (BATCH_SIZE * 4) == 0:
+            rate = (number + 1) / (time.perf_counter() - started)
+            print(f"  сделок: {number + 1} из {count} ({rate:.0f} в секунду)")
+    deals.flush()
+    experts.flush()
+    # Доля могла не добрать до зарезервированного числа - лишние id остаются пропуском
+    return first_deal, first_expert, experts.total
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Синтетические пользователи, клиенты и сделки через COPY (от 10 тыс. до "
+                    "10 млн сделок)")
+    parser.add_argument("--deals", type=int, default=10000, help="сделок менеджеров")
+    parser.add_argument("--clients", type=int, help="клиентов; по умолчанию сделок / 4")
+    parser.add_argument("--managers", type=int, help="менеджеров; по умолчанию сделок / 5000")
+    parser.add_argument("--experts", type=int, help="экспертов; по умолчанию менеджеров / 3")
+    parser.add_argument("--expert-share", type=float, default=0.6,
+                        help="доля сделок, переданных эксперту")
+    parser.add_argument("--password", required=True, help="пароль всех созданных пользователей")
+    parser.add_argument("--seed", type=int, default=1, help="зерно генератора")
+    parser.add_argument("--manifest", help="сохранить описание загруженных данных в JSON")
+    parser.add_argument("--no-analyze", action="store_true",
+                        help="не обновлять статистику и аналитические представления")
+    args = parser.parse_args()
+
+    if args.deals < 1 or not 0 <= args.expert_share <= 1:
+        raise SystemExit("Некорректный объем данных")
+    clients = args.clients or max(args.deals // 4, 1)
+    managers = args.managers or max(args.deals // 5000, 5)
+    experts = args.experts or max(managers // 3, 2)
+    counts = {'manager': managers, 'expert': experts, 'accountant': 2, 'boss': 1}
+    rng = random.Random(args.seed)
+    start = datetime.datetime(2023, 1, 1)
+
+    started = time.perf_counter()
+    password_hash = generate_password_hash(args.password, auth.HASH_METHOD)
+    # Каждая таблица - в своей транзакции; при ошибке уже загруженное остается
+    with db.unit_of_work(), db.connect_db() as conn, conn.cursor() as cur:
+        user_ids, logins = seed_users(cur, counts, password_hash, rng)
+    print(f"Пользователей: {sum(counts.values())}")
+    with db.unit_of_work(), db.connect_db() as conn, conn.cursor() as cur:
+        first_client, first_unp = seed_clients(cur, clients, rng, start)
+    print(f"Клиентов: {clients}")
+    with db.unit_of_work(), db.connect_db() as conn, conn.cursor() as cur:
+        first_deal, first_expert, expert_count = seed_deals(
+            cur, args.deals, args.expert_share, rng, start, user_ids['manager'],
+            user_ids['expert'], first_client, clients)
+    print(f"Сделок: {args.deals}, записей экспертов: {expert_count}")
+
+    if not args.no_analyze:
+        with db.unit_of_work(), db.connect_db() as conn, conn.cursor() as cur:
+            cur.execute("ANALYZE users, clients, deals_managers, deals_expert")
+        analytics.refresh_views(concurrently=False)
+    print(f"Готово за {time.perf_counter() - started:.1f} с")
+
+    if args.manifest:
+        manifest = {
+            'seed': args.seed,
+            'password': args.password,
+            'users': logins,
+            'clients': {'first_id': first_client, 'count': clients, 'first_unp': first_unp},
+            'deals': {'first_id': first_deal, 'count': args.deals},
+            'expert_deals': {'first_id': first_expert, 'count': expert_count},
+        }
+        with open(args.manifest, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
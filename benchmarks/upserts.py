@@ -0,0 +1,117 @@
+"""Проверка атомарных upsert при гонке: много потоков одновременно вызывают
+db.get_or_create_client с одним УНП и db.update_or_create_expert_deal с одной сделкой
+менеджера. После каждого раунда должен остаться ровно один клиент и одна запись эксперта,
+все потоки должны получить один id клиента, и ни один вызов не должен упасть.
+
+    python benchmarks/upserts.py --threads 16 --rounds 50
+
+Создает и в конце удаляет клиентов с УНП на MARKER и сделки с car_brand = MARKER.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+MARKER = "upsert-check"
+CREATED_MESSAGE = "Сделка успешно передана эксперту"
+
+
+def expert_fields(manager_deal_id, client_id, thread):
+    return {
+        'id_manager_deal': manager_deal_id, 'id_manager': None, 'id_client': client_id,
+        'car_brand': MARKER, 'sales_car': f"поток {thread}", 'skp_or_bl': None,
+        'shipment_or_signing': None, 'prepayment': None, 'contract_term': 12 + thread,
+        'currency_contract': 'BYN', 'interest_rate': None, 'use_number_cert': None,
+        'use_date_cert': None, 'express': False, 'electric_car': False,
+        'status': 'На рассмотрении',
+    }
+
+
+def run_round(number, threads):
+    """Один раунд: все потоки стартуют по барьеру с одинаковыми ключами"""
+    unp = f"{MARKER}-{number}"
+    with db.connect_db() as conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO deals_managers (car_brand) VALUES (%s) RETURNING id", (MARKER,))
+        manager_deal_id = cur.fetchone()[0]
+
+    barrier = threading.Barrier(threads)
+    client_ids = []
+    messages = []
+    errors = []
+
+    def worker(thread):
+        try:
+            barrier.wait()
+            client_id = db.get_or_create_client(f"{MARKER} {thread}", unp)
+            client_ids.append(client_id)
+            barrier.wait()
+            result = db.update_or_create_expert_deal(**expert_fields(manager_deal_id, client_id, thread))
+            messages.append(result['message'])
+        except Exception as e:
+            errors.append(f"поток {thread}: {e!r}")
+            barrier.abort()
+
+    workers = [threading.Thread(target=worker, args=(thread,)) for thread in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    with db.connect_db() as conn, conn.cursor() as cur:
+        cur.execute("SELECT COUNT(1) FROM clients WHERE unp = %s", (unp,))
+        clients = cur.fetchone()[0]
+        cur.execute("SELECT COUNT(1) FROM deals_expert WHERE id_manager_deal = %s", (manager_deal_id,))
+        expert_deals = cur.fetchone()[0]
+
+    problems = list(errors)
+    if clients != 1:
+        problems.append(f"клиентов с УНП {unp}: {clients}")
+    if len(set(client_ids)) != 1:
+        problems.append(f"потоки получили разные id клиента: {sorted(set(client_ids))}")
+    if expert_deals != 1:
+        problems.append(f"записей эксперта по сделке {manager_deal_id}: {expert_deals}")
+    if messages.count(CREATED_MESSAGE) != 1:
+        problems.append(f"вставок записи эксперта: {messages.count(CREATED_MESSAGE)}")
+    return problems
+
+
+def cleanup():
+    with db.connect_db() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM deals_expert WHERE car_brand = %s", (MARKER,))
+        cur.execute("DELETE FROM deals_managers WHERE car_brand = %s", (MARKER,))
+        cur.execute("DELETE FROM clients WHERE unp LIKE %s", (f"{MARKER}-%",))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Параллельные вызовы get_or_create_client и update_or_create_expert_deal "
+                    "с одинаковыми ключами: без дубликатов и без ошибок")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    cleanup()
+    failed = 0
+    started = time.perf_counter()
+    try:
+        for number in range(args.rounds):
+            problems = run_round(number, args.threads)
+            if problems:
+                failed += 1
+                print(f"Раунд {number}:")
+                for problem in problems[:10]:
+                    print(f"   {problem}")
+    finally:
+        cleanup()
+    print(f"{args.rounds} раундов по {args.threads} потоков за {time.perf_counter() - started:.1f} с, "
+          f"с ошибками: {failed}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+import argparse
+import csv
+import datetime
+import io
+import itertools
+import os
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+import db
+
+try:
+    import openpyxl
+except ImportError:  # XLSX поддерживается только при установленном openpyxl
+    openpyxl = None
+
+# Сколько строк копировать в промежуточную таблицу за один COPY
+BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 5000))
+
+# Колонки промежуточной таблицы в порядке COPY
+STAGING_COLUMNS = [
+    'row_no', 'id_users', 'name_client', 'unp_client', 'date_first_contact', 'car_brand',
+    'sales_car', 'skp_or_bl', 'status', 'shipment_or_signing', 'prepayment', 'contract_term',
+    'currency_contract', 'interest_rate', 'use_number_cert', 'use_date_cert',
+    'issued_number_cert', 'issued_date_cert', 'express', 'electric_car', 'amount_financing',
+    'm_plan_ship', 'description', 'sales_channel', 'name_agent',
+]
+
+TEXT_FIELDS = {
+    'name_client': 150, 'unp_client': 18, 'car_brand': 150, 'sales_car': 150,
+    'skp_or_bl': 10, 'status': 50, 'shipment_or_signing': 10, 'prepayment': 50,
+    'currency_contract': 10, 'description': None, 'sales_channel': 150, 'name_agent': 150,
+}
+INT_FIELDS = ('contract_term', 'use_number_cert', 'issued_number_cert')
+# Предел по модулю для колонок NUMERIC(5, 2) и NUMERIC(15, 2)
+DECIMAL_FIELDS = {'interest_rate': Decimal('1000'), 'amount_financing': Decimal('1e13')}
+CENT = Decimal('0.01')
+DATE_FIELDS = ('use_date_cert', 'issued_date_cert', 'm_plan_ship')
+BOOL_FIELDS = ('express', 'electric_car')
+
+TRUE_VALUES = {'1', 'true', 'yes', 'on', 'да', '+'}
+FALSE_VALUES = {'0', 'false', 'no', 'off', 'нет', '-'}
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y')
+DATETIME_FORMATS = (
+    '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%d.%m.%Y %H:%M', '%Y-%m-%d', '%d.%m.%Y',
+)
+
+
+def read_rows(stream, filename):
+    """Построчно читает CSV или XLSX; выдает (номер строки в файле, словарь по заголовку)"""
+    if filename.lower().endswith('.xlsx'):
+        if openpyxl is None:
+            raise ValueError("Для импорта XLSX установите пакет openpyxl")
+        workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+    else:
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        first_line = text.readline()
+        # Excel с русской локалью сохраняет CSV с разделителем ";"
+        delimiter = max(',;\t', key=first_line.count)
+        rows = csv.reader(itertools.chain([first_line], text), delimiter=delimiter)
+
+    header = next(rows, None)
+    if not header:
+        raise ValueError("Файл пуст")
+    header = [str(name or '').strip().lower() for name in header]
+    for row_no, values in enumerate(rows, start=2):
+        if not any(value not in (None, '') for value in values):
+            continue
+        yield row_no, dict(zip(header, values))
+
+
+def _clean(value):
+    if isinstance(value, str):
+        value = value.strip()
+    return None if value in (None, '') else value
+
+
+def _parse_date(value, formats):
+    if isinstance(value, datetime.datetime):
+        return value if formats is DATETIME_FORMATS else value.date()
+    if isinstance(value, datetime.date):
+        return value
+    for fmt in formats:
+        try:
+            parsed = datetime.datetime.strptime(str(value), fmt)
+        except ValueError:
+            continue
+        return parsed if formats is DATETIME_FORMATS else parsed.date()
+    raise ValueError
+
+
+def validate_row(raw, default_user_id, users):
+    """Проверяет строку файла; возвращает (значения для промежуточной таблицы, ошибки)"""
+    errors = []
+    row = {}
+
+    for field, max_length in TEXT_FIELDS.items():
+        value = _clean(raw.get(field))
+        if isinstance(value, float) and value.is_integer():
+            # Числовые ячейки XLSX (например, УНП) приходят как float
+            value = int(value)
+        if value is not None:
+            value = str(value)
+            if max_length and len(value) > max_length:
+                errors.append(f"{field}: длиннее {max_length} символов")
+        row[field] = value
+
+    if not row['name_client'] or not row['unp_client']:
+        errors.append("УНП и Наименование клиента обязательны для заполнения")
+    row['status'] = row['status'] or 'Согласование условий'
+    row['currency_contract'] = row['currency_contract'] or 'BYN'
+
+    for field in INT_FIELDS:
+        value = _clean(raw.get(field))
+        try:
+            row[field] = None if value is None else int(Decimal(str(value)))
+        except (InvalidOperation, ValueError):
+            errors.append(f"{field}: ожидается целое число")
+
+    for field, limit in DECIMAL_FIELDS.items():
+        value = _clean(raw.get(field))
+        try:
+            row[field] = None if value is None else Decimal(str(value).replace(',', '.').replace(' ', ''))
+            if row[field] is not None and not row[field].is_finite():
+                raise InvalidOperation
+        except InvalidOperation:
+            errors.append(f"{field}: ожидается число")
+            continue
+        if row[field] is not None and abs(row[field]) < limit:
+            # Postgres округлит до копеек (999.995 -> 1000.00), с пределом
+            # сравнивается уже округленное значение
+            row[field] = row[field].quantize(CENT, ROUND_HALF_UP)
+        if row[field] is not None and abs(row[field]) >= limit:
+            errors.append(f"{field}: значение вне допустимого диапазона")
+
+    for field in DATE_FIELDS:
+        value = _clean(raw.get(field))
+        try:
+            row[field] = None if value is None else _parse_date(value, DATE_FORMATS)
+        except ValueError:
+            errors.append(f"{field}: ожидается дата ГГГГ-ММ-ДД или ДД.ММ.ГГГГ")
+
+    value = _clean(raw.get('date_first_contact'))
+    try:
+        row['date_first_contact'] = None if value is None else _parse_date(value, DATETIME_FORMATS)
+    except ValueError:
+        errors.append("date_first_contact: ожидается дата и время ГГГГ-ММ-ДД ЧЧ:ММ")
+
+    for field in BOOL_FIELDS:
+        value = _clean(raw.get(field))
+        if value is None or value is False or str(value).lower() in FALSE_VALUES:
+            row[field] = False
+        elif value is True or str(value).lower() in TRUE_VALUES:
+            row[field] = True
+        else:
+            errors.append(f"{field}: ожидается да/нет")
+
+    manager = _clean(raw.get('manager'))
+    if manager is None:
+        row['id_users'] = default_user_id
+    elif str(manager) in users:
+        row['id_users'] = users[str(manager)]
+    else:
+        errors.append(f"manager: пользователь {manager} не найден")
+
+    return row, errors
+
+
+def _copy_batch(cur, buffer):
+    buffer.seek(0)
+    cur.copy_expert(
+        f"COPY import_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+        buffer,
+    )
+    buffer.seek(0)
+    buffer.truncate()
+
+
+def import_deals(rows, default_user_id=None, dry_run=False):
+    """Загружает сделки и клиентов из пар (номер строки, словарь) через COPY и слияние.
+
+    Ошибочные строки пропускаются и попадают в отчет; остальные импортируются.
+    """
+    report = {"rows": 0, "imported": 0, "clients_created": 0, "errors": []}
+
+    with db.connect_db() as conn, conn.cursor() as cur:
+        cur.execute("SELECT username, id FROM users")
+        users = dict(cur.fetchall())
+
+        cur.execute("""
+            CREATE TEMP TABLE import_staging (
+                row_no INT,
+                id_users INT,
+                name_client VARCHAR(150),
+                unp_client VARCHAR(18),
+                date_first_contact TIMESTAMP,
+                car_brand VARCHAR(150),
+                sales_car VARCHAR(150),
+                skp_or_bl VARCHAR(10),
+                status VARCHAR(50),
+                shipment_or_signing VARCHAR(10),
+                prepayment VARCHAR(50),
+                contract_term INT,
+                currency_contract VARCHAR(10),
+                interest_rate NUMERIC(5,2),
+                use_number_cert INT,
+                use_date_cert DATE,
+                issued_number_cert INT,
+                issued_date_cert DATE,
+                express BOOLEAN,
+                electric_car BOOLEAN,
+                amount_financing NUMERIC(15,2),
+                m_plan_ship DATE,
+                description TEXT,
+                sales_channel VARCHAR(150),
+                name_agent VARCHAR(150)
+            ) ON COMMIT DROP
+        """)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        pending = 0
+        for row_no, raw in rows:
+            report["rows"] += 1
+            row, errors = validate_row(raw, default_user_id, users)
+            if errors:
+                report["errors"].append({"row": row_no, "errors": errors})
+                continue
+            row['row_no'] = row_no
+            writer.writerow(['' if row[c] is None else row[c] for c in STAGING_COLUMNS])
+            pending += 1
+            if pending >= BATCH_SIZE:
+                _copy_batch(cur, buffer)
+                pending = 0
+        if pending:
+            _copy_batch(cur, buffer)
+
+        if dry_run:
+            cur.execute("SELECT COUNT(1) FROM import_staging")
+            report["valid"] = cur.fetchone()[0]
+            cur.execute("DROP TABLE import_staging")
+            return report
+
+        # Новые клиенты: по одному на УНП, наименование из первой строки файла
+        cur.execute("""
+            INSERT INTO clients (name, unp)
+            SELECT DISTINCT ON (unp_client) name_client, unp_client
+            FROM import_staging
+            ORDER BY unp_client, row_no
+            ON CONFLICT (unp) DO NOTHING
+        """)
+        report["clients_created"] = cur.rowcount
+
+        cur.execute("""
+            INSERT INTO deals_managers (
+                date_first_contact, id_users, id_client, car_brand, sales_car,
+                skp_or_bl, status, shipment_or_signing, prepayment,
+                contract_term, currency_contract, interest_rate,
+                use_number_cert, use_date_cert, issued_number_cert, issued_date_cert,
+                express, electric_car, amount_financing, m_plan_ship, description,
+                sales_channel, name_agent, created_at
+            )
+            SELECT
+                s.date_first_contact, s.id_users, c.id, s.car_brand, s.sales_car,
+                s.skp_or_bl, s.status, s.shipment_or_signing, s.prepayment,
+                s.contract_term, s.currency_contract, s.interest_rate,
+                s.use_number_cert, s.use_date_cert, s.issued_number_cert, s.issued_date_cert,
+                s.express, s.electric_car, s.amount_financing, s.m_plan_ship, s.description,
+                s.sales_channel, s.name_agent, CURRENT_TIMESTAMP
+            FROM import_staging s
+            JOIN clients c ON c.unp = s.unp_client
+            ORDER BY s.row_no
+        """)
+        report["imported"] = cur.rowcount
+        cur.execute("DROP TABLE import_staging")
+
+    return report
+
+
+def write_error_report(report, stream):
+    writer = csv.writer(stream)
+    writer.writerow(['row', 'errors'])
+    for item in report["errors"]:
+        writer.writerow([item["row"], "; ".join(item["errors"])])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Массовый импорт сделок и клиентов из CSV/XLSX")
+    parser.add_argument("file", help="CSV или XLSX с заголовком из названий полей формы сделки")
+    parser.add_argument("--manager", help="логин менеджера для строк без колонки manager")
+    parser.add_argument("--errors", help="куда сохранить отчет об ошибках (CSV)")
+    parser.add_argument("--dry-run", action="store_true", help="только проверить файл")
+    args = parser.parse_args()
+
+    with db.unit_of_work() as uow:
+        default_user_id = None
+        if args.manager:
+            user = db.get_user_by_username(args.manager)
+            if not user:
+                parser.error(f"пользователь {args.manager} не найден")
+            default_user_id = user.id
+
+        with open(args.file, 'rb') as f:
+            report = import_deals(read_rows(f, args.file), default_user_id, args.dry_run)
+        if args.dry_run:
+            uow.rollback_only = True
+
+    print(f"Строк: {report['rows']}, импортировано сделок: {report['imported']}, "
+          f"новых клиентов: {report['clients_created']}, ошибок: {len(report['errors'])}")
+    if report["errors"]:
+        if args.errors:
+            with open(args.errors, 'w', encoding='utf-8', newline='') as f:
+                write_error_report(report, f)
+        else:
+            for item in report["errors"][:20]:
+                print(f"  строка {item['row']}: {'; '.join(item['errors'])}")
+
+
+if __name__ == "__main__":
+    main()
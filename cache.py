@@ -0,0 +1,321 @@
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # Redis-бэкенд доступен только при установленном пакете redis
+    redis = None
+
+CACHE_CONFIG = {
+    # memory - LRU в памяти процесса, redis - общий кэш процессов, none - кэш выключен,
+    # auto - memory в одном процессе и none в нескольких.
+    # Сброс ключа (delete) виден только процессу, который его сделал: с несколькими
+    # воркерами memory отдавал бы другим воркерам старые карточки сделок до истечения
+    # ttl, поэтому при workers > 1 допустимы только redis и none.
+    "backend": os.getenv("CACHE_BACKEND", "auto"),
+    # Число процессов приложения; serve.py подставляет сюда число воркеров gunicorn
+    "workers": int(os.getenv("WEB_CONCURRENCY", 1)) or 1,
+    "url": os.getenv("CACHE_URL", "redis://localhost:6379/0"),
+    "maxsize": int(os.getenv("CACHE_MAXSIZE", 5000)),
+    "ttl": float(os.getenv("CACHE_TTL", 300)),
+    "prefix": os.getenv("CACHE_PREFIX", "crm:"),
+}
+
+# Отличает промах от закэшированного значения
+MISS = object()
+
+# Чтение с загрузкой из БД: generation(key) до загрузки, затем set(..., generation=...).
+# Запись пропускается, если ключ за это время сбрасывали (delete): иначе значение,
+# прочитанное до фиксации чужого изменения, легло бы в кэш после его сброса и
+# жило бы до истечения ttl.
+
+
+class MemoryCache:
+    """LRU-кэш в памяти процесса с ограничением по числу ключей и временем жизни записей"""
+
+    def __init__(self, maxsize=5000, ttl=300.0):
+        if maxsize < 1:
+            raise ValueError("Размер кэша должен быть положительным")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # ключ -> (значение, момент истечения)
+        self._lock = threading.Lock()
+        # Номер последнего сброса каждого ключа; хранятся последние maxsize ключей,
+        # для вытесненных действует _generation_floor - наибольший их номер
+        self._generation = 0
+        self._invalidated = OrderedDict()
+        self._generation_floor = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+        self._stale_writes = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._misses += 1
+                return MISS
+            if item[1] <= now:
+                del self._data[key]
+                self._expirations += 1
+                self._misses += 1
+                return MISS
+            self._data.move_to_end(key)
+            self._hits += 1
+            return item[0]
+
+    def generation(self, key):
+        with self._lock:
+            return self._generation
+
+    def set(self, key, value, ttl=None, generation=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if generation is not None and max(
+                    self._invalidated.get(key, 0), self._generation_floor) > generation:
+                self._stale_writes += 1
+                return False
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self._invalidations += 1
+                self._invalidated[key] = self._generation
+                self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.maxsize:
+                _, generation = self._invalidated.popitem(last=False)
+                self._generation_floor = max(self._generation_floor, generation)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            # Загрузки, начатые до очистки, тоже не должны попасть в кэш
+            self._generation += 1
+            self._generation_floor = self._generation
+            self._invalidated.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "backend": "memory",
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else None,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations,
+                "stale_writes": self._stale_writes,
+            }
+
+
+class RedisCache:
+    """Кэш в Redis (или совместимом сервере), общий для всех процессов приложения.
+    Подойдет любой клиент с методами get/set(ex=)/delete, как у redis-py.
+    Ошибки сервера не ломают запрос: чтение считается промахом, запись пропускается.
+    Номер сброса ключа хранится рядом с ним (INCR при delete), запись с проверкой
+    номера выполняется одним скриптом на сервере."""
+
+    # KEYS: ключ, его номер сброса; ARGV: ожидаемый номер, значение, ttl
+    SET_IF_GENERATION = """
+        if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+            return 0
+        end
+        redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+        return 1
+    """
+
+    def __init__(self, client, ttl=300.0, prefix="crm:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+        self._errors = 0
+        self._stale_writes = 0
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key):
+        try:
+            data = self.client.get(self.prefix + key)
+        except Exception:
+            self._count("_errors")
+            data = None
+        if data is None:
+            self._count("_misses")
+            return MISS
+        self._count("_hits")
+        return pickle.loads(data)
+
+    def _generation_key(self, key):
+        return f"{self.prefix}generation:{key}"
+
+    def generation(self, key):
+        try:
+            value = self.client.get(self._generation_key(key))
+        except Exception:
+            # Номер неизвестен - загруженное значение не кэшируется
+            self._count("_errors")
+            return MISS
+        return value.decode() if value is not None else '0'
+
+    def set(self, key, value, ttl=None, generation=None):
+        ttl = max(int(self.ttl if ttl is None else ttl), 1)
+        if generation is MISS:
+            return False
+        try:
+            if generation is None:
+                self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl)
+                return True
+            stored = self.client.eval(self.SET_IF_GENERATION, 2, self.prefix + key,
+                                      self._generation_key(key), generation, pickle.dumps(value), ttl)
+        except Exception:
+            self._count("_errors")
+            return False
+        if not stored:
+            self._count("_stale_writes")
+        return bool(stored)
+
+    def delete(self, *keys):
+        if not keys:
+            return
+        try:
+            pipe = self.client.pipeline()
+            pipe.delete(*[self.prefix + key for key in keys])
+            for key in keys:
+                # Номер живет дольше любой загрузки, начатой до сброса
+                pipe.incr(self._generation_key(key))
+                pipe.expire(self._generation_key(key), max(int(self.ttl), 60))
+            pipe.execute()
+            with self._lock:
+                self._invalidations += len(keys)
+        except Exception:
+            # Запись может остаться в кэше до истечения ttl
+            self._count("_errors")
+
+    def clear(self):
+        try:
+            keys = list(self.client.scan_iter(match=self.prefix + "*"))
+            if keys:
+                self.client.delete(*keys)
+        except Exception:
+            self._count("_errors")
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            result = {
+                "backend": "redis",
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else None,
+                "invalidations": self._invalidations,
+                "stale_writes": self._stale_writes,
+                "errors": self._errors,
+            }
+        try:
+            # Вытеснение выполняет сервер, поэтому берем его счетчики
+            info = self.client.info("stats")
+            result["evictions"] = info.get("evicted_keys")
+            result["expirations"] = info.get("expired_keys")
+        except Exception:
+            pass
+        return result
+
+
+class NullCache:
+    """Кэш выключен: каждое чтение - промах"""
+
+    def get(self, key):
+        return MISS
+
+    def generation(self, key):
+        return None
+
+    def set(self, key, value, ttl=None, generation=None):
+        return False
+
+    def delete(self, *keys):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {"backend": "none"}
+
+
+_cache = None
+_cache_pid = None
+_cache_lock = threading.Lock()
+
+
+def resolve_backend(config=CACHE_CONFIG):
+    """Бэкенд, который будет создан при такой конфигурации; ValueError, если кэш
+    в памяти процесса заказан при нескольких процессах"""
+    backend = config["backend"]
+    multiprocess = config["workers"] > 1
+    if backend == "auto":
+        return "none" if multiprocess else "memory"
+    if backend == "memory" and multiprocess:
+        raise ValueError(f"CACHE_BACKEND=memory не подходит для {config['workers']} процессов: "
+                         f"сброс ключа не доходит до других воркеров, используйте redis или none")
+    return backend
+
+
+def create_cache(config=CACHE_CONFIG):
+    backend = resolve_backend(config)
+    if backend == "memory":
+        return MemoryCache(config["maxsize"], config["ttl"])
+    if backend == "redis":
+        if redis is None:
+            raise ValueError("Для CACHE_BACKEND=redis установите пакет redis")
+        return RedisCache(redis.Redis.from_url(config["url"]), config["ttl"], config["prefix"])
+    if backend == "none":
+        return NullCache()
+    raise ValueError(f"Неизвестный CACHE_BACKEND: {backend}")
+
+
+def get_cache():
+    """Кэш текущего процесса, создается при первом обращении (и заново после fork)"""
+    global _cache, _cache_pid
+    if _cache is None or _cache_pid != os.getpid():
+        with _cache_lock:
+            if _cache is None or _cache_pid != os.getpid():
+                _cache = create_cache()
+                _cache_pid = os.getpid()
+    return _cache
+
+
+def set_cache(cache):
+    """Подменяет кэш процесса, например на RedisCache с локальным клиентом"""
+    global _cache, _cache_pid
+    with _cache_lock:
+        _cache = cache
+        _cache_pid = os.getpid()
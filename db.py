@@ -1,7 +1,22 @@
+import contextvars
 import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
 import psycopg2
 from dotenv import load_dotenv
 
+import cache
+import deal_filters
+import deal_form
+import metrics
+import pagination
+import queries
+from pool import ConnectionPool
+from rows import RecordCursor, dicts
+
 load_dotenv()
 
 DB_CONFIG = {
@@ -12,103 +27,255 @@ DB_CONFIG = {
     "port": os.getenv("DB_PORT"),
 }
 
+POOL_CONFIG = {
+    "minconn": int(os.getenv("DB_POOL_MIN", 1)),
+    "maxconn": int(os.getenv("DB_POOL_MAX", 10)),
+    "timeout": float(os.getenv("DB_POOL_TIMEOUT", 5)),
+    "check_idle": float(os.getenv("DB_POOL_CHECK_IDLE", 30)),
+}
+
+# Бюджет времени одного запроса к БД в мс (statement_timeout) для запросов приложения;
+# 0 - без ограничения. Маршрут может задать свой (декоратор statement_timeout в main.py).
+# Зависший запрос прерывается Postgres и не держит поток и соединение пула.
+STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", 5000))
+# Для выгрузок через iter_query, которые читают всю таблицу
+EXPORT_STATEMENT_TIMEOUT = int(os.getenv("DB_EXPORT_STATEMENT_TIMEOUT", 120000))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Возвращает пул соединений текущего процесса, создавая его при первом обращении"""
+    global _pool, _pool_pid
+    # После fork унаследованные соединения не используем и не закрываем -
+    # их сокеты общие с родительским процессом
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(DB_CONFIG, **POOL_CONFIG)
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def close_pool():
+    """Закрывает пул текущего процесса. В процессе после fork унаследованный пул только
+    забывается: его соединения принадлежат родителю."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+        _pool_pid = None
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+class UnitOfWork:
+    """Одно соединение и одна транзакция на все вызовы connect_db() внутри области"""
+
+    def __init__(self):
+        self.conn = None
+        self.rollback_only = False
+        self.token = None
+        # Вызываются после успешной фиксации транзакции (сброс кэшей и т.п.)
+        self.after_commit = []
+        # Ключи кэша, данные которых изменены в этой транзакции
+        self.dirty_keys = set()
+        # statement_timeout транзакции в мс; None - настройка сервера
+        self.statement_timeout = None
+
+
+_current_uow = contextvars.ContextVar("current_uow", default=None)
+
+
+def begin_unit_of_work(statement_timeout=None):
+    """Открывает область; соединение берется из пула только при первом обращении к БД"""
+    uow = UnitOfWork()
+    uow.statement_timeout = statement_timeout
+    uow.token = _current_uow.set(uow)
+    return uow
+
+
+def complete_unit_of_work(uow, commit=True):
+    """Фиксирует или откатывает транзакцию области и возвращает соединение в пул"""
+    conn, uow.conn = uow.conn, None
+    callbacks, uow.after_commit = uow.after_commit, []
+    if conn is None:
+        return
+
+    broken = False
+    committed = False
+    try:
+        if commit and not uow.rollback_only:
+            conn.commit()
+            committed = True
+        else:
+            conn.rollback()
+    except Exception:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+        raise
+    finally:
+        get_pool().putconn(conn, close=broken)
+
+    if committed:
+        for callback in callbacks:
+            callback()
+
+
+def on_commit(callback):
+    """Вызывает callback после фиксации текущей единицы работы (без нее - сразу)"""
+    uow = _current_uow.get()
+    if uow is None:
+        callback()
+    else:
+        uow.after_commit.append(callback)
+
+
+def end_unit_of_work(uow):
+    """Закрывает область; незафиксированная транзакция откатывается"""
+    try:
+        _current_uow.reset(uow.token)
+    except ValueError:
+        # Область закрывается не в том контексте, в котором открывалась
+        _current_uow.set(None)
+    complete_unit_of_work(uow, commit=False)
+
+
+@contextmanager
+def unit_of_work():
+    """Выполняет блок в одной транзакции; вложенные вызовы используют внешнюю область"""
+    if _current_uow.get() is not None:
+        yield _current_uow.get()
+        return
+
+    uow = begin_unit_of_work()
+    try:
+        yield uow
+        complete_unit_of_work(uow)
+    finally:
+        end_unit_of_work(uow)
+
+
+@contextmanager
+def separate_unit_of_work(statement_timeout=None):
+    """Как unit_of_work, но всегда в собственной транзакции на отдельном соединении,
+    даже внутри другой области; внешняя область восстанавливается на выходе"""
+    uow = begin_unit_of_work(statement_timeout)
+    try:
+        yield uow
+        complete_unit_of_work(uow)
+    finally:
+        end_unit_of_work(uow)
+
+
+@contextmanager
 def connect_db():
-    return psycopg2.connect(**DB_CONFIG)
+    """Возвращает соединение текущей единицы работы, открывая ее при необходимости"""
+    uow = _current_uow.get()
+    if uow is None:
+        with unit_of_work():
+            with connect_db() as conn:
+                yield conn
+        return
+
+    if uow.conn is None:
+        started = time.perf_counter()
+        uow.conn = get_pool().getconn()
+        metrics.observe_acquire("sync", time.perf_counter() - started)
+        if uow.statement_timeout is not None:
+            _apply_statement_timeout(uow.conn, uow.statement_timeout)
+    try:
+        yield uow.conn
+    except Exception:
+        uow.rollback_only = True
+        raise
+
+
+SET_STATEMENT_TIMEOUT_QUERY = queries.statement(
+    "set_statement_timeout", "SELECT set_config('statement_timeout', %s, true)")
+
+
+def _apply_statement_timeout(conn, ms):
+    # Как SET LOCAL: действует до конца транзакции, соединение возвращается в пул без него
+    with conn.cursor() as cur:
+        queries.execute(cur, SET_STATEMENT_TIMEOUT_QUERY, (str(int(ms)),))
+
+
+def set_statement_timeout(ms):
+    """Задает statement_timeout текущей единицы работы в мс (0 - без ограничения);
+    если соединение уже взято, применяется сразу"""
+    uow = _current_uow.get()
+    if uow is None:
+        return
+    uow.statement_timeout = ms
+    if uow.conn is not None:
+        _apply_statement_timeout(uow.conn, ms)
+
+
+def current_statement_timeout():
+    """statement_timeout текущей единицы работы в мс или None"""
+    uow = _current_uow.get()
+    return uow.statement_timeout if uow is not None else None
+
+
+# Сколько строк серверный курсор передает за одно обращение к БД
+STREAM_ITERSIZE = int(os.getenv("DB_STREAM_ITERSIZE", 2000))
+
+
+def iter_query(query, params=None, itersize=STREAM_ITERSIZE,
+               statement_timeout=EXPORT_STATEMENT_TIMEOUT):
+    """Построчно отдает результат запроса через серверный (именованный) курсор.
+
+    Использует собственное соединение из пула: ответ с выгрузкой передается клиенту
+    уже после того, как единица работы запроса завершена.
+    """
+    pool = get_pool()
+    started = time.perf_counter()
+    conn = pool.getconn()
+    metrics.observe_acquire("sync", time.perf_counter() - started)
+    try:
+        if statement_timeout:
+            _apply_statement_timeout(conn, statement_timeout)
+        with conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cur:
+            cur.itersize = itersize
+            # DECLARE серверного курсора не готовится, время только учитывается
+            queries.execute(cur, queries.dynamic("stream", query, prepare=False), params)
+            yield from cur
+    finally:
+        pool.putconn(conn)
+
 
 def init_db():
-    with connect_db() as conn, conn.cursor() as cur:
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(100) UNIQUE NOT NULL,
-                full_name VARCHAR(100),
-                password_hash TEXT NOT NULL,
-                role VARCHAR(50) CHECK (role IN ('manager', 'expert', 'accountant', 'boss')) NOT NULL
-            );
-        """)
-
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS clients (
-                id SERIAL PRIMARY KEY,
-                name VARCHAR(150),
-                unp VARCHAR(18) UNIQUE NOT NULL,
-                contact_person VARCHAR(150),
-                contact_phone VARCHAR(20),
-                contact_email VARCHAR(255),
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                descriptions TEXT
-            );
-        """)
-
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS deals_managers (
-                id SERIAL PRIMARY KEY,
-                date_first_contact TIMESTAMP,
-                id_users INT REFERENCES users(id),
-                id_client INT REFERENCES clients(id),
-                car_brand VARCHAR(150),
-                sales_car VARCHAR(150),
-                skp_or_bl VARCHAR(10),
-                status VARCHAR(50),
-                shipment_or_signing VARCHAR(10),
-                prepayment VARCHAR(50),
-                contract_term INT,
-                currency_contract VARCHAR(10),
-                interest_rate NUMERIC(5,2),
-                use_number_cert INT,
-                use_date_cert DATE,
-                issued_number_cert INT,
-                issued_date_cert DATE,
-                express BOOLEAN,
-                electric_car BOOLEAN,
-                amount_financing NUMERIC(15,2),
-                m_plan_ship DATE,
-                description TEXT,
-                sales_channel VARCHAR(150),
-                name_agent VARCHAR(150),
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS deals_expert (
-                id SERIAL PRIMARY KEY,
-                id_manager_deal INT REFERENCES deals_managers(id), -- Ссылка на исходную сделку
-                date_appearance TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                id_manager INT REFERENCES users(id), -- ID менеджера
-                id_client INT REFERENCES clients(id),
-                car_brand VARCHAR(150),
-                sales_car VARCHAR(150),
-                skp_or_bl VARCHAR(10),
-                shipment_or_signing VARCHAR(10),
-                prepayment VARCHAR(50),
-                contract_term INT,
-                currency_contract VARCHAR(10),
-                interest_rate NUMERIC(10,4),
-                use_number_cert INT,
-                use_date_cert DATE,
-                express BOOLEAN,
-                original_or_skan VARCHAR(30),
-                electric_car BOOLEAN,
-                solution_owner VARCHAR(30),
-                date_for_ce TIMESTAMP, -- Дата для кредитного эксперта
-                status VARCHAR(50),
-                id_ce INT REFERENCES users(id), -- ID кредитного эксперта
-                amount_financing NUMERIC(15,2),
-                date_credit_committee TIMESTAMP,
-                date_protocol TIMESTAMP,
-                date_signing_contract TIMESTAMP,
-                shipping_date TIMESTAMP, -- дата отгрузки лизинга
-                expert_comment TEXT, -- Комментарий эксперта
-                manager_comment TEXT, -- Комментарий менеджера
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-
-        conn.commit()
+    """Приводит схему БД к актуальной версии (см. migrate.py)"""
+    import migrate
+    migrate.migrate()
+
+
+CREATE_DEAL_QUERY = queries.statement("create_deal", """
+    INSERT INTO deals_managers (
+        date_first_contact, id_users, id_client, car_brand, sales_car,
+        skp_or_bl, status, shipment_or_signing, prepayment,
+        contract_term, currency_contract, interest_rate,
+        use_number_cert, use_date_cert, issued_number_cert, issued_date_cert,
+        express, electric_car, amount_financing, m_plan_ship, description,
+        sales_channel, name_agent, created_at
+    ) VALUES (
+        %(date_first_contact)s, %(user_id)s, %(client_id)s, %(car_brand)s, %(sales_car)s,
+        %(skp_or_bl)s, %(status)s, %(shipment_or_signing)s, %(prepayment)s,
+        %(contract_term)s, %(currency_contract)s, %(interest_rate)s,
+        %(use_number_cert)s, %(use_date_cert)s, %(issued_number_cert)s, %(issued_date_cert)s,
+        %(express)s, %(electric_car)s, %(amount_financing)s, %(m_plan_ship)s, %(description)s,
+        %(sales_channel)s, %(name_agent)s, CURRENT_TIMESTAMP
+    )
+    RETURNING id
+""")
 
 
 def create_deal_in_db(**kwargs):
@@ -125,145 +292,265 @@ def create_deal_in_db(**kwargs):
 
     with connect_db() as conn, conn.cursor() as cur:
         try:
-            cur.execute("""
-                INSERT INTO deals_managers (
-                    date_first_contact, id_users, id_client, car_brand, sales_car,
-                    skp_or_bl, status, shipment_or_signing, prepayment,
-                    contract_term, currency_contract, interest_rate,
-                    use_number_cert, use_date_cert, issued_number_cert, issued_date_cert,
-                    express, electric_car, amount_financing, m_plan_ship, description,
-                    sales_channel, name_agent, created_at
-                ) VALUES (
-                    %(date_first_contact)s, %(user_id)s, %(client_id)s, %(car_brand)s, %(sales_car)s,
-                    %(skp_or_bl)s, %(status)s, %(shipment_or_signing)s, %(prepayment)s,
-                    %(contract_term)s, %(currency_contract)s, %(interest_rate)s,
-                    %(use_number_cert)s, %(use_date_cert)s, %(issued_number_cert)s, %(issued_date_cert)s,
-                    %(express)s, %(electric_car)s, %(amount_financing)s, %(m_plan_ship)s, %(description)s,
-                    %(sales_channel)s, %(name_agent)s, CURRENT_TIMESTAMP
-                )
-                RETURNING id
-            """, kwargs)
+            queries.execute(cur, CREATE_DEAL_QUERY, kwargs)
             new_deal_id = cur.fetchone()[0]
-            conn.commit()
+            # Новая сделка еще не зафиксирована: чтение в этой транзакции не должно попасть в кэш
+            invalidate(f"deal:{new_deal_id}")
             return new_deal_id
         except Exception as e:
-            conn.rollback()
             raise ValueError(f"Ошибка при создании сделки: {str(e)}")
 
 def search_client(name_client):
     with connect_db() as conn, conn.cursor() as cur:
-        cur.execute("""
+        queries.execute(cur, queries.statement("client_by_name", """
         SELECT id FROM clients where name = %s
-        """, name_client)
+        """), (name_client,))
 
         return cur.fetchone()
 
 
-def get_deals_paginated(page, per_page):
+def _where(conditions):
+    return "WHERE " + " AND ".join(conditions) if conditions else ""
+
+
+def get_deals_paginated(page, per_page, filters=None):
     offset = (page - 1) * per_page
-    with connect_db() as conn, conn.cursor() as cur:
-        cur.execute("""
+    conditions, params = deal_filters.where_conditions(filters or {}, deal_filters.DEAL_FILTERS)
+    with connect_db() as conn, conn.cursor(cursor_factory=RecordCursor) as cur:
+        queries.execute(cur, queries.dynamic("deals_offset_page", f"""
             SELECT d.id, d.date_first_contact, u.full_name AS manager_name, c.name AS client_name,
                    d.car_brand, d.status, d.amount_financing, d.m_plan_ship
             FROM deals_managers d
             LEFT JOIN users u ON d.id_users = u.id
             LEFT JOIN clients c ON d.id_client = c.id
+            {_where(conditions)}
             ORDER BY d.id DESC
             LIMIT %s OFFSET %s;
-        """, (per_page, offset))
+        """), (*params, per_page, offset))
         return cur.fetchall()
 
 
+def deals_keyset_query(per_page, cursor=None, filters=None, sort='id', descending=True):
+    """SQL, параметры и ключ курсора страницы сделок (общие для db и db_async)"""
+    sort_spec = deal_filters.DEAL_SORTS[sort]
+    conditions, params = deal_filters.where_conditions(filters or {}, deal_filters.DEAL_FILTERS)
+    condition, order, key_params = pagination.keyset_clause("d.id", cursor, sort_spec, descending)
+    if condition:
+        conditions.append(condition)
+        params.extend(key_params)
+
+    query = f"""
+        SELECT d.id, d.date_first_contact, u.full_name AS manager_name, c.name AS client_name,
+               d.car_brand, d.status, d.amount_financing, d.m_plan_ship
+               {f", {sort_spec[0]} AS sort_key" if sort_spec else ""}
+        FROM deals_managers d
+        LEFT JOIN users u ON d.id_users = u.id
+        LEFT JOIN clients c ON d.id_client = c.id
+        {_where(conditions)}
+        ORDER BY {order}
+        LIMIT %s;
+    """
+    key = pagination.sort_key if sort_spec else (lambda row: row[0])
+    return query, (*params, per_page + 1), key
+
+
+def get_deals_keyset(per_page, cursor=None, filters=None, sort='id', descending=True):
+    """Страница сделок без OFFSET; cursor - результат pagination.decode_cursor.
+
+    filters - результат deal_filters.parse_filters, sort - ключ deal_filters.DEAL_SORTS.
+    """
+    query, params, key = deals_keyset_query(per_page, cursor, filters, sort, descending)
+    with connect_db() as conn, conn.cursor(cursor_factory=RecordCursor) as cur:
+        queries.execute(cur, queries.dynamic("deals_page", query), params)
+        return pagination.build_page(cur.fetchall(), per_page, cursor, key)
+
+
+def estimate_rows(query, params=()):
+    """Оценка числа строк результата запроса по плану, без его выполнения"""
+    with connect_db() as conn, conn.cursor() as cur:
+        queries.execute(cur, queries.dynamic("explain", "EXPLAIN (FORMAT JSON) " + query,
+                                             prepare=False), params)
+        return int(cur.fetchone()[0][0]["Plan"]["Plan Rows"])
+
+
+def deals_count_query(filters):
+    conditions, params = deal_filters.where_conditions(filters, deal_filters.DEAL_FILTERS)
+    return f"SELECT 1 FROM deals_managers d {_where(conditions)}", params
+
+
+def estimate_deals_count(filters=None):
+    if not filters:
+        return estimate_count('deals_managers')
+    return estimate_rows(*deals_count_query(filters))
+
+
+COUNT_CACHE_TTL = float(os.getenv("COUNT_CACHE_TTL", 60))
+# Ниже этого порога оценка планировщика неточна, а точный COUNT и так дешев
+EXACT_COUNT_THRESHOLD = int(os.getenv("EXACT_COUNT_THRESHOLD", 10000))
+
+_count_cache = {}
+_count_cache_lock = threading.Lock()
+
+
+def cached_count(table):
+    """Число строк таблицы из кэша процесса или None, если кэш устарел"""
+    with _count_cache_lock:
+        cached = _count_cache.get(table)
+        if cached and time.monotonic() - cached[1] < COUNT_CACHE_TTL:
+            return cached[0]
+    return None
+
+
+def store_count(table, total):
+    with _count_cache_lock:
+        _count_cache[table] = (total, time.monotonic())
+    return total
+
+
+# Имя таблицы подставляется только из кода, не из запроса пользователя
+ESTIMATE_COUNT_QUERY = queries.statement(
+    "estimate_count", "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass")
+EXACT_COUNT_QUERY = "SELECT COUNT(1) FROM {table}"
+
+
+def estimate_count(table):
+    """Приблизительное число строк таблицы по статистике планировщика с кэшированием"""
+    total = cached_count(table)
+    if total is not None:
+        return total
+
+    with connect_db() as conn, conn.cursor() as cur:
+        queries.execute(cur, ESTIMATE_COUNT_QUERY, (table,))
+        total = cur.fetchone()[0]
+        if total < EXACT_COUNT_THRESHOLD:
+            query = queries.dynamic("exact_count", EXACT_COUNT_QUERY.format(table=table))
+            queries.execute(cur, query)
+            total = cur.fetchone()[0]
+    return store_count(table, total)
+
+
 def count_deals():
     with connect_db() as conn, conn.cursor() as cur:
-        cur.execute("SELECT COUNT(1) FROM deals_managers;")
+        queries.execute(cur, queries.statement("count_deals",
+                                               "SELECT COUNT(1) FROM deals_managers;"))
         return cur.fetchone()[0]
 
 
 
+def cached(key, loader):
+    """Читает значение через кэш; None не кэшируется"""
+    uow = _current_uow.get()
+    if uow is not None and key in uow.dirty_keys:
+        # Транзакция видит свои незафиксированные изменения - в общий кэш их не кладем
+        return loader()
+
+    store = cache.get_cache()
+    value = store.get(key)
+    if value is cache.MISS:
+        # Если ключ сбросят, пока идет загрузка, прочитанное значение может быть уже
+        # устаревшим - тогда оно не кэшируется
+        generation = store.generation(key)
+        value = loader()
+        if value is not None:
+            store.set(key, value, generation=generation)
+    return value
+
+
+def invalidate(*keys):
+    """Сбрасывает ключи кэша сразу и еще раз после фиксации текущей транзакции"""
+    cache.get_cache().delete(*keys)
+    uow = _current_uow.get()
+    if uow is not None:
+        uow.dirty_keys.update(keys)
+        uow.after_commit.append(lambda: cache.get_cache().delete(*keys))
+
+
+def cache_stats():
+    return cache.get_cache().stats()
+
+
 def get_deal_details(deal_id):
-    with connect_db() as conn, conn.cursor() as cur:
-        cur.execute("""
-            SELECT 
-                d.id, d.date_first_contact, u.full_name AS manager_name, 
-                c.name AS client_name, c.unp, d.car_brand, d.sales_car, 
-                d.skp_or_bl, d.status, d.shipment_or_signing, 
-                d.prepayment, d.contract_term, d.currency_contract, 
-                d.interest_rate, d.use_number_cert, d.use_date_cert, 
-                d.issued_number_cert, d.issued_date_cert, 
-                d.express, d.electric_car, d.amount_financing, 
-                d.m_plan_ship, d.description, d.sales_channel, d.name_agent,
-                d.id_users, d.id_client
-            FROM deals_managers d
-            LEFT JOIN users u ON d.id_users = u.id
-            LEFT JOIN clients c ON d.id_client = c.id
-            WHERE d.id = %s;
-        """, (deal_id,))
-        columns = [desc[0] for desc in cur.description]
-        row = cur.fetchone()
-        if row:
-            return dict(zip(columns, row))
-        return None
+    """Сделка менеджера с именами менеджера и клиента (через кэш)"""
+    return cached(f"deal:{deal_id}", lambda: _load_deal_details(deal_id))
+
+
+DEAL_DETAILS_QUERY = queries.statement("deal_details", """
+    SELECT 
+        d.id, d.date_first_contact, u.full_name AS manager_name, 
+        c.name AS client_name, c.unp, d.car_brand, d.sales_car, 
+        d.skp_or_bl, d.status, d.shipment_or_signing, 
+        d.prepayment, d.contract_term, d.currency_contract, 
+        d.interest_rate, d.use_number_cert, d.use_date_cert, 
+        d.issued_number_cert, d.issued_date_cert, 
+        d.express, d.electric_car, d.amount_financing, 
+        d.m_plan_ship, d.description, d.sales_channel, d.name_agent,
+        d.id_users, d.id_client, d.updated_at
+    FROM deals_managers d
+    LEFT JOIN users u ON d.id_users = u.id
+    LEFT JOIN clients c ON d.id_client = c.id
+    WHERE d.id = %s;
+""")
+
+
+def _load_deal_details(deal_id):
+    with connect_db() as conn, conn.cursor(cursor_factory=RecordCursor) as cur:
+        queries.execute(cur, DEAL_DETAILS_QUERY, (deal_id,))
+        return cur.fetchone()
 
 
 def update_or_create_expert_deal(**kwargs):
-    """Обновляет существующую запись эксперта или создает новую"""
+    """Обновляет существующую запись эксперта или создает новую одним запросом"""
     with connect_db() as conn, conn.cursor() as cur:
         try:
-            # Проверяем существование записи
-            expert_deal_id = get_expert_deal_by_manager_deal_id(kwargs['id_manager_deal'])
-
-            if expert_deal_id:
-                # Обновляем существующую запись
-                cur.execute("""
-                    UPDATE deals_expert SET
-                        car_brand = %(car_brand)s,
-                        sales_car = %(sales_car)s,
-                        skp_or_bl = %(skp_or_bl)s,
-                        shipment_or_signing = %(shipment_or_signing)s,
-                        prepayment = %(prepayment)s,
-                        contract_term = %(contract_term)s,
-                        currency_contract = %(currency_contract)s,
-                        interest_rate = %(interest_rate)s,
-                        use_number_cert = %(use_number_cert)s,
-                        use_date_cert = %(use_date_cert)s,
-                        express = %(express)s,
-                        electric_car = %(electric_car)s,
-                        status = %(status)s,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE id = %(expert_deal_id)s
-                """, {**kwargs, 'expert_deal_id': expert_deal_id})
-                message = "Данные эксперта успешно обновлены"
-            else:
-                # Создаем новую запись
-                cur.execute("""
-                    INSERT INTO deals_expert (
-                        id_manager_deal, id_manager, id_client, car_brand, 
-                        sales_car, skp_or_bl, shipment_or_signing, prepayment,
-                        contract_term, currency_contract, interest_rate,
-                        use_number_cert, use_date_cert, express, electric_car,
-                        status
-                    ) VALUES (
-                        %(id_manager_deal)s, %(id_manager)s, %(id_client)s, %(car_brand)s,
-                        %(sales_car)s, %(skp_or_bl)s, %(shipment_or_signing)s, %(prepayment)s,
-                        %(contract_term)s, %(currency_contract)s, %(interest_rate)s,
-                        %(use_number_cert)s, %(use_date_cert)s, %(express)s, %(electric_car)s,
-                        %(status)s
-                    )
-                """, kwargs)
-                message = "Сделка успешно передана эксперту"
+            # Уникальность id_manager_deal гарантирует одну запись эксперта на сделку
+            # даже при параллельной передаче; xmax = 0 только у вставленной строки
+            queries.execute(cur, queries.statement("upsert_expert_deal", """
+                INSERT INTO deals_expert (
+                    id_manager_deal, id_manager, id_client, car_brand, 
+                    sales_car, skp_or_bl, shipment_or_signing, prepayment,
+                    contract_term, currency_contract, interest_rate,
+                    use_number_cert, use_date_cert, express, electric_car,
+                    status
+                ) VALUES (
+                    %(id_manager_deal)s, %(id_manager)s, %(id_client)s, %(car_brand)s,
+                    %(sales_car)s, %(skp_or_bl)s, %(shipment_or_signing)s, %(prepayment)s,
+                    %(contract_term)s, %(currency_contract)s, %(interest_rate)s,
+                    %(use_number_cert)s, %(use_date_cert)s, %(express)s, %(electric_car)s,
+                    %(status)s
+                )
+                ON CONFLICT (id_manager_deal) DO UPDATE SET
+                    car_brand = EXCLUDED.car_brand,
+                    sales_car = EXCLUDED.sales_car,
+                    skp_or_bl = EXCLUDED.skp_or_bl,
+                    shipment_or_signing = EXCLUDED.shipment_or_signing,
+                    prepayment = EXCLUDED.prepayment,
+                    contract_term = EXCLUDED.contract_term,
+                    currency_contract = EXCLUDED.currency_contract,
+                    interest_rate = EXCLUDED.interest_rate,
+                    use_number_cert = EXCLUDED.use_number_cert,
+                    use_date_cert = EXCLUDED.use_date_cert,
+                    express = EXCLUDED.express,
+                    electric_car = EXCLUDED.electric_car,
+                    status = EXCLUDED.status,
+                    updated_at = CURRENT_TIMESTAMP
+                RETURNING id, (xmax = 0) AS inserted
+            """), kwargs)
+            expert_deal_id, inserted = cur.fetchone()
+            invalidate(f"expert_deal:{expert_deal_id}")
 
-            conn.commit()
+            if inserted:
+                message = "Сделка успешно передана эксперту"
+            else:
+                message = "Данные эксперта успешно обновлены"
             return {"success": True, "message": message}
 
         except Exception as e:
-            conn.rollback()
             raise ValueError(f"Ошибка при передаче эксперту: {str(e)}")
 
 
 def update_deal(deal_id, *args):
     with connect_db() as conn, conn.cursor() as cur:
-        cur.execute("""
+        queries.execute(cur, queries.statement("update_deal", """
             UPDATE deals_managers SET
                 date_first_contact = %s,
                 id_client = %s,
@@ -289,79 +576,177 @@ def update_deal(deal_id, *args):
                 name_agent = %s,
                 updated_at = CURRENT_TIMESTAMP
             WHERE id = %s
-        """, (*args, deal_id))
-        conn.commit()
+            RETURNING (SELECT e.id FROM deals_expert e WHERE e.id_manager_deal = deals_managers.id)
+        """), (*args, deal_id))
+        row = cur.fetchone()
+    _invalidate_deal(deal_id, row[0] if row else None)
+
+
+def get_deal_for_edit(deal_id):
+    """Сделка из базы в обход кэша: по ней проверяется версия и считаются изменения"""
+    return _load_deal_details(deal_id)
+
+
+def update_deal_fields(deal_id, changes, version):
+    """Обновляет только переданные колонки сделки, если ее updated_at все еще равен version.
+    Возвращает новый updated_at или None, если сделку успели изменить."""
+    unknown = set(changes) - set(deal_form.EDIT_FIELDS)
+    if unknown or not changes:
+        raise ValueError("Некорректный набор изменяемых полей")
+    columns = sorted(changes)
+    # Свой подготовленный запрос на каждый набор колонок; наборов на практике немного
+    query = queries.dynamic("update_deal_fields", f"""
+        UPDATE deals_managers SET
+            {", ".join(f"{column} = %({column})s" for column in columns)},
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = %(deal_id)s AND updated_at IS NOT DISTINCT FROM %(version)s
+        RETURNING updated_at,
+            (SELECT e.id FROM deals_expert e WHERE e.id_manager_deal = deals_managers.id)
+    """)
+    with connect_db() as conn, conn.cursor() as cur:
+        queries.execute(cur, query, {**changes, 'deal_id': deal_id, 'version': version})
+        row = cur.fetchone()
+    if row is None:
+        return None
+    _invalidate_deal(deal_id, row[1])
+    return row[0]
+
 
 def update_deal_status(deal_id, status):
     with connect_db() as conn, conn.cursor() as cur:
-        cur.execute("""
+        queries.execute(cur, queries.statement("update_deal_status", """
             UPDATE deals_managers 
             SET status = %s, updated_at = CURRENT_TIMESTAMP
             WHERE id = %s
-        """, (status, deal_id))
-        conn.commit()
+            RETURNING (SELECT e.id FROM deals_expert e WHERE e.id_manager_deal = deals_managers.id)
+        """), (status, deal_id))
+        row = cur.fetchone()
+    _invalidate_deal(deal_id, row[0] if row else None)
+
+
+def _invalidate_deal(deal_id, expert_deal_id):
+    # Карточка эксперта показывает поля сделки менеджера, поэтому сбрасывается вместе с ней
+    if expert_deal_id:
+        invalidate(f"deal:{deal_id}", f"expert_deal:{expert_deal_id}")
+    else:
+        invalidate(f"deal:{deal_id}")
 
 
 # Добавляем в db.py
 def create_user(username, password_hash, role, full_name):
     with connect_db() as conn, conn.cursor() as cur:
-        cur.execute("""
+        queries.execute(cur, queries.statement("create_user", """
             INSERT INTO users (username, password_hash, role, full_name)
             VALUES (%s, %s, %s, %s)
             RETURNING id
-        """, (username, password_hash, role, full_name))
+        """), (username, password_hash, role, full_name))
         user_id = cur.fetchone()[0]
-        conn.commit()
-        return user_id
+    # Сброс сразу и после фиксации: иначе параллельный запрос успеет закэшировать
+    # состав без нового пользователя
+    invalidate_roster()
+    on_commit(invalidate_roster)
+    return user_id
+
+# Колонки перечислены явно: подготовленный SELECT * перестает работать после
+# добавления колонки в таблицу
+USER_BY_USERNAME_QUERY = queries.statement("user_by_username", """
+    SELECT id, username, full_name, password_hash, role
+    FROM users
+    WHERE username = %s
+""")
+
 
 def get_user_by_username(username):
+    with connect_db() as conn, conn.cursor(cursor_factory=RecordCursor) as cur:
+        queries.execute(cur, USER_BY_USERNAME_QUERY, (username,))
+        return cur.fetchone()
+
+
+def update_password_hash(user_id, old_hash, new_hash):
+    """Заменяет хэш пароля, если его не изменили с момента проверки"""
     with connect_db() as conn, conn.cursor() as cur:
-        cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-        columns = [desc[0] for desc in cur.description]
-        row = cur.fetchone()
-        if row:
-            return dict(zip(columns, row))
-        return None
+        queries.execute(cur, queries.statement("update_password_hash", """
+            UPDATE users SET password_hash = %s
+            WHERE id = %s AND password_hash = %s
+        """), (new_hash, user_id, old_hash))
+        return cur.rowcount == 1
 
 
 def get_or_create_client(name, unp):
-    """Проверяет существование клиента по УНП, если нет - создает нового"""
+    """Возвращает ID клиента по УНП, создавая клиента при необходимости, одним запросом"""
     with connect_db() as conn, conn.cursor() as cur:
-        # Проверяем существование клиента
-        cur.execute("SELECT id FROM clients WHERE unp = %s", (unp,))
-        client = cur.fetchone()
-
-        if client:
-            return client[0]
-        else:
-            # Создаем нового клиента
-            cur.execute("""
-                INSERT INTO clients (name, unp) 
-                VALUES (%s, %s)
-                RETURNING id
-            """, (name, unp))
-            new_client_id = cur.fetchone()[0]
-            conn.commit()
-            return new_client_id
+        # Пустое обновление при конфликте нужно, чтобы RETURNING вернул id существующей строки
+        queries.execute(cur, queries.statement("get_or_create_client", """
+            INSERT INTO clients (name, unp) 
+            VALUES (%s, %s)
+            ON CONFLICT (unp) DO UPDATE SET unp = EXCLUDED.unp
+            RETURNING id
+        """), (name, unp))
+        return cur.fetchone()[0]
 
 
 def get_expert_deal_by_manager_deal_id(manager_deal_id):
     """Получает запись эксперта по ID сделки менеджера"""
     with connect_db() as conn, conn.cursor() as cur:
-        cur.execute("""
+        queries.execute(cur, queries.statement("expert_deal_by_manager_deal", """
             SELECT id FROM deals_expert 
             WHERE id_manager_deal = %s
             ORDER BY created_at DESC
             LIMIT 1
-        """, (manager_deal_id,))
+        """), (manager_deal_id,))
         result = cur.fetchone()
         return result[0] if result else None
 
 
-def get_expert_deals_paginated(page, per_page, expert_id=None):
+def _expert_conditions(expert_id, filters):
+    conditions, params = deal_filters.where_conditions(filters or {}, deal_filters.EXPERT_DEAL_FILTERS)
+    if expert_id:
+        # Список эксперта: его сделки и еще не назначенные никому
+        conditions.append("(e.id_ce = %s OR e.id_ce IS NULL)")
+        params.append(expert_id)
+    return conditions, params
+
+
+# Колонки deals_expert для страницы списка, включая все выражения сортировки
+EXPERT_PAGE_COLUMNS = """
+    e.id, e.date_appearance, e.id_manager, e.id_client, e.car_brand, e.status,
+    e.amount_financing, e.shipping_date, e.id_ce
+"""
+
+
+def _expert_page_source(expert_id, conditions, params, order, limit):
+    """FROM, WHERE и их параметры для страницы сделок эксперта.
+
+    С условием (id_ce = %s OR id_ce IS NULL) индексы (id_ce, ..., id DESC) не отдают
+    строки по порядку, и Postgres сортирует все подходящие сделки. Поэтому сделки эксперта
+    и не назначенные никому берутся двумя ветками UNION ALL, каждая своим проходом индекса
+    со своим LIMIT, а общий порядок наводится на 2 * limit строках. conditions - фильтры
+    и условие курсора, общие для обеих веток.
+    """
+    if not expert_id:
+        return "deals_expert e", _where(conditions), list(params)
+
+    def branch(name, condition):
+        return f"""
+            SELECT * FROM (
+                SELECT {EXPERT_PAGE_COLUMNS}
+                FROM deals_expert e
+                {_where([*conditions, condition])}
+                ORDER BY {order}
+                LIMIT %s
+            ) {name}"""
+
+    source = f"({branch('assigned', 'e.id_ce = %s')} UNION ALL {branch('unassigned', 'e.id_ce IS NULL')}) e"
+    return source, "", [*params, expert_id, limit, *params, limit]
+
+
+def get_expert_deals_paginated(page, per_page, expert_id=None, filters=None):
     offset = (page - 1) * per_page
-    with connect_db() as conn, conn.cursor() as cur:
-        query = """
+    conditions, params = deal_filters.where_conditions(filters or {}, deal_filters.EXPERT_DEAL_FILTERS)
+    source, where, params = _expert_page_source(expert_id, conditions, params, "e.id DESC",
+                                                offset + per_page)
+    with connect_db() as conn, conn.cursor(cursor_factory=RecordCursor) as cur:
+        queries.execute(cur, queries.dynamic("expert_deals_offset_page", f"""
             SELECT 
                 e.id, e.date_appearance, 
                 u.full_name AS manager_name, 
@@ -369,68 +754,237 @@ def get_expert_deals_paginated(page, per_page, expert_id=None):
                 e.car_brand, e.status, 
                 e.amount_financing, e.shipping_date,
                 e.id_ce
-            FROM deals_expert e
+            FROM {source}
             LEFT JOIN users u ON e.id_manager = u.id
             LEFT JOIN clients c ON e.id_client = c.id
-        """
-        params = (per_page, offset)
+            {where}
+            ORDER BY e.id DESC
+            LIMIT %s OFFSET %s;
+        """), (*params, per_page, offset))
+        return cur.fetchall()
 
-        if expert_id:
-            query += " WHERE e.id_ce = %s"
-            params = (expert_id, per_page, offset)
 
-        query += " ORDER BY e.id DESC LIMIT %s OFFSET %s;"
+def expert_deals_keyset_query(per_page, cursor=None, expert_id=None, filters=None, sort='id',
+                              descending=True):
+    """SQL, параметры и ключ курсора страницы сделок эксперта (общие для db и db_async)"""
+    sort_spec = deal_filters.EXPERT_DEAL_SORTS[sort]
+    conditions, params = deal_filters.where_conditions(filters or {}, deal_filters.EXPERT_DEAL_FILTERS)
+    condition, order, key_params = pagination.keyset_clause("e.id", cursor, sort_spec, descending)
+    if condition:
+        conditions.append(condition)
+        params.extend(key_params)
+    source, where, params = _expert_page_source(expert_id, conditions, params, order, per_page + 1)
+
+    query = f"""
+        SELECT 
+            e.id, e.date_appearance, 
+            u.full_name AS manager_name, 
+            c.name AS client_name,
+            e.car_brand, e.status, 
+            e.amount_financing, e.shipping_date,
+            e.id_ce
+            {f", {sort_spec[0]} AS sort_key" if sort_spec else ""}
+        FROM {source}
+        LEFT JOIN users u ON e.id_manager = u.id
+        LEFT JOIN clients c ON e.id_client = c.id
+        {where}
+        ORDER BY {order}
+        LIMIT %s;
+    """
+    key = pagination.sort_key if sort_spec else (lambda row: row[0])
+    return query, (*params, per_page + 1), key
+
+
+def get_expert_deals_keyset(per_page, cursor=None, expert_id=None, filters=None, sort='id',
+                            descending=True):
+    query, params, key = expert_deals_keyset_query(per_page, cursor, expert_id, filters, sort,
+                                                   descending)
+    with connect_db() as conn, conn.cursor(cursor_factory=RecordCursor) as cur:
+        queries.execute(cur, queries.dynamic("expert_deals_page", query), params)
+        return pagination.build_page(cur.fetchall(), per_page, cursor, key)
 
-        cur.execute(query, params)
-        return cur.fetchall()
 
+def expert_deals_count_query(expert_id=None, filters=None):
+    """Запрос для числа сделок эксперта: (SQL, параметры, exact). exact - запрос сразу
+    возвращает число по счетчикам, иначе это выборка для оценки планировщиком."""
+    filters = filters or {}
+    # Статус и эксперт считаются точно по счетчикам, прочие фильтры - по оценке планировщика
+    if set(filters) <= {'status'}:
+        experts = [expert_id, 0] if expert_id else None
+        return (*expert_counters_query(experts, filters.get('status')), True)
+    if not expert_id and set(filters) <= {'status', 'expert'}:
+        return (*expert_counters_query([filters['expert']], filters.get('status')), True)
+    conditions, params = _expert_conditions(expert_id, filters)
+    return f"SELECT 1 FROM deals_expert e {_where(conditions)}", params, False
 
-def count_expert_deals(expert_id=None):
+
+def estimate_expert_deals_count(expert_id=None, filters=None):
+    query, params, exact = expert_deals_count_query(expert_id, filters)
+    if not exact:
+        return estimate_rows(query, params)
     with connect_db() as conn, conn.cursor() as cur:
-        query = "SELECT COUNT(1) FROM deals_expert"
-        params = None
+        queries.execute(cur, queries.dynamic("expert_counters", query), params)
+        return cur.fetchone()[0]
+
+
+DEAL_EXPORT_COLUMNS = [
+    'id', 'date_first_contact', 'manager_name', 'client_name', 'unp', 'car_brand', 'sales_car',
+    'skp_or_bl', 'status', 'shipment_or_signing', 'prepayment', 'contract_term',
+    'currency_contract', 'interest_rate', 'use_number_cert', 'use_date_cert',
+    'issued_number_cert', 'issued_date_cert', 'express', 'electric_car', 'amount_financing',
+    'm_plan_ship', 'description', 'sales_channel', 'name_agent', 'created_at', 'updated_at',
+]
+
+
+def iter_deals_export(filters=None):
+    """Сделки менеджеров с именами менеджеров и клиентов для выгрузки; фильтры как у списка"""
+    conditions, params = deal_filters.where_conditions(filters or {}, deal_filters.DEAL_FILTERS)
+    return iter_query(f"""
+        SELECT
+            d.id, d.date_first_contact, u.full_name AS manager_name,
+            c.name AS client_name, c.unp, d.car_brand, d.sales_car,
+            d.skp_or_bl, d.status, d.shipment_or_signing,
+            d.prepayment, d.contract_term, d.currency_contract,
+            d.interest_rate, d.use_number_cert, d.use_date_cert,
+            d.issued_number_cert, d.issued_date_cert,
+            d.express, d.electric_car, d.amount_financing,
+            d.m_plan_ship, d.description, d.sales_channel, d.name_agent,
+            d.created_at, d.updated_at
+        FROM deals_managers d
+        LEFT JOIN users u ON d.id_users = u.id
+        LEFT JOIN clients c ON d.id_client = c.id
+        {_where(conditions)}
+        ORDER BY d.id DESC
+    """, params)
+
+
+EXPERT_DEAL_EXPORT_COLUMNS = [
+    'id', 'id_manager_deal', 'date_appearance', 'manager_name', 'client_name', 'unp',
+    'car_brand', 'sales_car', 'skp_or_bl', 'status', 'shipment_or_signing', 'prepayment',
+    'contract_term', 'currency_contract', 'interest_rate', 'use_number_cert', 'use_date_cert',
+    'express', 'electric_car', 'amount_financing', 'original_or_skan', 'solution_owner',
+    'date_for_ce', 'expert_name', 'date_credit_committee', 'date_protocol',
+    'date_signing_contract', 'shipping_date', 'expert_comment', 'manager_comment',
+    'created_at', 'updated_at',
+]
 
-        cur.execute(query, params)
+
+def iter_expert_deals_export(expert_id=None, filters=None):
+    """Сделки экспертов для выгрузки; фильтры как у списка сделок"""
+    conditions, params = _expert_conditions(expert_id, filters)
+    return iter_query(f"""
+        SELECT
+            e.id, e.id_manager_deal, e.date_appearance, u.full_name AS manager_name,
+            c.name AS client_name, c.unp, e.car_brand, e.sales_car,
+            e.skp_or_bl, e.status, e.shipment_or_signing, e.prepayment,
+            e.contract_term, e.currency_contract, e.interest_rate,
+            e.use_number_cert, e.use_date_cert, e.express, e.electric_car,
+            e.amount_financing, e.original_or_skan, e.solution_owner,
+            e.date_for_ce, ce.full_name AS expert_name, e.date_credit_committee,
+            e.date_protocol, e.date_signing_contract, e.shipping_date,
+            e.expert_comment, e.manager_comment, e.created_at, e.updated_at
+        FROM deals_expert e
+        LEFT JOIN users u ON e.id_manager = u.id
+        LEFT JOIN clients c ON e.id_client = c.id
+        LEFT JOIN users ce ON e.id_ce = ce.id
+        {_where(conditions)}
+        ORDER BY e.id DESC
+    """, params)
+
+
+def expert_counters_query(experts=None, status=None):
+    # Сделки без эксперта учитываются в счетчиках с id_ce = 0 (миграция 0006)
+    conditions = []
+    params = []
+    if experts is not None:
+        conditions.append("id_ce = ANY(%s)")
+        params.append(list(experts))
+    if status is not None:
+        conditions.append("status = %s")
+        params.append(status)
+    return f"SELECT COALESCE(SUM(deals), 0) FROM deals_expert_counters {_where(conditions)}", params
+
+
+def _sum_expert_counters(experts=None, status=None):
+    query, params = expert_counters_query(experts, status)
+    with connect_db() as conn, conn.cursor() as cur:
+        queries.execute(cur, queries.dynamic("expert_counters", query), params)
         return cur.fetchone()[0]
 
 
-def get_expert_deal_details(deal_id):
+def count_expert_deals(expert_id=None, status=None):
+    """Число сделок в списке эксперта (его и не назначенные), без expert_id - всех сделок"""
+    return _sum_expert_counters([expert_id, 0] if expert_id else None, status)
+
+
+def check_expert_counters():
+    """Расхождения счетчиков с таблицей: [(id_ce, status, по счетчику, фактически)]"""
     with connect_db() as conn, conn.cursor() as cur:
-        cur.execute("""
-            SELECT 
-                e.id, e.date_appearance, 
-                u.full_name AS manager_name, 
-                c.name AS client_name, c.unp,
-                e.car_brand, e.sales_car, 
-                e.skp_or_bl, e.status, 
-                e.shipment_or_signing, e.prepayment,
-                e.contract_term, e.currency_contract, 
-                e.interest_rate, e.use_number_cert, 
-                e.use_date_cert, e.express, 
-                e.electric_car, e.amount_financing,
-                e.shipping_date, e.expert_comment,
-                e.manager_comment, e.id_manager_deal,
-                e.original_or_skan, e.solution_owner,
-                e.date_for_ce, e.date_credit_committee,
-                e.date_protocol, e.date_signing_contract,
-                ce.full_name AS expert_name,
-                e.id_ce
-            FROM deals_expert e
-            LEFT JOIN users u ON e.id_manager = u.id
-            LEFT JOIN clients c ON e.id_client = c.id
-            LEFT JOIN users ce ON e.id_ce = ce.id
-        """, (deal_id,))
-        columns = [desc[0] for desc in cur.description]
-        row = cur.fetchone()
-        if row:
-            return dict(zip(columns, row))
-        return None
+        queries.execute(cur, queries.statement("check_expert_counters", """
+            SELECT COALESCE(c.id_ce, f.id_ce), COALESCE(c.status, f.status),
+                   COALESCE(c.deals, 0), COALESCE(f.deals, 0)
+            FROM deals_expert_counters c
+            FULL JOIN (
+                SELECT COALESCE(id_ce, 0) AS id_ce, COALESCE(status, '') AS status, COUNT(1) AS deals
+                FROM deals_expert
+                GROUP BY 1, 2
+            ) f ON f.id_ce = c.id_ce AND f.status = c.status
+            WHERE COALESCE(c.deals, 0) <> COALESCE(f.deals, 0)
+            ORDER BY 1, 2
+        """))
+        return cur.fetchall()
+
+
+def get_expert_deal_details(deal_id):
+    """Сделка эксперта с именами менеджера, клиента, эксперта и полями исходной сделки
+    менеджера (через кэш)"""
+    return cached(f"expert_deal:{deal_id}", lambda: _load_expert_deal_details(deal_id))
+
+
+EXPERT_DEAL_DETAILS_QUERY = queries.statement("expert_deal_details", """
+    SELECT 
+        e.id, e.date_appearance, 
+        u.full_name AS manager_name, 
+        c.name AS client_name, c.unp,
+        e.car_brand, e.sales_car, 
+        e.skp_or_bl, e.status, 
+        e.shipment_or_signing, e.prepayment,
+        e.contract_term, e.currency_contract, 
+        e.interest_rate, e.use_number_cert, 
+        e.use_date_cert, e.express, 
+        e.electric_car, e.amount_financing,
+        e.shipping_date, e.expert_comment,
+        e.manager_comment, e.id_manager_deal,
+        e.original_or_skan, e.solution_owner,
+        e.date_for_ce, e.date_credit_committee,
+        e.date_protocol, e.date_signing_contract,
+        ce.full_name AS expert_name,
+        e.id_ce,
+        m.status AS manager_deal_status,
+        m.date_first_contact AS manager_deal_date_first_contact,
+        m.m_plan_ship AS manager_deal_m_plan_ship,
+        m.sales_channel AS manager_deal_sales_channel,
+        m.name_agent AS manager_deal_name_agent,
+        m.description AS manager_deal_description
+    FROM deals_expert e
+    LEFT JOIN deals_managers m ON e.id_manager_deal = m.id
+    LEFT JOIN users u ON e.id_manager = u.id
+    LEFT JOIN clients c ON e.id_client = c.id
+    LEFT JOIN users ce ON e.id_ce = ce.id
+    WHERE e.id = %s
+""")
+
+
+def _load_expert_deal_details(deal_id):
+    with connect_db() as conn, conn.cursor(cursor_factory=RecordCursor) as cur:
+        queries.execute(cur, EXPERT_DEAL_DETAILS_QUERY, (deal_id,))
+        return cur.fetchone()
 
 
 def update_expert_deal(deal_id, **kwargs):
     with connect_db() as conn, conn.cursor() as cur:
         try:
-            cur.execute("""
+            queries.execute(cur, queries.statement("update_expert_deal", """
                 UPDATE deals_expert SET
                     original_or_skan = %(original_or_skan)s,
                     solution_owner = %(solution_owner)s,
@@ -444,40 +998,191 @@ def update_expert_deal(deal_id, **kwargs):
                     id_ce = %(id_ce)s,
                     updated_at = CURRENT_TIMESTAMP
                 WHERE id = %(deal_id)s
-            """, {**kwargs, 'deal_id': deal_id})
-            conn.commit()
+            """), {**kwargs, 'deal_id': deal_id})
         except Exception as e:
-            conn.rollback()
             raise ValueError(f"Ошибка при обновлении сделки эксперта: {str(e)}")
+    invalidate(f"expert_deal:{deal_id}")
 
 
 # В db.py добавляем новые функции
 
 def get_all_clients():
     """Получает список всех клиентов"""
-    with connect_db() as conn, conn.cursor() as cur:
-        cur.execute("""
+    with connect_db() as conn, conn.cursor(cursor_factory=RecordCursor) as cur:
+        queries.execute(cur, queries.statement("all_clients", """
             SELECT id, name, unp, contact_person, contact_phone, contact_email
             FROM clients
             ORDER BY name
-        """)
-        columns = [desc[0] for desc in cur.description]
-        return [dict(zip(columns, row)) for row in cur.fetchall()]
+        """))
+        return cur.fetchall()
+
+def _like_escape(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_clients_query(query, page=1, per_page=50):
+    """Запросы числа найденных и страницы клиентов с общими именованными параметрами"""
+    query = (query or '').strip()
+    params = {
+        'q': query,
+        'contains': f"%{_like_escape(query)}%",
+        'prefix': f"{_like_escape(query)}%",
+        'limit': per_page,
+        'offset': (page - 1) * per_page,
+    }
+    if query:
+        # Подстрочный поиск ILIKE обслуживают GIN-индексы pg_trgm
+        where = """
+            WHERE name ILIKE %(contains)s
+               OR contact_person ILIKE %(contains)s
+               OR contact_email ILIKE %(contains)s
+               OR unp LIKE %(prefix)s
+        """
+        order = "unp = %(q)s DESC, similarity(name, %(q)s) DESC, name"
+    else:
+        where = ""
+        order = "name"
+
+    count_query = f"SELECT COUNT(1) FROM clients {where}"
+    page_query = f"""
+        SELECT id, name, unp, contact_person, contact_phone, contact_email
+        FROM clients
+        {where}
+        ORDER BY {order}
+        LIMIT %(limit)s OFFSET %(offset)s
+    """
+    return count_query, page_query, params
+
+
+def search_clients(query, page=1, per_page=50):
+    """Ищет клиентов по наименованию, УНП, контактному лицу и email.
+
+    Возвращает (клиенты текущей страницы, общее количество найденных).
+    """
+    count_query, page_query, params = search_clients_query(query, page, per_page)
+    with connect_db() as conn, conn.cursor(cursor_factory=RecordCursor) as cur:
+        queries.execute(cur, queries.dynamic("clients_count", count_query), params)
+        total = cur.fetchone()[0]
+
+        queries.execute(cur, queries.dynamic("clients_page", page_query), params)
+        return cur.fetchall(), total
+
+
+def suggest_clients(query, limit=10):
+    """Подсказки для поля ввода: клиенты по префиксу УНП или подстроке наименования"""
+    query = (query or '').strip()
+    if not query:
+        return []
+    with connect_db() as conn, conn.cursor() as cur:
+        queries.execute(cur, queries.statement("suggest_clients", """
+            SELECT id, name, unp
+            FROM clients
+            WHERE unp LIKE %(prefix)s OR name ILIKE %(contains)s
+            ORDER BY unp = %(q)s DESC, similarity(name, %(q)s) DESC, name
+            LIMIT %(limit)s
+        """), {
+            'q': query,
+            'contains': f"%{_like_escape(query)}%",
+            'prefix': f"{_like_escape(query)}%",
+            'limit': limit,
+        })
+        return dicts(cur)
+
+
+# Сколько секунд живет кэш состава сотрудников. Пользователей, созданных в других
+# процессах, этот процесс увидит не позже чем через это время.
+ROSTER_CACHE_TTL = float(os.getenv("ROSTER_CACHE_TTL", 300))
+
+_roster_cache = {}
+_roster_lock = threading.Lock()
+
+
+def invalidate_roster():
+    with _roster_lock:
+        _roster_cache.clear()
+
+
+ROSTER_QUERY = queries.statement("roster", """
+    SELECT id, username, full_name, role
+    FROM users
+    ORDER BY role, full_name
+""")
+
+
+def cached_roster():
+    """Состав сотрудников из кэша процесса или None, если кэш устарел"""
+    with _roster_lock:
+        cached = _roster_cache.get('roster')
+        if cached and time.monotonic() - cached[1] < ROSTER_CACHE_TTL:
+            return cached[0]
+    return None
+
+
+def store_roster(users):
+    """Группирует пользователей по ролям и кладет в кэш процесса"""
+    roster = {}
+    for user in users:
+        roster.setdefault(user.role, []).append(user)
+    with _roster_lock:
+        _roster_cache['roster'] = (roster, time.monotonic())
+    return roster
+
+
+def get_roster():
+    """Все пользователи одним запросом, сгруппированные по ролям: {роль: [пользователь]}"""
+    roster = cached_roster()
+    if roster is not None:
+        return roster
+
+    with connect_db() as conn, conn.cursor(cursor_factory=RecordCursor) as cur:
+        queries.execute(cur, ROSTER_QUERY)
+        return store_roster(cur.fetchall())
+
 
 def get_users_by_role(role):
     """Получает пользователей по роли"""
-    with connect_db() as conn, conn.cursor() as cur:
-        cur.execute("""
-            SELECT id, username, full_name, role
-            FROM users
-            WHERE role = %s
-            ORDER BY full_name
-        """, (role,))
-        columns = [desc[0] for desc in cur.description]
-        return [dict(zip(columns, row)) for row in cur.fetchall()]
+    # Записи неизменяемы, поэтому копировать их из кэша не нужно
+    return list(get_roster().get(role, []))
+
 
 def count_users_by_role(role):
     """Считает количество пользователей по роли"""
+    return len(get_roster().get(role, []))
+
+
+def get_portfolio_schedule_inputs():
+    """Параметры графика по сделкам в работе: [(сумма, ставка, срок, валюта, дата начала)].
+    Дата начала - плановая отгрузка, при ее отсутствии - первый контакт."""
+    with connect_db() as conn, conn.cursor() as cur:
+        queries.execute(cur, queries.statement("portfolio_schedule_inputs", """
+            SELECT amount_financing, interest_rate, contract_term, currency_contract,
+                   COALESCE(m_plan_ship, date_first_contact::date)
+            FROM deals_managers
+            WHERE amount_financing > 0 AND interest_rate >= 0 AND contract_term > 0
+              AND NOT (COALESCE(status, '') = ANY(%s))
+        """), (deal_filters.DEAL_CLOSED_STATUSES,))
+        return cur.fetchall()
+
+
+def get_employee_workload():
+    """Нагрузка сотрудников одним запросом: {id: {'open_deals': n, 'volume': {валюта: сумма}}}.
+    Для менеджеров считаются их сделки, для экспертов - назначенные им сделки экспертизы."""
     with connect_db() as conn, conn.cursor() as cur:
-        cur.execute("SELECT COUNT(*) FROM users WHERE role = %s", (role,))
-        return cur.fetchone()[0]
\ No newline at end of file
+        queries.execute(cur, queries.statement("employee_workload", """
+            SELECT id_users, currency_contract, COUNT(1), SUM(amount_financing)
+            FROM deals_managers
+            WHERE id_users IS NOT NULL AND NOT (COALESCE(status, '') = ANY(%s))
+            GROUP BY id_users, currency_contract
+            UNION ALL
+            SELECT id_ce, currency_contract, COUNT(1), SUM(amount_financing)
+            FROM deals_expert
+            WHERE id_ce IS NOT NULL AND NOT (COALESCE(status, '') = ANY(%s))
+            GROUP BY id_ce, currency_contract
+        """), (deal_filters.DEAL_CLOSED_STATUSES, deal_filters.EXPERT_DEAL_CLOSED_STATUSES))
+        workload = {}
+        for user_id, currency, deals, volume in cur.fetchall():
+            item = workload.setdefault(user_id, {'open_deals': 0, 'volume': {}})
+            item['open_deals'] += deals
+            if volume is not None:
+                item['volume'][currency or '-'] = volume
+        return workload
@@ -0,0 +1,227 @@
+import asyncio
+import contextlib
+import json
+import os
+import time
+
+try:
+    import asyncpg
+except ImportError:  # асинхронный доступ к базе нужен только в режиме ASGI (asgi.py)
+    asyncpg = None
+
+import cache
+import db
+import metrics
+import pagination
+import queries
+import rows as records
+import slow_queries
+
+# Асинхронные версии частых чтений из db.py для обработчиков asgi.py. SQL и кэши
+# (состав сотрудников, число строк, карточки сделок) общие с db.py, поэтому обе версии
+# возвращают одно и то же, а изменения через db.py сразу видны и здесь.
+
+# Пул свой у каждого процесса и цикла событий. Один процесс обслуживает много запросов
+# одновременно, поэтому размер пула задается отдельно от пула psycopg2.
+POOL_CONFIG = {
+    "min_size": int(os.getenv("DB_ASYNC_POOL_MIN", db.POOL_CONFIG["minconn"])),
+    "max_size": int(os.getenv("DB_ASYNC_POOL_MAX", db.POOL_CONFIG["maxconn"])),
+    "max_inactive_connection_lifetime": float(os.getenv("DB_ASYNC_POOL_IDLE", 300)),
+}
+# Запросы вне маршрутов ограничены тем же statement_timeout, что и в db.py
+if db.STATEMENT_TIMEOUT:
+    POOL_CONFIG["server_settings"] = {"statement_timeout": str(db.STATEMENT_TIMEOUT)}
+ACQUIRE_TIMEOUT = db.POOL_CONFIG["timeout"]
+
+_pool_future = None
+_pool_owner = None
+
+def to_asyncpg(query, params=()):
+    """Запрос с параметрами psycopg2 (%s или %(name)s) или запрос реестра queries ->
+    запрос с $1, $2... и аргументы. asyncpg сам готовит запросы на соединении и держит
+    их в своем кэше, поэтому PREPARE здесь не нужен."""
+    if isinstance(query, queries.Query):
+        text, order = query.text, query.order
+    else:
+        text, order = queries.numbered(query)
+    return text, queries.arguments(order, params)
+
+
+def _connect_kwargs():
+    config = db.DB_CONFIG
+    return {
+        "database": config["dbname"],
+        "user": config["user"],
+        "password": config["password"],
+        "host": config["host"],
+        "port": int(config["port"]) if config["port"] else None,
+    }
+
+
+async def get_pool():
+    """Пул asyncpg текущего процесса и цикла событий, создается при первом обращении"""
+    global _pool_future, _pool_owner
+    owner = (os.getpid(), asyncio.get_running_loop())
+    if _pool_future is None or _pool_owner != owner:
+        if asyncpg is None:
+            raise ValueError("Для режима ASGI установите пакет asyncpg")
+        # Создание пула - одна задача на всех: параллельные первые запросы ждут ее же
+        _pool_owner = owner
+        _pool_future = asyncio.ensure_future(asyncpg.create_pool(**_connect_kwargs(),
+                                                                 **POOL_CONFIG))
+    future = _pool_future
+    try:
+        return await future
+    except Exception:
+        if _pool_future is future:
+            _pool_future = None
+        raise
+
+
+async def close_pool():
+    global _pool_future
+    future, _pool_future = _pool_future, None
+    if future is not None and future.done() and not future.exception():
+        await future.result().close()
+
+
+def pool_stats():
+    if _pool_future is None or not _pool_future.done() or _pool_future.exception():
+        return {}
+    pool = _pool_future.result()
+    return {
+        "size": pool.get_size(),
+        "idle": pool.get_idle_size(),
+        "min": pool.get_min_size(),
+        "max": pool.get_max_size(),
+    }
+
+
+async def _call(conn, method, query, params=()):
+    sql, args = to_asyncpg(query, params)
+    # Бюджет маршрута (db.set_statement_timeout): по его истечении asyncpg отменяет
+    # запрос на сервере и бросает TimeoutError
+    budget = db.current_statement_timeout()
+    started = time.perf_counter()
+    error = None
+    try:
+        return await getattr(conn, method)(sql, *args, timeout=budget / 1000 if budget else None)
+    except BaseException as e:
+        error = getattr(e, 'sqlstate', None) or type(e).__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        if isinstance(query, queries.Query):
+            metrics.observe_query(query.name, elapsed, error is not None)
+            slow_queries.record(query, params, elapsed, error)
+        else:
+            # Запросы, собранные из фильтров, учитываются вместе
+            metrics.observe_query("async", elapsed, error is not None)
+
+
+@contextlib.asynccontextmanager
+async def connection():
+    """Соединение из пула с учетом времени ожидания в метриках"""
+    pool = await get_pool()
+    started = time.perf_counter()
+    async with pool.acquire(timeout=ACQUIRE_TIMEOUT) as conn:
+        metrics.observe_acquire("async", time.perf_counter() - started)
+        yield conn
+
+
+async def _run(method, query, params):
+    async with connection() as conn:
+        return await _call(conn, method, query, params)
+
+
+async def fetch(query, params=()):
+    return await _run('fetch', query, params)
+
+
+async def fetchrow(query, params=()):
+    return await _run('fetchrow', query, params)
+
+
+async def fetchval(query, params=()):
+    return await _run('fetchval', query, params)
+
+
+async def get_deals_keyset(per_page, cursor=None, filters=None, sort='id', descending=True):
+    query, params, key = db.deals_keyset_query(per_page, cursor, filters, sort, descending)
+    rows = await fetch(query, params)
+    return pagination.build_page(records.from_mappings(rows), per_page, cursor, key)
+
+
+async def estimate_rows(query, params=()):
+    plan = await fetchval("EXPLAIN (FORMAT JSON) " + query, params)
+    return int(json.loads(plan)[0]["Plan"]["Plan Rows"])
+
+
+async def estimate_count(table):
+    total = db.cached_count(table)
+    if total is not None:
+        return total
+
+    async with connection() as conn:
+        total = await _call(conn, 'fetchval', db.ESTIMATE_COUNT_QUERY, (table,))
+        if total < db.EXACT_COUNT_THRESHOLD:
+            total = await _call(conn, 'fetchval', db.EXACT_COUNT_QUERY.format(table=table))
+    return db.store_count(table, total)
+
+
+async def estimate_deals_count(filters=None):
+    if not filters:
+        return await estimate_count('deals_managers')
+    return await estimate_rows(*db.deals_count_query(filters))
+
+
+async def get_deal_details(deal_id):
+    """Сделка менеджера через тот же кэш, что db.get_deal_details"""
+    # Обращения к кэшу синхронные: для memory это словарь, redis отвечает быстрее,
+    # чем стоит переключение в поток
+    store = cache.get_cache()
+    key = f"deal:{deal_id}"
+    deal = store.get(key)
+    if deal is cache.MISS:
+        generation = store.generation(key)
+        row = await fetchrow(db.DEAL_DETAILS_QUERY, (deal_id,))
+        deal = records.from_mappings([row])[0] if row else None
+        if deal is not None:
+            store.set(key, deal, generation=generation)
+    return deal
+
+
+async def get_expert_deals_keyset(per_page, cursor=None, expert_id=None, filters=None, sort='id',
+                                  descending=True):
+    query, params, key = db.expert_deals_keyset_query(per_page, cursor, expert_id, filters, sort,
+                                                      descending)
+    rows = await fetch(query, params)
+    return pagination.build_page(records.from_mappings(rows), per_page, cursor, key)
+
+
+async def estimate_expert_deals_count(expert_id=None, filters=None):
+    query, params, exact = db.expert_deals_count_query(expert_id, filters)
+    if not exact:
+        return await estimate_rows(query, params)
+    return await fetchval(query, params)
+
+
+async def search_clients(query, page=1, per_page=50):
+    """Как db.search_clients: (клиенты страницы, общее количество найденных)"""
+    count_query, page_query, params = db.search_clients_query(query, page, per_page)
+    async with connection() as conn:
+        total = await _call(conn, 'fetchval', count_query, params)
+        rows = await _call(conn, 'fetch', page_query, params)
+    return records.from_mappings(rows), total
+
+
+async def get_roster():
+    roster = db.cached_roster()
+    if roster is None:
+        rows = await fetch(db.ROSTER_QUERY)
+        roster = db.store_roster(records.from_mappings(rows))
+    return roster
+
+
+async def get_users_by_role(role):
+    return list((await get_roster()).get(role, []))
@@ -0,0 +1,117 @@
+import datetime
+from decimal import Decimal, InvalidOperation
+from urllib.parse import urlencode
+
+
+def _date(value):
+    return datetime.date.fromisoformat(value)
+
+
+def _datetime(value):
+    return datetime.datetime.combine(_date(value), datetime.time())
+
+
+def _decimal(value):
+    try:
+        return Decimal(value.replace(',', '.').replace(' ', ''))
+    except InvalidOperation:
+        raise ValueError
+
+
+# Статусы из форм сделки менеджера и эксперта - для выпадающих списков фильтров
+DEAL_STATUSES = [
+    'Согласование условий', 'Отказ банка', 'Отказ клиента', 'На рассмотрении', 'Сбор документов',
+]
+EXPERT_DEAL_STATUSES = ['На рассмотрении', 'Одобрено', 'Отклонено', 'Требует доработки']
+
+# Завершенные статусы: такие сделки не входят в нагрузку сотрудника
+DEAL_CLOSED_STATUSES = ['Отказ банка', 'Отказ клиента']
+EXPERT_DEAL_CLOSED_STATUSES = ['Одобрено', 'Отклонено']
+
+CURRENCIES = ['BYN', 'USD', 'EUR', 'RUB']
+
+# Фильтры списков: параметр запроса -> (SQL-выражение, оператор, преобразование значения).
+# В SQL попадают только выражения из этих словарей, значения передаются параметрами.
+DEAL_FILTERS = {
+    'status': ('d.status', '=', str),
+    'manager': ('d.id_users', '=', int),
+    'client': ('d.id_client', '=', int),
+    'currency': ('d.currency_contract', '=', str),
+    'ship_from': ('d.m_plan_ship', '>=', _date),
+    'ship_to': ('d.m_plan_ship', '<=', _date),
+    'amount_min': ('d.amount_financing', '>=', _decimal),
+    'amount_max': ('d.amount_financing', '<=', _decimal),
+}
+
+EXPERT_DEAL_FILTERS = {
+    'status': ('e.status', '=', str),
+    'manager': ('e.id_manager', '=', int),
+    'expert': ('e.id_ce', '=', int),
+    'client': ('e.id_client', '=', int),
+    'currency': ('e.currency_contract', '=', str),
+    # shipping_date хранит время, поэтому границы - начало дня, а верхняя - следующего
+    'ship_from': ('e.shipping_date', '>=', _datetime),
+    'ship_to': ('e.shipping_date', '<', lambda value: _datetime(value) + datetime.timedelta(days=1)),
+    'amount_min': ('e.amount_financing', '>=', _decimal),
+    'amount_max': ('e.amount_financing', '<=', _decimal),
+}
+
+# Сортировки: параметр -> (SQL-выражение, тип для приведения значения из курсора);
+# None - сортировка только по id
+DEAL_SORTS = {
+    'id': None,
+    'date_first_contact': ('d.date_first_contact', 'timestamp'),
+    'status': ('d.status', 'varchar'),
+    'amount_financing': ('d.amount_financing', 'numeric'),
+    'm_plan_ship': ('d.m_plan_ship', 'date'),
+}
+
+EXPERT_DEAL_SORTS = {
+    'id': None,
+    'date_appearance': ('e.date_appearance', 'timestamp'),
+    'status': ('e.status', 'varchar'),
+    'amount_financing': ('e.amount_financing', 'numeric'),
+    'shipping_date': ('e.shipping_date', 'timestamp'),
+}
+
+
+def parse_filters(args, spec):
+    """Выбирает из параметров запроса известные фильтры и приводит значения к нужным типам"""
+    filters = {}
+    for name, (_, _, convert) in spec.items():
+        value = (args.get(name) or '').strip()
+        if not value:
+            continue
+        try:
+            filters[name] = convert(value)
+        except ValueError:
+            raise ValueError(f"Некорректное значение фильтра {name}")
+    return filters
+
+
+def parse_sort(args, sorts):
+    """Возвращает (имя сортировки, по убыванию) из параметров sort и order"""
+    sort = args.get('sort') or 'id'
+    if sort not in sorts:
+        raise ValueError(f"Сортировка по {sort} не поддерживается")
+    order = args.get('order') or 'desc'
+    if order not in ('asc', 'desc'):
+        raise ValueError("Порядок сортировки должен быть asc или desc")
+    return sort, order == 'desc'
+
+
+def where_conditions(filters, spec):
+    """Условия WHERE и параметры для разобранных фильтров"""
+    conditions = []
+    params = []
+    for name, value in filters.items():
+        expression, operator, _ = spec[name]
+        conditions.append(f"{expression} {operator} %s")
+        params.append(value)
+    return conditions, params
+
+
+def query_string(args):
+    """Параметры фильтров и сортировки списка для ссылок пагинации и выгрузки"""
+    return urlencode([(key, value) for key, value in args.items(multi=True)
+                      if key not in ('cursor', 'page', 'format') and value])
@@ -0,0 +1,116 @@
+import datetime
+from decimal import Decimal, InvalidOperation
+
+# Форма редактирования сделки менеджера: значения полей приводятся к типам колонок и
+# сравниваются с загруженной сделкой, в UPDATE попадают только изменившиеся колонки.
+# Версия сделки - ее updated_at на момент открытия формы.
+
+
+def _text(value):
+    return value
+
+
+def _int(value):
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError("ожидается целое число")
+
+
+def _decimal(value):
+    try:
+        return Decimal(value.replace(',', '.').replace(' ', ''))
+    except InvalidOperation:
+        raise ValueError("ожидается число")
+
+
+def _date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ValueError("ожидается дата ГГГГ-ММ-ДД")
+
+
+def _datetime(value):
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError("ожидается дата и время ГГГГ-ММ-ДДTЧЧ:ММ")
+
+
+def _bool(value):
+    return value == 'on'
+
+
+# Поле формы (оно же колонка deals_managers) -> преобразование значения.
+# Клиент и менеджер сделки в форме не меняются.
+EDIT_FIELDS = {
+    'date_first_contact': _datetime,
+    'car_brand': _text,
+    'sales_car': _text,
+    'skp_or_bl': _text,
+    'status': _text,
+    'shipment_or_signing': _text,
+    'prepayment': _text,
+    'contract_term': _int,
+    'currency_contract': _text,
+    'interest_rate': _decimal,
+    'use_number_cert': _int,
+    'use_date_cert': _date,
+    'issued_number_cert': _int,
+    'issued_date_cert': _date,
+    'express': _bool,
+    'electric_car': _bool,
+    'amount_financing': _decimal,
+    'm_plan_ship': _date,
+    'description': _text,
+    'sales_channel': _text,
+    'name_agent': _text,
+}
+
+
+def _same(convert, old, new):
+    if convert is _bool:
+        # NULL в старых строках и снятый флажок - одно и то же
+        return bool(old) == new
+    if convert is _datetime and old is not None and new is not None:
+        # Форма передает время с точностью до минуты
+        return old.replace(tzinfo=None) == new.replace(tzinfo=None) or (
+            new.second == new.microsecond == 0
+            and old.replace(second=0, microsecond=0, tzinfo=None) == new.replace(tzinfo=None))
+    return old == new
+
+
+def changes(deal, form):
+    """Изменившиеся поля сделки: {колонка: новое значение}. Поля, которых нет в форме,
+    не меняются; флажки, как в HTML-формах, приходят только отмеченными."""
+    result = {}
+    for field, convert in EDIT_FIELDS.items():
+        if convert is _bool:
+            value = _bool(form.get(field))
+        elif field not in form:
+            continue
+        else:
+            value = form.get(field)
+            try:
+                value = None if value in (None, '') else convert(value)
+            except ValueError as e:
+                raise ValueError(f"{field}: {e}")
+        if not _same(convert, getattr(deal, field), value):
+            result[field] = value
+    return result
+
+
+def version(deal):
+    """Версия сделки для скрытого поля формы"""
+    return deal.updated_at.isoformat() if deal.updated_at is not None else ''
+
+
+def parse_version(value):
+    """Версия из формы: datetime или None для сделок без updated_at"""
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError("Некорректная версия сделки")
@@ -0,0 +1,233 @@
+import argparse
+import uuid
+from contextlib import contextmanager
+
+import psycopg2.extensions
+
+import analytics
+import db
+import fx
+import queries
+import slow_queries
+from rows import RecordCursor
+
+# Планы уже показанных запросов: один и тот же SQL выводим один раз
+_plans = {}
+_new_plans = []
+_analyze = False
+
+
+def _remember_plan(conn, sql, params):
+    """Сохраняет план запроса, если такой SQL еще не встречался"""
+    key = " ".join(sql.split())
+    if key in _plans:
+        return
+    mode = slow_queries.explain_mode(sql)
+    if mode is None:
+        # Служебные команды (set_config, блокировки) не планируются
+        return
+    # ANALYZE выполняет запрос, поэтому для изменяющих запросов только план
+    prefix = "EXPLAIN (ANALYZE, BUFFERS) " if _analyze and mode == 'analyze' else "EXPLAIN "
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+        cur.execute(prefix + sql, params or None)
+        _plans[key] = [row[0] for row in cur.fetchall()]
+    _new_plans.append(key)
+
+
+# Модули, которые открывают курсоры как conn.cursor(cursor_factory=RecordCursor)
+READER_MODULES = (db, fx)
+
+_execute = queries.execute
+_in_registry = False
+
+
+def explained_execute(cur, query, params=()):
+    """Замена queries.execute: план снимается по тексту запроса реестра с его параметрами,
+    а сам запрос выполняется как обычно (PREPARE/EXECUTE при DB_PREPARE=1)"""
+    global _in_registry
+    _remember_plan(cur.connection, query.sql, params)
+    _in_registry = True
+    try:
+        return _execute(cur, query, params)
+    finally:
+        _in_registry = False
+
+
+class ExplainCursor(RecordCursor):
+    """Курсор, который перед выполнением запроса вне реестра сохраняет его план.
+    Наследует RecordCursor: на время сценария подменяет его в модулях, которые
+    открывают курсор с cursor_factory=RecordCursor."""
+
+    def execute(self, query, vars=None):
+        if not _in_registry:
+            _remember_plan(self.connection, query, vars)
+        return super().execute(query, vars)
+
+
+@contextmanager
+def step(conn, name):
+    """Выполняет шаг сценария в точке сохранения и печатает планы его новых запросов"""
+    _new_plans.clear()
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+        cur.execute("SAVEPOINT explain_step")
+        try:
+            yield
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT explain_step")
+            print(f"== {name}: ошибка: {e}\n")
+            return
+
+    print(f"== {name}")
+    for key in _new_plans:
+        print(f"-- {key[:160]}{'...' if len(key) > 160 else ''}")
+        for line in _plans[key]:
+            print(f"   {line}")
+    print()
+
+
+def run_scenario(conn):
+    """Вызывает функции db.py на тестовых данных так, чтобы выполнился каждый запрос"""
+    suffix = uuid.uuid4().hex[:8]
+    username = f"explain_{suffix}"
+    unp = suffix.upper()
+    ctx = {}
+
+    with step(conn, "create_user"):
+        ctx['user_id'] = db.create_user(username, "-", "manager", "Explain Manager")
+        ctx['expert_id'] = db.create_user(username + "_ce", "-", "expert", "Explain Expert")
+    with step(conn, "get_user_by_username"):
+        db.get_user_by_username(username)
+    with step(conn, "get_users_by_role"):
+        db.get_users_by_role('manager')
+    with step(conn, "count_users_by_role"):
+        db.count_users_by_role('manager')
+
+    with step(conn, "get_or_create_client"):
+        ctx['client_id'] = db.get_or_create_client("Explain Client", unp)
+        db.get_or_create_client("Explain Client", unp)
+    with step(conn, "search_client"):
+        db.search_client("Explain Client")
+    with step(conn, "get_all_clients"):
+        db.get_all_clients()
+    with step(conn, "search_clients"):
+        db.search_clients("Explain", 2, 50)
+        db.search_clients("", 1, 50)
+    with step(conn, "suggest_clients"):
+        db.suggest_clients(unp[:4])
+
+    with step(conn, "create_deal_in_db"):
+        ctx['deal_id'] = db.create_deal_in_db(
+            date_first_contact=None, user_id=ctx['user_id'], client_id=ctx['client_id'],
+            car_brand="Explain", sales_car=None, skp_or_bl=None, status="Согласование условий",
+            shipment_or_signing=None, prepayment=None, contract_term=36, currency_contract="BYN",
+            interest_rate=10, use_number_cert=None, use_date_cert=None, issued_number_cert=None,
+            issued_date_cert=None, express=False, electric_car=False, amount_financing=100000,
+            m_plan_ship=None, description=None, sales_channel=None, name_agent=None,
+        )
+    with step(conn, "get_deals_paginated"):
+        db.get_deals_paginated(5, 10)
+    with step(conn, "get_deals_keyset"):
+        db.get_deals_keyset(10)
+        db.get_deals_keyset(10, ('next', ctx['deal_id']))
+        db.get_deals_keyset(10, ('prev', ctx['deal_id']))
+    with step(conn, "get_deals_keyset (фильтры и сортировка)"):
+        filters = {'status': "Согласование условий", 'manager': ctx['user_id'], 'currency': "BYN"}
+        db.get_deals_keyset(10, None, filters, 'm_plan_ship')
+        db.get_deals_keyset(10, ('next', [None, ctx['deal_id']]), filters, 'm_plan_ship')
+        db.get_deals_keyset(10, ('next', ["100000", ctx['deal_id']]), {'amount_min': 1}, 'amount_financing')
+    with step(conn, "count_deals"):
+        db.count_deals()
+    with step(conn, "estimate_deals_count"):
+        db.estimate_deals_count({'status': "Согласование условий", 'manager': ctx['user_id']})
+    with step(conn, "get_deal_details"):
+        deal = db.get_deal_details(ctx['deal_id'])
+    with step(conn, "update_deal"):
+        db.update_deal(
+            ctx['deal_id'], deal.date_first_contact, deal.id_client, deal.car_brand,
+            deal.sales_car, deal.skp_or_bl, deal.status, deal.shipment_or_signing,
+            deal.prepayment, deal.contract_term, deal.currency_contract,
+            deal.interest_rate, deal.use_number_cert, deal.use_date_cert,
+            deal.issued_number_cert, deal.issued_date_cert, deal.express,
+            deal.electric_car, deal.amount_financing, deal.m_plan_ship,
+            deal.description, deal.sales_channel, deal.name_agent,
+        )
+    with step(conn, "update_deal_fields"):
+        deal = db.get_deal_for_edit(ctx['deal_id'])
+        db.update_deal_fields(ctx['deal_id'], {'status': "Сбор документов"}, deal.updated_at)
+    with step(conn, "update_deal_status"):
+        db.update_deal_status(ctx['deal_id'], "На рассмотрении")
+
+    expert_fields = dict(
+        id_manager_deal=ctx['deal_id'], id_manager=ctx['user_id'], id_client=ctx['client_id'],
+        car_brand="Explain", sales_car=None, skp_or_bl=None, shipment_or_signing=None,
+        prepayment=None, contract_term=36, currency_contract="BYN", interest_rate=10,
+        use_number_cert=None, use_date_cert=None, express=False, electric_car=False,
+        status="На рассмотрении",
+    )
+    with step(conn, "update_or_create_expert_deal"):
+        # Первый вызов создает запись эксперта, второй - обновляет ее
+        db.update_or_create_expert_deal(**expert_fields)
+        db.update_or_create_expert_deal(**expert_fields)
+    with step(conn, "get_expert_deal_by_manager_deal_id"):
+        ctx['expert_deal_id'] = db.get_expert_deal_by_manager_deal_id(ctx['deal_id'])
+    with step(conn, "update_expert_deal"):
+        db.update_expert_deal(
+            ctx['expert_deal_id'], original_or_skan=None, solution_owner=None, date_for_ce=None,
+            status="На рассмотрении", date_credit_committee=None, date_protocol=None,
+            date_signing_contract=None, shipping_date=None, expert_comment=None,
+            id_ce=ctx['expert_id'],
+        )
+    with step(conn, "get_expert_deals_paginated"):
+        db.get_expert_deals_paginated(5, 10)
+        db.get_expert_deals_paginated(1, 10, ctx['expert_id'])
+    with step(conn, "get_expert_deals_keyset"):
+        db.get_expert_deals_keyset(10)
+        db.get_expert_deals_keyset(10, ('next', ctx['expert_deal_id']), ctx['expert_id'])
+        db.get_expert_deals_keyset(10, None, filters={'status': "На рассмотрении"}, sort='shipping_date')
+    with step(conn, "count_expert_deals"):
+        db.count_expert_deals(ctx['expert_id'])
+        db.count_expert_deals(None, "На рассмотрении")
+    with step(conn, "estimate_expert_deals_count"):
+        db.estimate_expert_deals_count(None, {'expert': ctx['expert_id']})
+        db.estimate_expert_deals_count(ctx['expert_id'], {'currency': "BYN"})
+    with step(conn, "get_expert_deal_details"):
+        db.get_expert_deal_details(ctx['expert_deal_id'])
+
+    with step(conn, "analytics"):
+        analytics.volume_by_month()
+        analytics.funnel(by_manager=True)
+        analytics.stage_durations()
+    with step(conn, "portfolio_totals"):
+        fx.portfolio_totals()
+
+
+def main():
+    global _analyze
+    parser = argparse.ArgumentParser(
+        description="Печатает планы выполнения запросов db.py. Сценарий создает тестовые "
+                    "данные в транзакции, которая затем откатывается.")
+    parser.add_argument("--analyze", action="store_true",
+                        help="для SELECT выполнять EXPLAIN (ANALYZE, BUFFERS)")
+    args = parser.parse_args()
+    _analyze = args.analyze
+
+    with db.unit_of_work() as uow:
+        uow.rollback_only = True
+        with db.connect_db() as conn:
+            default_factory = conn.cursor_factory
+            conn.cursor_factory = ExplainCursor
+            # Читатели db.py и fx.py передают cursor_factory явно и мимо фабрики соединения
+            for module in READER_MODULES:
+                module.RecordCursor = ExplainCursor
+            queries.execute = explained_execute
+            try:
+                run_scenario(conn)
+            finally:
+                queries.execute = _execute
+                for module in READER_MODULES:
+                    module.RecordCursor = RecordCursor
+                conn.cursor_factory = default_factory
+
+
+if __name__ == "__main__":
+    main()
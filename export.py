@@ -0,0 +1,81 @@
+import csv
+import datetime
+import io
+import os
+import tempfile
+
+from flask import Response
+
+try:
+    import openpyxl
+except ImportError:  # XLSX поддерживается только при установленном openpyxl
+    openpyxl = None
+
+# Размер порции, которой ответ уходит клиенту
+CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 64 * 1024))
+
+
+def _format_value(value):
+    if value is None:
+        return ''
+    if value is True:
+        return 'Да'
+    if value is False:
+        return 'Нет'
+    return value
+
+
+def csv_chunks(columns, rows):
+    """Кодирует строки в CSV (разделитель «;», UTF-8 с BOM для Excel) порциями по CHUNK_SIZE"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    buffer.write('\ufeff')
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_format_value(value) for value in row])
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def xlsx_chunks(columns, rows):
+    """Пишет строки в XLSX в режиме write_only через временный файл и отдает его порциями"""
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(columns)
+    for row in rows:
+        # Excel не поддерживает даты с часовым поясом
+        sheet.append([
+            value.replace(tzinfo=None) if isinstance(value, datetime.datetime) else value
+            for value in row
+        ])
+
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def export_response(columns, rows, basename, fmt='csv'):
+    """Потоковый (chunked) ответ с выгрузкой в CSV или XLSX"""
+    filename = f"{basename}_{datetime.date.today():%Y%m%d}.{fmt}"
+    if fmt == 'xlsx':
+        if openpyxl is None:
+            raise ValueError("Для выгрузки в XLSX установите пакет openpyxl")
+        body = xlsx_chunks(columns, rows)
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    elif fmt == 'csv':
+        body = csv_chunks(columns, rows)
+        mimetype = 'text/csv'
+    else:
+        raise ValueError("Поддерживаются форматы csv и xlsx")
+
+    return Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+    })
@@ -0,0 +1,231 @@
+import argparse
+import csv
+import datetime
+import io
+import itertools
+import os
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+from psycopg2.extras import execute_values
+
+import cache
+import db
+from rows import RecordCursor
+
+# Валюта, в которой хранятся курсы: rate - цена единицы валюты в базовой валюте
+BASE_CURRENCY = os.getenv("FX_BASE_CURRENCY", "BYN")
+# Сколько секунд процесс хранит курсы на дату; загрузка курсов в этом процессе
+# сбрасывает кэш сразу, в остальных - не позже чем через это время
+FX_CACHE_TTL = float(os.getenv("FX_CACHE_TTL", 3600))
+# Итоги портфеля зависят и от сделок, поэтому живут недолго
+PORTFOLIO_CACHE_TTL = float(os.getenv("PORTFOLIO_CACHE_TTL", 60))
+
+DATE_FORMATS = ('%Y-%m-%d', '%d.%m.%Y')
+
+_rates_cache = {}
+_rates_lock = threading.Lock()
+_portfolio_cache = cache.MemoryCache(maxsize=256, ttl=PORTFOLIO_CACHE_TTL)
+
+
+def _parse_date(value):
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value.strip(), fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"некорректная дата {value}")
+
+
+def normalize_currency(value):
+    """Код валюты сделки: поле свободное, поэтому приводим к верхнему регистру;
+    пустое значение - базовая валюта"""
+    return (value or '').strip().upper() or BASE_CURRENCY
+
+
+def read_rates(stream):
+    """Читает CSV с колонками date, currency, rate и необязательной scale (курс за scale
+    единиц, как публикует НБ РБ). Возвращает [(валюта, дата, курс за единицу)]."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    first_line = text.readline()
+    delimiter = max(',;\t', key=first_line.count)
+    reader = csv.DictReader(itertools.chain([first_line], text), delimiter=delimiter)
+    missing = {'date', 'currency', 'rate'} - set(reader.fieldnames or [])
+    if missing:
+        raise ValueError("В файле курсов нет колонок: " + ", ".join(sorted(missing)))
+
+    rates = {}
+    for line_no, row in enumerate(reader, start=2):
+        try:
+            rate_date = _parse_date(row['date'] or '')
+            currency = normalize_currency(row['currency'])
+            rate = Decimal((row['rate'] or '').replace(',', '.').replace(' ', ''))
+            scale = Decimal((row.get('scale') or '1').replace(',', '.'))
+            if rate <= 0 or scale <= 0:
+                raise ValueError("курс должен быть положительным")
+        except InvalidOperation:
+            raise ValueError(f"Строка {line_no}: некорректный курс")
+        except ValueError as e:
+            raise ValueError(f"Строка {line_no}: {e}")
+        if currency == BASE_CURRENCY:
+            continue
+        # Повтор валюты и даты в файле - берем последнюю строку
+        rates[(currency, rate_date)] = rate / scale
+    return [(currency, rate_date, rate) for (currency, rate_date), rate in rates.items()]
+
+
+def load_rates(rates):
+    """Загружает курсы одним запросом; существующие на ту же дату заменяются"""
+    if not rates:
+        return 0
+    with db.connect_db() as conn, conn.cursor() as cur:
+        execute_values(cur, """
+            INSERT INTO fx_rates (currency, rate_date, rate)
+            VALUES %s
+            ON CONFLICT (currency, rate_date) DO UPDATE
+            SET rate = EXCLUDED.rate, loaded_at = CURRENT_TIMESTAMP
+        """, rates, page_size=1000)
+    invalidate_rates()
+    db.on_commit(invalidate_rates)
+    return len(rates)
+
+
+def invalidate_rates():
+    with _rates_lock:
+        _rates_cache.clear()
+    _portfolio_cache.clear()
+
+
+def rates_on(as_of=None):
+    """Курсы на дату: для каждой валюты последний курс не позже as_of.
+    Возвращает {валюта: курс}, базовая валюта всегда с курсом 1."""
+    as_of = as_of or datetime.date.today()
+    now = time.monotonic()
+    with _rates_lock:
+        cached = _rates_cache.get(as_of)
+        if cached and now - cached[1] < FX_CACHE_TTL:
+            return cached[0]
+
+    with db.connect_db() as conn, conn.cursor() as cur:
+        cur.execute("""
+            SELECT DISTINCT ON (currency) currency, rate
+            FROM fx_rates
+            WHERE rate_date <= %s
+            ORDER BY currency, rate_date DESC
+        """, (as_of,))
+        rates = dict(cur.fetchall())
+    rates[BASE_CURRENCY] = Decimal(1)
+
+    with _rates_lock:
+        _rates_cache[as_of] = (rates, now)
+    return rates
+
+
+def _totals_row(row):
+    return {
+        'deals': row.deals,
+        'amount': float(row.amount or 0),
+        'unconverted_deals': row.unconverted_deals,
+    }
+
+
+def portfolio_totals(currency=None, as_of=None):
+    """Сумма финансирования портфеля в одной валюте по курсам на дату as_of: итог и разрезы
+    по менеджерам, статусам и месяцам первого контакта одним запросом (GROUPING SETS).
+    Сделки в валютах без курса не пересчитываются и считаются отдельно."""
+    currency = normalize_currency(currency)
+    as_of = as_of or datetime.date.today()
+    rates = rates_on(as_of)
+    if currency not in rates:
+        raise ValueError(f"Нет курса {currency} на {as_of:%d.%m.%Y}")
+
+    # Курсы входят в ключ: исправленный курс на ту же дату дает новый результат
+    key = f"{currency}:{as_of}:{hash(tuple(sorted(rates.items())))}"
+    result = _portfolio_cache.get(key)
+    if result is not cache.MISS:
+        return result
+
+    with db.connect_db() as conn, conn.cursor(cursor_factory=RecordCursor) as cur:
+        cur.execute("""
+            WITH rates (currency, rate) AS (
+                SELECT * FROM unnest(%(currencies)s::varchar[], %(rates)s::numeric[])
+            ),
+            deals AS (
+                SELECT id_users, status,
+                       date_trunc('month', date_first_contact)::date AS month,
+                       COALESCE(NULLIF(UPPER(TRIM(currency_contract)), ''), %(base)s) AS currency,
+                       amount_financing
+                FROM deals_managers
+                WHERE amount_financing IS NOT NULL
+            )
+            SELECT GROUPING(d.id_users, d.status, d.month) AS grouping_set,
+                   d.id_users, d.status, d.month,
+                   COUNT(1) AS deals,
+                   ROUND(SUM(d.amount_financing * r.rate) FILTER (WHERE r.rate IS NOT NULL)
+                         / %(target_rate)s, 2) AS amount,
+                   COUNT(1) FILTER (WHERE r.rate IS NULL) AS unconverted_deals,
+                   array_agg(DISTINCT d.currency) FILTER (WHERE r.rate IS NULL)
+                       AS unconverted_currencies
+            FROM deals d
+            LEFT JOIN rates r ON r.currency = d.currency
+            GROUP BY GROUPING SETS ((d.id_users), (d.status), (d.month), ())
+        """, {
+            'currencies': list(rates),
+            'rates': list(rates.values()),
+            'base': BASE_CURRENCY,
+            'target_rate': rates[currency],
+        })
+        rows = cur.fetchall()
+
+    names = {user.id: user.full_name
+             for users in db.get_roster().values() for user in users}
+    result = {
+        'currency': currency,
+        'as_of': as_of.isoformat(),
+        'rates': {name: float(rate) for name, rate in sorted(rates.items())},
+        'total': {'deals': 0, 'amount': 0.0, 'unconverted_deals': 0},
+        'unconverted_currencies': [],
+        'by_manager': [],
+        'by_status': [],
+        'by_month': [],
+    }
+    # GROUPING: 1 в разряде - столбец не входит в набор группировки
+    for row in rows:
+        item = _totals_row(row)
+        if row.grouping_set == 0b011:
+            item['id_manager'] = row.id_users
+            item['manager_name'] = names.get(row.id_users)
+            result['by_manager'].append(item)
+        elif row.grouping_set == 0b101:
+            item['status'] = row.status
+            result['by_status'].append(item)
+        elif row.grouping_set == 0b110:
+            item['month'] = row.month.isoformat() if row.month else None
+            result['by_month'].append(item)
+        else:
+            result['total'] = item
+            result['unconverted_currencies'] = sorted(row.unconverted_currencies or [])
+
+    result['by_manager'].sort(key=lambda item: -item['amount'])
+    result['by_status'].sort(key=lambda item: -item['amount'])
+    result['by_month'].sort(key=lambda item: item['month'] or '')
+    _portfolio_cache.set(key, result)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Загрузка курсов валют из CSV (колонки date, currency, rate[, scale])")
+    parser.add_argument("file")
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as f:
+        rates = read_rates(f)
+    with db.unit_of_work():
+        loaded = load_rates(rates)
+    print(f"Загружено курсов: {loaded}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,50 @@
-from flask import Flask, request, render_template, redirect, session, jsonify, url_for
+from flask import Flask, request, render_template, redirect, session, jsonify, url_for, g
 import db
+import analytics
+import bulk_import
+import deal_filters
+import deal_form
+import export
+import fx
+import metrics
+import datetime
 import math
-from auth import hash_password, verify_password
+import os
+import pagination
+import queries
+import schedule
+import slow_queries
+import auth
 from functools import wraps
 
+import psycopg2.errors
+
 app = Flask(__name__)
 app.secret_key = 'your-secret-key'  # нужно для session
+# Первым, чтобы время запроса включало работу остальных обработчиков
+metrics.init_app(app)
+
+
+# Все обращения к БД в рамках одного запроса идут через одно соединение и одну транзакцию
+@app.before_request
+def open_unit_of_work():
+    g.db_uow = db.begin_unit_of_work(statement_timeout=db.STATEMENT_TIMEOUT)
+    analytics.ensure_scheduler()
+
+
+@app.after_request
+def commit_unit_of_work(response):
+    uow = g.get('db_uow')
+    if uow is not None:
+        db.complete_unit_of_work(uow, commit=response.status_code < 400)
+    return response
+
+
+@app.teardown_request
+def close_unit_of_work(exc):
+    uow = g.pop('db_uow', None)
+    if uow is not None:
+        db.end_unit_of_work(uow)
 
 
 # Декоратор для проверки авторизации
@@ -18,6 +57,43 @@ def login_required(f):
     return decorated_function
 
 
+def boss_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get('role') != 'boss':
+            return jsonify({"success": False, "message": "Доступ запрещен"}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+# Бюджеты statement_timeout маршрутов переопределяются без правки кода:
+# DB_ROUTE_TIMEOUTS="show_deals=2000,analytics_funnel=30000" (мс, по имени функции)
+ROUTE_STATEMENT_TIMEOUTS = {
+    name.strip(): int(ms)
+    for name, ms in (item.split('=', 1) for item in os.getenv("DB_ROUTE_TIMEOUTS", "").split(',')
+                     if item.strip())
+}
+
+
+def statement_timeout(ms):
+    """Свой бюджет времени запросов к БД для маршрута вместо DB_STATEMENT_TIMEOUT"""
+    def decorator(f):
+        budget = ROUTE_STATEMENT_TIMEOUTS.get(f.__name__, ms)
+
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            db.set_statement_timeout(budget)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+@app.errorhandler(psycopg2.errors.QueryCanceled)
+def query_canceled(e):
+    # Запрос прерван по statement_timeout; транзакция откатывается, соединение свободно
+    return "Запрос к базе данных выполнялся слишком долго, попробуйте сузить выборку", 503
+
+
 # Маршруты для авторизации
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -25,11 +101,17 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
 
-        user = db.get_user_by_username(username)
-        if user and verify_password(user['password_hash'], password):
-            session['user_id'] = user['id']
-            session['username'] = user['username']
-            session['role'] = user['role']
+        try:
+            user = auth.authenticate(username, password)
+        except auth.LoginThrottled as e:
+            return render_template('login.html', error=str(e)), 429, \
+                {'Retry-After': str(int(e.retry_after) + 1)}
+        except auth.AuthBusy as e:
+            return render_template('login.html', error=str(e)), 503, {'Retry-After': '1'}
+        if user:
+            session['user_id'] = user.id
+            session['username'] = user.username
+            session['role'] = user.role
             return redirect(request.args.get('next') or url_for('index'))
 
         return render_template('login.html', error='Неверное имя пользователя или пароль')
@@ -110,53 +192,167 @@ def create_deal():
     return render_template('create_deal.html')
 
 
+@app.route('/import', methods=['GET', 'POST'])
+@login_required
+@statement_timeout(60000)
+def import_deals():
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            return jsonify({"success": False, "message": "Файл не выбран"}), 400
+
+        try:
+            report = bulk_import.import_deals(
+                bulk_import.read_rows(upload.stream, upload.filename),
+                default_user_id=session.get('user_id')
+            )
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        except Exception as e:
+            return jsonify({"success": False, "message": f"Внутренняя ошибка сервера: {str(e)}"}), 500
+
+        return jsonify({
+            "success": True,
+            "message": (f"Импортировано сделок: {report['imported']} из {report['rows']}, "
+                        f"новых клиентов: {report['clients_created']}, ошибок: {len(report['errors'])}"),
+            **report
+        })
+
+    return render_template('import_deals.html')
+
+
+# Размеры страниц списков; общие для обработчиков Flask и asgi.py
+DEALS_PER_PAGE = 10
+CLIENTS_PER_PAGE = 50
+
+
+def parse_deal_list(args):
+    """Фильтры, сортировка и курсор списка сделок из параметров запроса"""
+    filters = deal_filters.parse_filters(args, deal_filters.DEAL_FILTERS)
+    sort, descending = deal_filters.parse_sort(args, deal_filters.DEAL_SORTS)
+    return filters, sort, descending, pagination.decode_cursor(args.get('cursor'))
+
+
+def deal_list_context(total_deals, managers):
+    return dict(
+        total_deals=total_deals,
+        filter_query=deal_filters.query_string(request.args),
+        managers=managers,
+        statuses=deal_filters.DEAL_STATUSES,
+        currencies=deal_filters.CURRENCIES,
+        sorts=deal_filters.DEAL_SORTS,
+    )
+
+
+def render_keyset_page(template, page, list_context):
+    deals, next_cursor, prev_cursor = page
+    return render_template(template,
+                           deals=deals,
+                           next_cursor=next_cursor,
+                           prev_cursor=prev_cursor,
+                           last_cursor=pagination.LAST_CURSOR,
+                           **list_context)
+
+
 @app.route('/deals')
 @login_required
+@statement_timeout(3000)
 def show_deals():
-    page = int(request.args.get('page', 1))
-    per_page = 10
-    total_deals = db.count_deals()
-    total_pages = math.ceil(total_deals / per_page)
-    deals = db.get_deals_paginated(page, per_page)
-    return render_template('show_deals.html', deals=deals, page=page, total_pages=total_pages)
+    try:
+        filters, sort, descending, cursor = parse_deal_list(request.args)
+    except ValueError as e:
+        return str(e), 400
+
+    total_deals = db.estimate_deals_count(filters)
+    list_context = deal_list_context(total_deals, db.get_users_by_role('manager'))
+
+    # Старые ссылки вида ?page=N продолжают работать через OFFSET
+    if 'page' in request.args:
+        page = int(request.args.get('page', 1))
+        total_pages = math.ceil(total_deals / DEALS_PER_PAGE)
+        deals = db.get_deals_paginated(page, DEALS_PER_PAGE, filters)
+        return render_template('show_deals.html', deals=deals, page=page, total_pages=total_pages,
+                               **list_context)
+
+    try:
+        page = db.get_deals_keyset(DEALS_PER_PAGE, cursor, filters, sort, descending)
+    except ValueError as e:
+        return str(e), 400
+    return render_keyset_page('show_deals.html', page, list_context)
+
+
+@app.route('/deals/export')
+@login_required
+def export_deals():
+    try:
+        filters = deal_filters.parse_filters(request.args, deal_filters.DEAL_FILTERS)
+        return export.export_response(db.DEAL_EXPORT_COLUMNS, db.iter_deals_export(filters),
+                                      'deals', request.args.get('format', 'csv'))
+    except ValueError as e:
+        return str(e), 400
 
 
 @app.route('/deal/<int:deal_id>')
 @login_required
+@statement_timeout(1000)
 def view_deal(deal_id):
     deal = db.get_deal_details(deal_id)
     if not deal:
         return "Сделка не найдена", 404
 
-    deal_tuple = (
-        deal['id'],
-        deal['date_first_contact'],
-        deal.get('manager_name'),
-        deal.get('client_name'),
-        deal['car_brand'],
-        deal['sales_car'],
-        deal['skp_or_bl'],
-        deal['status'],
-        deal['shipment_or_signing'],
-        deal['prepayment'],
-        deal['contract_term'],
-        deal['currency_contract'],
-        deal['interest_rate'],
-        deal['use_number_cert'],
-        deal['use_date_cert'],
-        deal['issued_number_cert'],
-        deal['issued_date_cert'],
-        deal['express'],
-        deal['electric_car'],
-        deal['amount_financing'],
-        deal['m_plan_ship'],
-        deal['description'],
-        deal['sales_channel'],
-        deal['name_agent'],
-        deal['unp']
-    )
+    return render_template('view_deal.html', deal=deal, can_transfer=True)
+
 
-    return render_template('view_deal.html', deal=deal_tuple, can_transfer=True)
+@app.route('/deal/<int:deal_id>/schedule')
+@login_required
+@statement_timeout(1000)
+def deal_schedule(deal_id):
+    deal = db.get_deal_details(deal_id)
+    if not deal:
+        return jsonify({"success": False, "message": "Сделка не найдена"}), 404
+    try:
+        try:
+            commission = float(request.args.get('commission') or 0)
+        except ValueError:
+            raise ValueError("Некорректная комиссия")
+        return jsonify(schedule.deal_schedule(deal, request.args.get('method', 'annuity'),
+                                              commission))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+
+@app.route('/portfolio/cashflow')
+@login_required
+@boss_required
+@statement_timeout(10000)
+def portfolio_cashflow():
+    try:
+        try:
+            horizon = int(request.args.get('months') or 0) or None
+        except ValueError:
+            raise ValueError("Некорректный горизонт прогноза")
+        return jsonify(schedule.portfolio_cash_flow(db.get_portfolio_schedule_inputs(),
+                                                    request.args.get('method', 'annuity'),
+                                                    horizon))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+
+@app.route('/portfolio/totals')
+@login_required
+@boss_required
+@statement_timeout(10000)
+def portfolio_totals():
+    try:
+        as_of = request.args.get('date')
+        if as_of:
+            try:
+                as_of = datetime.date.fromisoformat(as_of)
+            except ValueError:
+                raise ValueError("Некорректная дата курса")
+        return jsonify(fx.portfolio_totals(request.args.get('currency'), as_of or None))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
 
 
 @app.route('/transfer_to_expert/<int:deal_id>', methods=['POST'])
@@ -169,27 +365,27 @@ def transfer_to_expert(deal_id):
             return jsonify({"success": False, "message": "Сделка не найдена"}), 404
 
         # Проверяем, что сделка принадлежит текущему пользователю
-        if deal['id_users'] != session['user_id']:
+        if deal.id_users != session['user_id']:
             return jsonify({"success": False, "message": "Вы не можете передать чужую сделку"}), 403
 
         # Обновляем или создаем запись эксперта
         result = db.update_or_create_expert_deal(
             id_manager_deal=deal_id,
-            id_manager=deal['id_users'],
-            id_client=deal['id_client'],
-            car_brand=deal['car_brand'],
-            sales_car=deal['sales_car'],
-            skp_or_bl=deal['skp_or_bl'],
-            shipment_or_signing=deal['shipment_or_signing'],
-            prepayment=deal['prepayment'],
-            contract_term=deal['contract_term'],
-            currency_contract=deal['currency_contract'],
-            interest_rate=deal['interest_rate'],
-            use_number_cert=deal['use_number_cert'],
-            use_date_cert=deal['use_date_cert'],
-            express=deal['express'],
-            electric_car=deal['electric_car'],
-            status=deal['status']  # Передаем текущий статус из сделки менеджера
+            id_manager=deal.id_users,
+            id_client=deal.id_client,
+            car_brand=deal.car_brand,
+            sales_car=deal.sales_car,
+            skp_or_bl=deal.skp_or_bl,
+            shipment_or_signing=deal.shipment_or_signing,
+            prepayment=deal.prepayment,
+            contract_term=deal.contract_term,
+            currency_contract=deal.currency_contract,
+            interest_rate=deal.interest_rate,
+            use_number_cert=deal.use_number_cert,
+            use_date_cert=deal.use_date_cert,
+            express=deal.express,
+            electric_car=deal.electric_car,
+            status=deal.status  # Передаем текущий статус из сделки менеджера
         )
 
         return jsonify(result)
@@ -204,74 +400,66 @@ def transfer_to_expert(deal_id):
 @login_required
 def edit_deal(deal_id):
     if request.method == 'POST':
-        # AJAX-запрос (возвращаем JSON)
-        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            data = request.form.to_dict()
-
-            # Очищаем данные от пустых значений
-            for key in data:
-                if data[key] == '':
-                    data[key] = None
-
-            try:
-                deal = db.get_deal_details(deal_id)
-                if not deal:
-                    return jsonify({"success": False, "message": "Сделка не найдена"}), 404
-
-                if deal['id_users'] != session['user_id']:
-                    return jsonify({"success": False, "message": "Вы не можете редактировать чужую сделку"}), 403
-
-                db.update_deal(
-                    deal_id,
-                    data.get('date_first_contact'),
-                    deal['id_client'],
-                    data.get('car_brand'),
-                    data.get('sales_car'),
-                    data.get('skp_or_bl'),
-                    data.get('status'),
-                    data.get('shipment_or_signing'),
-                    data.get('prepayment'),
-                    data.get('contract_term'),
-                    data.get('currency_contract'),
-                    data.get('interest_rate'),
-                    data.get('use_number_cert'),
-                    data.get('use_date_cert'),
-                    data.get('issued_number_cert'),
-                    data.get('issued_date_cert'),
-                    data.get('express') == 'on',
-                    data.get('electric_car') == 'on',
-                    data.get('amount_financing'),
-                    data.get('m_plan_ship'),
-                    data.get('description'),
-                    data.get('sales_channel'),
-                    data.get('name_agent')
-                )
-
-                return jsonify({
-                    "success": True,
-                    "message": "Сделка успешно обновлена!",
-                    "deal_id": deal_id
-                })
-
-            except ValueError as e:
-                return jsonify({"success": False, "message": str(e)}), 400
-            except Exception as e:
-                return jsonify({"success": False, "message": f"Внутренняя ошибка сервера: {str(e)}"}), 500
-
-        # Обычный POST-запрос (редирект)
-        else:
-            # ... обработка как для обычной формы ...
-            return redirect(f'/deal/{deal_id}')
-
-    # GET запрос - отображаем форму редактирования
-    deal = db.get_deal_details(deal_id)
+        # AJAX-запрос получает JSON, обычная отправка формы - редирект на сделку
+        ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+        try:
+            result, status = save_deal_changes(deal_id, request.form)
+        except ValueError as e:
+            result, status = {"success": False, "message": str(e)}, 400
+        except Exception as e:
+            if not ajax:
+                raise
+            result, status = {"success": False, "message": f"Внутренняя ошибка сервера: {str(e)}"}, 500
+
+        if ajax:
+            return jsonify(result), status
+        if status != 200:
+            return result["message"], status
+        return redirect(f'/deal/{deal_id}')
+
+    # GET запрос - отображаем форму редактирования. Версия формы берется из базы:
+    # из кэша могла бы прийти устаревшая, и первое же сохранение получило бы 409
+    deal = db.get_deal_for_edit(deal_id)
     if not deal:
         return "Сделка не найдена", 404
 
-    if deal['id_users'] != session['user_id']:
+    if deal.id_users != session['user_id']:
         return "Вы не можете редактировать чужую сделку", 403
 
-    return render_template('edit_deal.html', deal=deal)
+    return render_template('edit_deal.html', deal=deal, version=deal_form.version(deal))
+
+
+DEAL_CONFLICT_MESSAGE = "Сделку уже изменили, пока была открыта форма. Обновите страницу и повторите изменения"
+
+
+def save_deal_changes(deal_id, form):
+    """Сохраняет только изменившиеся поля сделки, если она не менялась с открытия формы;
+    возвращает (ответ, код)"""
+    deal = db.get_deal_for_edit(deal_id)
+    if not deal:
+        return {"success": False, "message": "Сделка не найдена"}, 404
+
+    if deal.id_users != session['user_id']:
+        return {"success": False, "message": "Вы не можете редактировать чужую сделку"}, 403
+
+    # Без версии нельзя понять, не затрет ли сохранение чужие изменения
+    if 'version' not in form or deal_form.parse_version(form['version']) != deal.updated_at:
+        return {"success": False, "message": DEAL_CONFLICT_MESSAGE}, 409
+
+    changes = deal_form.changes(deal, form)
+    version = deal.updated_at
+    if changes:
+        version = db.update_deal_fields(deal_id, changes, deal.updated_at)
+        if version is None:
+            return {"success": False, "message": DEAL_CONFLICT_MESSAGE}, 409
+
+    return {
+        "success": True,
+        "message": "Сделка успешно обновлена!" if changes else "Изменений нет",
+        "deal_id": deal_id,
+        "changed": sorted(changes),
+        "version": version.isoformat() if version is not None else '',
+    }, 200
 
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -285,32 +473,87 @@ def register():
         if db.get_user_by_username(username):
             return render_template('register.html', error='Пользователь с таким именем уже существует')
 
-        hashed_password = hash_password(password)
+        try:
+            hashed_password = auth.hash_password(password)
+        except auth.AuthBusy as e:
+            return render_template('register.html', error=str(e)), 503
         db.create_user(username, hashed_password, role, full_name)
         return redirect(url_for('login'))
 
     return render_template('register.html')
 
 
+def parse_expert_deal_list(args):
+    """Фильтры, сортировка, курсор и эксперт, чьи сделки показывать, из параметров запроса"""
+    filters = deal_filters.parse_filters(args, deal_filters.EXPERT_DEAL_FILTERS)
+    sort, descending = deal_filters.parse_sort(args, deal_filters.EXPERT_DEAL_SORTS)
+    cursor = pagination.decode_cursor(args.get('cursor'))
+    # Эксперт видит свои сделки и еще не назначенные, остальные роли - все
+    expert_id = session['user_id'] if session.get('role') == 'expert' else None
+    if expert_id:
+        filters.pop('expert', None)
+    return filters, sort, descending, cursor, expert_id
+
+
+def expert_deal_list_context(total_deals, managers, experts):
+    return dict(
+        total_deals=total_deals,
+        filter_query=deal_filters.query_string(request.args),
+        managers=managers,
+        experts=experts,
+        statuses=deal_filters.EXPERT_DEAL_STATUSES,
+        currencies=deal_filters.CURRENCIES,
+        sorts=deal_filters.EXPERT_DEAL_SORTS,
+        user_id=session['user_id'],
+    )
+
+
 @app.route('/expert/deals')
 @login_required
+@statement_timeout(3000)
 def expert_deals():
+    try:
+        filters, sort, descending, cursor, expert_id = parse_expert_deal_list(request.args)
+    except ValueError as e:
+        return str(e), 400
 
-    page = int(request.args.get('page', 1))
-    per_page = 10
-    total_deals = db.count_expert_deals(session['user_id'])
-    total_pages = math.ceil(total_deals / per_page)
-    deals = db.get_expert_deals_paginated(page, per_page)
+    total_deals = db.estimate_expert_deals_count(expert_id, filters)
+    list_context = expert_deal_list_context(total_deals, db.get_users_by_role('manager'),
+                                            db.get_users_by_role('expert'))
 
-    return render_template('expert_deals.html',
-                           deals=deals,
-                           page=page,
-                           total_pages=total_pages,
-                           user_id=session['user_id'])
+    if 'page' in request.args:
+        page = int(request.args.get('page', 1))
+        total_pages = math.ceil(total_deals / DEALS_PER_PAGE)
+        deals = db.get_expert_deals_paginated(page, DEALS_PER_PAGE, expert_id, filters)
+        return render_template('expert_deals.html', deals=deals, page=page, total_pages=total_pages,
+                               **list_context)
+
+    try:
+        page = db.get_expert_deals_keyset(DEALS_PER_PAGE, cursor, expert_id, filters, sort,
+                                          descending)
+    except ValueError as e:
+        return str(e), 400
+    return render_keyset_page('expert_deals.html', page, list_context)
+
+
+@app.route('/expert/deals/export')
+@login_required
+def export_expert_deals():
+    try:
+        filters = deal_filters.parse_filters(request.args, deal_filters.EXPERT_DEAL_FILTERS)
+        expert_id = session['user_id'] if session.get('role') == 'expert' else None
+        if expert_id:
+            filters.pop('expert', None)
+        return export.export_response(db.EXPERT_DEAL_EXPORT_COLUMNS,
+                                      db.iter_expert_deals_export(expert_id, filters),
+                                      'expert_deals', request.args.get('format', 'csv'))
+    except ValueError as e:
+        return str(e), 400
 
 
 @app.route('/expert/deal/<int:deal_id>')
 @login_required
+@statement_timeout(1000)
 def expert_view_deal(deal_id):
 
     deal = db.get_expert_deal_details(deal_id)
@@ -353,33 +596,153 @@ def expert_update_deal(deal_id):
 
 # В main.py добавляем новые маршруты
 
+def parse_client_search(args):
+    return args.get('q', '').strip(), max(int(args.get('page', 1)), 1)
+
+
+def render_clients(query, page, clients, total):
+    return render_template('clients.html',
+                           clients=clients,
+                           q=query,
+                           page=page,
+                           total=total,
+                           total_pages=math.ceil(total / CLIENTS_PER_PAGE))
+
+
 @app.route('/clients')
 @login_required
+@statement_timeout(2000)
 def show_clients():
-    clients = db.get_all_clients()
-    return render_template('clients.html', clients=clients)
+    query, page = parse_client_search(request.args)
+    clients, total = db.search_clients(query, page, CLIENTS_PER_PAGE)
+    return render_clients(query, page, clients, total)
+
+
+@app.route('/clients/search')
+@login_required
+@statement_timeout(500)
+def search_clients():
+    return jsonify(db.suggest_clients(request.args.get('q', ''), limit=10))
 
 
 @app.route('/employees')
 @login_required
+@statement_timeout(3000)
 def show_employees():
-    experts = db.get_users_by_role('expert')
-    managers = db.get_users_by_role('manager')
-    accountants = db.get_users_by_role('accountant')
+    roster = db.get_roster()
+    experts = roster.get('expert', [])
+    managers = roster.get('manager', [])
+    accountants = roster.get('accountant', [])
 
     stats = {
-        'experts_count': db.count_users_by_role('expert'),
-        'managers_count': db.count_users_by_role('manager'),
-        'accountants_count': db.count_users_by_role('accountant')
+        'experts_count': len(experts),
+        'managers_count': len(managers),
+        'accountants_count': len(accountants)
     }
 
     return render_template('employees.html',
                            experts=experts,
                            managers=managers,
                            accountants=accountants,
+                           workload=db.get_employee_workload(),
                            stats=stats)
 
 
+@app.route('/analytics')
+@login_required
+@boss_required
+def analytics_dashboard():
+    return render_template('analytics.html', refreshes=analytics.refresh_status(),
+                           currencies=deal_filters.CURRENCIES)
+
+
+def _analytics_period():
+    return (analytics.parse_month(request.args.get('from')),
+            analytics.parse_month(request.args.get('to')))
+
+
+@app.route('/analytics/volume')
+@login_required
+@boss_required
+@statement_timeout(15000)
+def analytics_volume():
+    try:
+        return jsonify(analytics.volume_by_month(*_analytics_period()))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+
+@app.route('/analytics/funnel')
+@login_required
+@boss_required
+@statement_timeout(15000)
+def analytics_funnel():
+    try:
+        return jsonify(analytics.funnel(*_analytics_period(),
+                                        by_manager=request.args.get('by') == 'manager'))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+
+@app.route('/analytics/durations')
+@login_required
+@boss_required
+@statement_timeout(15000)
+def analytics_durations():
+    try:
+        return jsonify(analytics.stage_durations(*_analytics_period()))
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+
+@app.route('/analytics/refresh', methods=['POST'])
+@login_required
+@boss_required
+# REFRESH MATERIALIZED VIEW на больших таблицах идет минутами
+@statement_timeout(0)
+def analytics_refresh():
+    refreshed = analytics.refresh_views()
+    return jsonify({"success": True, "refreshed": [view for view, _ in refreshed],
+                    "status": analytics.refresh_status()})
+
+
+@app.route('/stats/pool')
+@login_required
+@boss_required
+def pool_stats():
+    return jsonify(db.pool_stats())
+
+
+@app.route('/stats/cache')
+@login_required
+@boss_required
+def cache_stats():
+    return jsonify(db.cache_stats())
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    if not metrics.authorized(request.headers.get('Authorization')):
+        return "Доступ запрещен", 403
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+@app.route('/stats/queries')
+@login_required
+@boss_required
+def query_stats():
+    return jsonify(queries.stats())
+
+
+@app.route('/stats/slow_queries')
+@login_required
+@boss_required
+def slow_query_stats():
+    return jsonify({"threshold_ms": slow_queries.SLOW_QUERY_MS,
+                    "queries": slow_queries.recent()})
+
+
 if __name__ == "__main__":
-    db.init_db()
+    # Сервер разработки. Схема обновляется отдельно (python migrate.py),
+    # в production приложение запускает serve.py
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,307 @@
+import bisect
+import contextvars
+import glob
+import json
+import os
+import threading
+import time
+
+from flask import before_render_template, request, template_rendered
+
+# Метрики приложения в формате Prometheus (/metrics): время ответа по маршрутам,
+# время и число запросов к БД по именам реестра queries, ожидание соединения пула и
+# рендер шаблонов. Наблюдение - поиск корзины и сложение под блокировкой, поэтому
+# сбор можно не выключать в production.
+#
+# У gunicorn несколько процессов, а /metrics отвечает один из них. Если задан
+# METRICS_DIR, каждый процесс периодически сохраняет туда свои значения, и /metrics
+# отдает их сумму по всем процессам.
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Заголовок Server-Timing в ответах: время БД, ожидания соединения и шаблонов запроса
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+METRICS_DIR = os.getenv("METRICS_DIR") or None
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+# Если задан, /metrics требует заголовок Authorization: Bearer <токен>
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") or None
+
+# Границы корзин гистограмм в секундах
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Гистограмма с метками: на каждый набор меток - счетчики корзин, сумма и число"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            item = self._values.get(labels)
+            if item is None:
+                item = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            # Счетчики корзин без накопления; накопленные считаются при выводе
+            item[index] += 1
+            item[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: list(item) for labels, item in self._values.items()}
+
+    def lines(self, values):
+        for labels, item in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), item):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labels, labels, le=_le(bound))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {item[-1]:.6f}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {cumulative}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: [value] for labels, value in self._values.items()}
+
+    def lines(self, values):
+        for labels, item in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labels, labels)} {item[0]}"
+
+
+def _le(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+REQUEST_DURATION = Histogram("crm_http_request_duration_seconds",
+                             "Время обработки запроса по маршрутам", ("route", "method"))
+REQUESTS = Counter("crm_http_requests_total", "Запросы по маршрутам и кодам ответа",
+                   ("route", "method", "status"))
+QUERY_DURATION = Histogram("crm_db_query_duration_seconds",
+                           "Время выполнения запросов к БД по именам реестра", ("query",))
+QUERY_ERRORS = Counter("crm_db_query_errors_total", "Запросы к БД, завершившиеся ошибкой",
+                       ("query",))
+ACQUIRE_DURATION = Histogram("crm_db_connection_acquire_seconds",
+                             "Ожидание соединения из пула", ("pool",))
+TEMPLATE_DURATION = Histogram("crm_template_render_seconds", "Время рендера шаблонов",
+                              ("template",))
+
+METRICS = [REQUEST_DURATION, REQUESTS, QUERY_DURATION, QUERY_ERRORS, ACQUIRE_DURATION,
+           TEMPLATE_DURATION]
+
+
+class _RequestState:
+    """Начало текущего запроса, код ответа и время по частям для Server-Timing"""
+
+    __slots__ = ("started", "status", "timings", "templates", "token")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.status = 500
+        self.timings = {}  # {часть: [секунды, число]}
+        self.templates = []
+        self.token = None
+
+
+# Состояние хранится в contextvar, а не в g: дешевле на каждом обращении и доступно
+# из кода без контекста Flask (пул соединений, реестр запросов)
+_request_state = contextvars.ContextVar("metrics_request", default=None)
+
+
+def _add_timing(part, elapsed):
+    state = _request_state.get()
+    if state is not None:
+        item = state.timings.get(part)
+        if item is None:
+            state.timings[part] = [elapsed, 1]
+        else:
+            item[0] += elapsed
+            item[1] += 1
+
+
+def observe_query(name, elapsed, failed=False):
+    if not METRICS_ENABLED:
+        return
+    QUERY_DURATION.observe((name,), elapsed)
+    if failed:
+        QUERY_ERRORS.inc((name,))
+    _add_timing("db", elapsed)
+
+
+def observe_acquire(pool, elapsed):
+    if not METRICS_ENABLED:
+        return
+    ACQUIRE_DURATION.observe((pool,), elapsed)
+    _add_timing("db-acquire", elapsed)
+
+
+def _template_started(sender, template, context, **extra):
+    state = _request_state.get()
+    if state is not None:
+        state.templates.append(time.perf_counter())
+
+
+def _template_finished(sender, template, context, **extra):
+    state = _request_state.get()
+    if state is None or not state.templates:
+        return
+    elapsed = time.perf_counter() - state.templates.pop()
+    TEMPLATE_DURATION.observe((template.name or "<string>",), elapsed)
+    _add_timing("tpl", elapsed)
+
+
+def _route():
+    rule = request.url_rule
+    # Несовпавшие пути объединяются, иначе каждый адрес сканера стал бы отдельной меткой
+    return rule.rule if rule is not None else "<unmatched>"
+
+
+def _before_request():
+    state = _RequestState()
+    state.token = _request_state.set(state)
+
+
+def _after_request(response):
+    state = _request_state.get()
+    if state is None:
+        return response
+    state.status = response.status_code
+    if SERVER_TIMING:
+        parts = [f"app;dur={(time.perf_counter() - state.started) * 1000:.1f}"]
+        for part, (seconds, count) in state.timings.items():
+            parts.append(f'{part};dur={seconds * 1000:.1f};desc="{count}"')
+        response.headers.add("Server-Timing", ", ".join(parts))
+    return response
+
+
+def _teardown_request(exc):
+    state = _request_state.get()
+    if state is None:
+        return
+    try:
+        _request_state.reset(state.token)
+    except ValueError:
+        _request_state.set(None)
+    labels = (_route(), request.method)
+    REQUEST_DURATION.observe(labels, time.perf_counter() - state.started)
+    REQUESTS.inc(labels + (str(state.status),))
+    if METRICS_DIR:
+        flush()
+
+
+def init_app(app):
+    """Подключает сбор метрик к приложению; вызывается до регистрации остальных
+    обработчиков, чтобы время запроса включало их работу"""
+    if not METRICS_ENABLED:
+        return
+    app.before_request(_before_request)
+    # after_request вызываются в обратном порядке: этот - последним, после фиксации транзакции
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+
+
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def _snapshot():
+    return {metric.name: metric.snapshot() for metric in METRICS}
+
+
+def flush(force=False):
+    """Сохраняет значения процесса в METRICS_DIR не чаще раза в METRICS_FLUSH_INTERVAL"""
+    global _last_flush
+    now = time.monotonic()
+    if not force and now - _last_flush < METRICS_FLUSH_INTERVAL:
+        return
+    if not _flush_lock.acquire(blocking=False):
+        return
+    try:
+        _last_flush = now
+        data = {name: [[list(labels), item] for labels, item in values.items()]
+                for name, values in _snapshot().items()}
+        path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+    finally:
+        _flush_lock.release()
+
+
+def clear_dir():
+    """Удаляет значения прежних процессов; вызывается в мастере до запуска воркеров"""
+    if METRICS_DIR:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+            os.remove(path)
+
+
+def _collect():
+    if not METRICS_DIR:
+        return _snapshot()
+    flush(force=True)
+    # Значения завершившихся процессов остаются в сумме: счетчики не должны уменьшаться
+    merged = {metric.name: {} for metric in METRICS}
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, values in data.items():
+            target = merged.get(name)
+            if target is None:
+                continue
+            for labels, item in values:
+                labels = tuple(labels)
+                current = target.get(labels)
+                target[labels] = item if current is None else [a + b for a, b in zip(current, item)]
+    return merged
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus"""
+    values = _collect()
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.lines(values.get(metric.name, {})))
+    return "\n".join(lines) + "\n"
+
+
+def authorized(header):
+    return METRICS_TOKEN is None or header == f"Bearer {METRICS_TOKEN}"
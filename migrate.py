@@ -0,0 +1,85 @@
+import argparse
+import os
+import re
+
+import db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+# Ключ advisory-блокировки: параллельно стартующие процессы применяют миграции по очереди
+LOCK_KEY = 7283401
+
+
+def load_migrations():
+    """Читает файлы migrations/NNNN_name.sql и возвращает [(версия, имя, sql)] по порядку"""
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = re.fullmatch(r"(\d+)_(\w+)\.sql", filename)
+        if not match:
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, filename), encoding="utf-8") as f:
+            migrations.append((int(match.group(1)), match.group(2), f.read()))
+
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError("Номера миграций повторяются")
+    return sorted(migrations)
+
+
+def _prepare(cur):
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (LOCK_KEY,))
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(150) NOT NULL,
+            applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def applied_versions():
+    with db.connect_db() as conn, conn.cursor() as cur:
+        _prepare(cur)
+        cur.execute("SELECT version FROM schema_migrations")
+        return {row[0] for row in cur.fetchall()}
+
+
+def migrate(target=None):
+    """Применяет недостающие миграции, каждую в своей транзакции; возвращает их версии"""
+    applied = []
+    for version, name, sql in load_migrations():
+        if target is not None and version > target:
+            break
+        with db.connect_db() as conn, conn.cursor() as cur:
+            _prepare(cur)
+            cur.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+            if cur.fetchone():
+                continue
+            cur.execute(sql)
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                        (version, name))
+        applied.append(version)
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Версионные миграции схемы БД")
+    parser.add_argument("--target", type=int, help="применить миграции до указанной версии включительно")
+    parser.add_argument("--status", action="store_true", help="показать состояние миграций и выйти")
+    args = parser.parse_args()
+
+    if args.status:
+        done = applied_versions()
+        for version, name, _ in load_migrations():
+            mark = "x" if version in done else " "
+            print(f"[{mark}] {version:04d} {name}")
+        return
+
+    applied = migrate(args.target)
+    if applied:
+        print("Применены миграции: " + ", ".join(f"{v:04d}" for v in applied))
+    else:
+        print("Схема БД актуальна")
+
+
+if __name__ == "__main__":
+    main()
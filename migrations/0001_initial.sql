@@ -0,0 +1,84 @@
+-- Исходная схема (ранее создавалась в db.init_db)
+
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    username VARCHAR(100) UNIQUE NOT NULL,
+    full_name VARCHAR(100),
+    password_hash TEXT NOT NULL,
+    role VARCHAR(50) CHECK (role IN ('manager', 'expert', 'accountant', 'boss')) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS clients (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(150),
+    unp VARCHAR(18) UNIQUE NOT NULL,
+    contact_person VARCHAR(150),
+    contact_phone VARCHAR(20),
+    contact_email VARCHAR(255),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    descriptions TEXT
+);
+
+CREATE TABLE IF NOT EXISTS deals_managers (
+    id SERIAL PRIMARY KEY,
+    date_first_contact TIMESTAMP,
+    id_users INT REFERENCES users(id),
+    id_client INT REFERENCES clients(id),
+    car_brand VARCHAR(150),
+    sales_car VARCHAR(150),
+    skp_or_bl VARCHAR(10),
+    status VARCHAR(50),
+    shipment_or_signing VARCHAR(10),
+    prepayment VARCHAR(50),
+    contract_term INT,
+    currency_contract VARCHAR(10),
+    interest_rate NUMERIC(5,2),
+    use_number_cert INT,
+    use_date_cert DATE,
+    issued_number_cert INT,
+    issued_date_cert DATE,
+    express BOOLEAN,
+    electric_car BOOLEAN,
+    amount_financing NUMERIC(15,2),
+    m_plan_ship DATE,
+    description TEXT,
+    sales_channel VARCHAR(150),
+    name_agent VARCHAR(150),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS deals_expert (
+    id SERIAL PRIMARY KEY,
+    id_manager_deal INT REFERENCES deals_managers(id), -- Ссылка на исходную сделку
+    date_appearance TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    id_manager INT REFERENCES users(id), -- ID менеджера
+    id_client INT REFERENCES clients(id),
+    car_brand VARCHAR(150),
+    sales_car VARCHAR(150),
+    skp_or_bl VARCHAR(10),
+    shipment_or_signing VARCHAR(10),
+    prepayment VARCHAR(50),
+    contract_term INT,
+    currency_contract VARCHAR(10),
+    interest_rate NUMERIC(10,4),
+    use_number_cert INT,
+    use_date_cert DATE,
+    express BOOLEAN,
+    original_or_skan VARCHAR(30),
+    electric_car BOOLEAN,
+    solution_owner VARCHAR(30),
+    date_for_ce TIMESTAMP, -- Дата для кредитного эксперта
+    status VARCHAR(50),
+    id_ce INT REFERENCES users(id), -- ID кредитного эксперта
+    amount_financing NUMERIC(15,2),
+    date_credit_committee TIMESTAMP,
+    date_protocol TIMESTAMP,
+    date_signing_contract TIMESTAMP,
+    shipping_date TIMESTAMP, -- дата отгрузки лизинга
+    expert_comment TEXT, -- Комментарий эксперта
+    manager_comment TEXT, -- Комментарий менеджера
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
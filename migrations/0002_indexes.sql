@@ -0,0 +1,16 @@
+-- Индексы под горячие выборки db.py
+
+-- Внешние ключи, по которым идут LEFT JOIN и фильтры
+CREATE INDEX IF NOT EXISTS deals_managers_id_users_idx ON deals_managers (id_users);
+CREATE INDEX IF NOT EXISTS deals_managers_id_client_idx ON deals_managers (id_client);
+CREATE INDEX IF NOT EXISTS deals_expert_id_manager_idx ON deals_expert (id_manager);
+CREATE INDEX IF NOT EXISTS deals_expert_id_client_idx ON deals_expert (id_client);
+
+-- Список сделок эксперта: WHERE id_ce = %s ORDER BY id DESC
+CREATE INDEX IF NOT EXISTS deals_expert_id_ce_id_idx ON deals_expert (id_ce, id DESC);
+
+-- get_users_by_role: WHERE role = %s ORDER BY full_name
+CREATE INDEX IF NOT EXISTS users_role_full_name_idx ON users (role, full_name);
+
+-- get_all_clients: ORDER BY name, search_client: WHERE name = %s
+CREATE INDEX IF NOT EXISTS clients_name_idx ON clients (name);
@@ -0,0 +1,19 @@
+-- Одна запись эксперта на сделку менеджера
+
+-- Раньше дубликаты могли появиться при параллельной передаче сделки.
+-- Приложение всегда читало самую свежую запись, поэтому остальные удаляем.
+DELETE FROM deals_expert e
+USING deals_expert newer
+WHERE e.id_manager_deal = newer.id_manager_deal
+  AND (COALESCE(e.created_at, '-infinity'), e.id)
+    < (COALESCE(newer.created_at, '-infinity'), newer.id);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'deals_expert_id_manager_deal_key'
+    ) THEN
+        ALTER TABLE deals_expert
+            ADD CONSTRAINT deals_expert_id_manager_deal_key UNIQUE (id_manager_deal);
+    END IF;
+END $$;
@@ -0,0 +1,14 @@
+-- Поиск клиентов по подстроке в наименовании, контактном лице и email, по префиксу УНП
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS clients_name_trgm_idx
+    ON clients USING gin (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS clients_contact_person_trgm_idx
+    ON clients USING gin (contact_person gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS clients_contact_email_trgm_idx
+    ON clients USING gin (contact_email gin_trgm_ops);
+
+-- LIKE 'префикс%' по УНП независимо от правил сортировки базы
+CREATE INDEX IF NOT EXISTS clients_unp_pattern_idx
+    ON clients (unp varchar_pattern_ops);
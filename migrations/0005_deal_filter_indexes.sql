@@ -0,0 +1,49 @@
+-- Составные индексы под фильтры и сортировки списков сделок (deal_filters.py).
+-- Каждый индекс заканчивается на id, чтобы постраничный обход по ключу шел по индексу.
+-- Колонки сортировок идут в порядке списка (pagination.keyset_clause): DESC NULLS LAST,
+-- id DESC. Обход назад и сортировка по возрастанию (NULL в начале) - обратный проход
+-- того же индекса; в порядке по умолчанию (ASC NULLS LAST) ни один проход с ним не совпал бы.
+-- Сочетания фильтров, для которых нет отдельного индекса, обслуживает BitmapAnd.
+
+-- Одноколоночные индексы внешних ключей из 0002 заменяются составными с тем же префиксом
+DROP INDEX IF EXISTS deals_managers_id_users_idx;
+DROP INDEX IF EXISTS deals_managers_id_client_idx;
+DROP INDEX IF EXISTS deals_expert_id_manager_idx;
+DROP INDEX IF EXISTS deals_expert_id_client_idx;
+
+CREATE INDEX IF NOT EXISTS deals_managers_id_users_id_idx ON deals_managers (id_users, id DESC);
+CREATE INDEX IF NOT EXISTS deals_managers_id_client_id_idx ON deals_managers (id_client, id DESC);
+CREATE INDEX IF NOT EXISTS deals_managers_status_id_idx
+    ON deals_managers (status DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS deals_managers_id_users_status_id_idx
+    ON deals_managers (id_users, status DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS deals_managers_currency_id_idx
+    ON deals_managers (currency_contract, id DESC);
+-- «Статус X у менеджера Y с отгрузкой в этом месяце» и сортировка по плановой отгрузке
+CREATE INDEX IF NOT EXISTS deals_managers_m_plan_ship_id_idx
+    ON deals_managers (m_plan_ship DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS deals_managers_id_users_m_plan_ship_idx
+    ON deals_managers (id_users, m_plan_ship DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS deals_managers_status_m_plan_ship_idx
+    ON deals_managers (status, m_plan_ship DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS deals_managers_amount_id_idx
+    ON deals_managers (amount_financing DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS deals_managers_date_first_contact_id_idx
+    ON deals_managers (date_first_contact DESC NULLS LAST, id DESC);
+
+CREATE INDEX IF NOT EXISTS deals_expert_id_manager_id_idx ON deals_expert (id_manager, id DESC);
+CREATE INDEX IF NOT EXISTS deals_expert_id_client_id_idx ON deals_expert (id_client, id DESC);
+CREATE INDEX IF NOT EXISTS deals_expert_status_id_idx
+    ON deals_expert (status DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS deals_expert_id_ce_status_id_idx
+    ON deals_expert (id_ce, status DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS deals_expert_currency_id_idx
+    ON deals_expert (currency_contract, id DESC);
+CREATE INDEX IF NOT EXISTS deals_expert_shipping_date_id_idx
+    ON deals_expert (shipping_date DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS deals_expert_id_ce_shipping_date_idx
+    ON deals_expert (id_ce, shipping_date DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS deals_expert_amount_id_idx
+    ON deals_expert (amount_financing DESC NULLS LAST, id DESC);
+CREATE INDEX IF NOT EXISTS deals_expert_date_appearance_id_idx
+    ON deals_expert (date_appearance DESC NULLS LAST, id DESC);
@@ -0,0 +1,65 @@
+-- Счетчики сделок эксперта по (эксперт, статус) для списка /expert/deals.
+-- Поддерживаются триггером на deals_expert в той же транзакции, что и изменение сделки,
+-- поэтому их сумма всегда совпадает с COUNT по таблице.
+-- Ключ не может быть NULL: не назначенные эксперту сделки хранятся с id_ce = 0,
+-- сделки без статуса - со статусом ''.
+
+CREATE TABLE IF NOT EXISTS deals_expert_counters (
+    id_ce INT NOT NULL,
+    status VARCHAR(50) NOT NULL,
+    deals BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (id_ce, status)
+);
+
+CREATE OR REPLACE FUNCTION deals_expert_counters_update() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND OLD.id_ce IS NOT DISTINCT FROM NEW.id_ce
+       AND OLD.status IS NOT DISTINCT FROM NEW.status THEN
+        RETURN NULL;
+    END IF;
+
+    -- Строки счетчиков блокируются в порядке ключа: встречные переводы сделок между
+    -- одними и теми же экспертами/статусами не приводят к взаимоблокировке
+    INSERT INTO deals_expert_counters AS c (id_ce, status, deals)
+    SELECT id_ce, status, SUM(delta)
+    FROM (
+        SELECT COALESCE(OLD.id_ce, 0) AS id_ce, COALESCE(OLD.status, '') AS status, -1 AS delta
+        WHERE TG_OP IN ('UPDATE', 'DELETE')
+        UNION ALL
+        SELECT COALESCE(NEW.id_ce, 0), COALESCE(NEW.status, ''), 1
+        WHERE TG_OP IN ('INSERT', 'UPDATE')
+    ) changes
+    GROUP BY id_ce, status
+    ORDER BY id_ce, status
+    ON CONFLICT (id_ce, status) DO UPDATE SET deals = c.deals + EXCLUDED.deals;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION deals_expert_counters_truncate() RETURNS trigger AS $$
+BEGIN
+    TRUNCATE deals_expert_counters;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS deals_expert_counters_row ON deals_expert;
+CREATE TRIGGER deals_expert_counters_row
+    AFTER INSERT OR DELETE OR UPDATE OF id_ce, status ON deals_expert
+    FOR EACH ROW EXECUTE FUNCTION deals_expert_counters_update();
+
+DROP TRIGGER IF EXISTS deals_expert_counters_truncate ON deals_expert;
+CREATE TRIGGER deals_expert_counters_truncate
+    AFTER TRUNCATE ON deals_expert
+    FOR EACH STATEMENT EXECUTE FUNCTION deals_expert_counters_truncate();
+
+-- Начальное заполнение. SHARE-блокировка не дает изменить сделки, пока счетчики
+-- пересчитываются; триггер уже создан, так что последующие изменения учтутся им.
+LOCK TABLE deals_expert IN SHARE MODE;
+TRUNCATE deals_expert_counters;
+INSERT INTO deals_expert_counters (id_ce, status, deals)
+SELECT COALESCE(id_ce, 0), COALESCE(status, ''), COUNT(1)
+FROM deals_expert
+GROUP BY 1, 2;
@@ -0,0 +1,83 @@
+-- Материализованные представления для аналитики руководителя (analytics.py).
+-- Обновляются REFRESH MATERIALIZED VIEW CONCURRENTLY, для этого у каждого
+-- представления есть уникальный индекс по простым столбцам.
+
+-- Объем по месяцам и валютам: заведенные менеджерами сделки (по дате первого контакта)
+-- и подписанные договоры (по дате подписания у эксперта)
+CREATE MATERIALIZED VIEW IF NOT EXISTS analytics_volume_monthly AS
+SELECT month, currency,
+       SUM(deals_created) AS deals_created,
+       SUM(amount_created) AS amount_created,
+       SUM(deals_signed) AS deals_signed,
+       SUM(amount_signed) AS amount_signed
+FROM (
+    SELECT date_trunc('month', date_first_contact)::date AS month,
+           COALESCE(currency_contract, '-') AS currency,
+           COUNT(1) AS deals_created,
+           COALESCE(SUM(amount_financing), 0) AS amount_created,
+           0 AS deals_signed,
+           0 AS amount_signed
+    FROM deals_managers
+    WHERE date_first_contact IS NOT NULL
+    GROUP BY 1, 2
+    UNION ALL
+    SELECT date_trunc('month', date_signing_contract)::date,
+           COALESCE(currency_contract, '-'),
+           0, 0,
+           COUNT(1),
+           COALESCE(SUM(amount_financing), 0)
+    FROM deals_expert
+    WHERE date_signing_contract IS NOT NULL
+    GROUP BY 1, 2
+) volumes
+GROUP BY month, currency;
+
+CREATE UNIQUE INDEX IF NOT EXISTS analytics_volume_monthly_key
+    ON analytics_volume_monthly (month, currency);
+
+-- Воронка по месяцу первого контакта и менеджеру:
+-- сделка менеджера -> передана эксперту -> одобрена -> договор подписан
+CREATE MATERIALIZED VIEW IF NOT EXISTS analytics_funnel_monthly AS
+SELECT date_trunc('month', d.date_first_contact)::date AS month,
+       COALESCE(d.id_users, 0) AS id_manager,
+       COUNT(1) AS manager_deals,
+       COUNT(e.id) AS expert_deals,
+       COUNT(1) FILTER (WHERE e.status = 'Одобрено') AS approved,
+       COUNT(e.date_signing_contract) AS signed
+FROM deals_managers d
+LEFT JOIN deals_expert e ON e.id_manager_deal = d.id
+WHERE d.date_first_contact IS NOT NULL
+GROUP BY 1, 2;
+
+CREATE UNIQUE INDEX IF NOT EXISTS analytics_funnel_monthly_key
+    ON analytics_funnel_monthly (month, id_manager);
+
+-- Сроки этапов экспертизы по месяцу передачи эксперту, в днях
+CREATE MATERIALIZED VIEW IF NOT EXISTS analytics_stage_durations AS
+SELECT date_trunc('month', date_for_ce)::date AS month,
+       COUNT(1) AS deals,
+       COUNT(date_credit_committee) AS with_committee,
+       AVG(EXTRACT(EPOCH FROM date_credit_committee - date_for_ce) / 86400)
+           AS avg_days_to_committee,
+       percentile_cont(0.5) WITHIN GROUP (
+           ORDER BY EXTRACT(EPOCH FROM date_credit_committee - date_for_ce) / 86400)
+           AS median_days_to_committee,
+       COUNT(shipping_date) FILTER (WHERE date_credit_committee IS NOT NULL) AS with_shipping,
+       AVG(EXTRACT(EPOCH FROM shipping_date - date_credit_committee) / 86400)
+           AS avg_days_to_shipping,
+       percentile_cont(0.5) WITHIN GROUP (
+           ORDER BY EXTRACT(EPOCH FROM shipping_date - date_credit_committee) / 86400)
+           AS median_days_to_shipping
+FROM deals_expert
+WHERE date_for_ce IS NOT NULL
+GROUP BY 1;
+
+CREATE UNIQUE INDEX IF NOT EXISTS analytics_stage_durations_key
+    ON analytics_stage_durations (month);
+
+-- Когда и за сколько обновлялось каждое представление
+CREATE TABLE IF NOT EXISTS analytics_refreshes (
+    view_name VARCHAR(100) PRIMARY KEY,
+    refreshed_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    duration_ms NUMERIC(12,3) NOT NULL
+);
@@ -0,0 +1,11 @@
+-- Курсы валют для пересчета портфеля (fx.py).
+-- rate - сколько единиц базовой валюты (FX_BASE_CURRENCY, по умолчанию BYN) стоит
+-- одна единица currency на дату rate_date; для базовой валюты строка не нужна.
+
+CREATE TABLE IF NOT EXISTS fx_rates (
+    currency VARCHAR(10) NOT NULL,
+    rate_date DATE NOT NULL,
+    rate NUMERIC(18,8) NOT NULL CHECK (rate > 0),
+    loaded_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (currency, rate_date)
+);
@@ -0,0 +1,116 @@
+import base64
+import datetime
+import json
+from decimal import Decimal
+
+# Направления обхода: next - к более старым записям, prev - к более новым,
+# last - самая старая страница
+DIRECTIONS = ('next', 'prev', 'last')
+
+
+def encode_cursor(direction, key):
+    """Упаковывает позицию страницы в непрозрачную строку для URL"""
+    raw = json.dumps([direction, key], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Распаковывает курсор из URL; пустой курсор означает первую страницу"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, key = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Некорректный курсор страницы")
+    if direction not in DIRECTIONS:
+        raise ValueError("Некорректный курсор страницы")
+    return direction, key
+
+
+LAST_CURSOR = encode_cursor('last', None)
+
+
+def keyset_clause(column, cursor, sort=None, descending=True):
+    """Условие, порядок сортировки и параметры для выборки страницы.
+
+    column - уникальный ключ (id). sort - необязательная пара (SQL-выражение, тип),
+    по которой сортируется список; тогда ключ курсора - [значение sort, id]. NULL в sort
+    считается наименьшим значением: такие строки идут в конце списка по убыванию и в
+    начале списка по возрастанию. Так оба направления и обход назад совпадают с прямым
+    или обратным проходом индекса (sort DESC NULLS LAST, id DESC).
+    """
+    direction, key = cursor or ('next', None)
+    forward = direction == 'next'
+    order_dir = 'DESC' if descending == forward else 'ASC'
+    op = '<' if order_dir == 'DESC' else '>'
+
+    if sort is None:
+        order = f"{column} {order_dir}"
+        if key is None:
+            return None, order, ()
+        if not isinstance(key, int):
+            raise ValueError("Некорректный курсор страницы")
+        return f"{column} {op} %s", order, (key,)
+
+    expression, sql_type = sort
+    # NULL - наименьшее значение: при обходе по убыванию такие строки в конце
+    nulls = 'LAST' if order_dir == 'DESC' else 'FIRST'
+    order = f"{expression} {order_dir} NULLS {nulls}, {column} {order_dir}"
+    if key is None:
+        return None, order, ()
+    if not isinstance(key, list) or len(key) != 2:
+        raise ValueError("Некорректный курсор страницы")
+
+    value, last_id = key
+    if not isinstance(last_id, int) or not isinstance(value, (str, type(None))):
+        raise ValueError("Некорректный курсор страницы")
+    # Значение курсора - строка (см. sort_key); приведение через text одинаково работает
+    # у psycopg2 и asyncpg, который иначе ждет от параметра сразу нужный тип
+    param = f"%s::text::{sql_type}"
+    if order_dir == 'DESC' and value is None:
+        condition = f"({expression} IS NULL AND {column} {op} %s)"
+        params = (last_id,)
+    elif order_dir == 'DESC':
+        condition = (f"({expression} {op} {param} OR ({expression} = {param} AND {column} {op} %s)"
+                     f" OR {expression} IS NULL)")
+        params = (value, value, last_id)
+    elif value is None:
+        condition = f"({expression} IS NOT NULL OR {column} {op} %s)"
+        params = (last_id,)
+    else:
+        condition = f"({expression} {op} {param} OR ({expression} = {param} AND {column} {op} %s))"
+        params = (value, value, last_id)
+    return condition, order, params
+
+
+def sort_key(row):
+    """Ключ курсора для списка, отсортированного по выражению в последней колонке строки"""
+    value = row[-1]
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.isoformat()
+    elif isinstance(value, Decimal):
+        value = str(value)
+    return [value, row[0]]
+
+
+def build_page(rows, per_page, cursor, key=lambda row: row[0]):
+    """Собирает страницу из rows, выбранных с LIMIT per_page + 1 в порядке обхода.
+
+    Возвращает (rows, next_cursor, prev_cursor); отсутствующий курсор - None.
+    """
+    direction = cursor[0] if cursor else 'next'
+    has_more = len(rows) > per_page
+    rows = list(rows[:per_page])
+    if direction != 'next':
+        rows.reverse()
+    if not rows:
+        return rows, None, None
+
+    if direction == 'next':
+        next_cursor = encode_cursor('next', key(rows[-1])) if has_more else None
+        prev_cursor = encode_cursor('prev', key(rows[0])) if cursor else None
+    else:
+        next_cursor = encode_cursor('next', key(rows[-1])) if direction == 'prev' else None
+        prev_cursor = encode_cursor('prev', key(rows[0])) if has_more else None
+    return rows, next_cursor, prev_cursor
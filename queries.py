@@ -0,0 +1,210 @@
+import functools
+import hashlib
+import os
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import psycopg2
+
+import metrics
+import slow_queries
+
+# Реестр запросов db.py. Каждый запрос объявляется один раз под именем; на соединении
+# пула он готовится (PREPARE) при первом выполнении, дальше выполняется через EXECUTE -
+# Postgres не разбирает текст заново и после нескольких выполнений использует
+# сохраненный план. Для каждого запроса собираются число вызовов и время выполнения.
+#
+# Подготовленные запросы живут в сессии Postgres: за пулером в режиме транзакций
+# (pgbouncer pool_mode=transaction) их нужно отключить - DB_PREPARE=0.
+
+PREPARE_ENABLED = os.getenv("DB_PREPARE", "1") == "1"
+# Сколько подготовленных запросов держит одно соединение; самые давние освобождаются
+PREPARED_PER_CONNECTION = int(os.getenv("DB_PREPARED_MAX", 200))
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+_NAME = re.compile(r"[a-z_][a-z0-9_]*")
+
+# Коды ошибок Postgres: подготовленный запрос не найден (DISCARD ALL или DEALLOCATE извне),
+# уже существует, план запроса устарел после изменения структуры таблиц
+_MISSING = '26000'
+_DUPLICATE = '42P05'
+_STALE = '0A000'
+
+
+@functools.lru_cache(maxsize=1024)
+def numbered(sql):
+    """SQL с параметрами psycopg2 (%s или %(name)s) -> (SQL с $1, $2..., порядок параметров).
+    Порядок - номера позиционных параметров или имена именованных."""
+    order = []
+    numbers = {}
+
+    def replace(match):
+        if match.group(0) == '%%':
+            return '%'
+        name = match.group(1)
+        if name is None:
+            order.append(len(order))
+            return f"${len(order)}"
+        if name not in numbers:
+            order.append(name)
+            numbers[name] = len(order)
+        return f"${numbers[name]}"
+
+    return _PLACEHOLDER.sub(replace, sql), tuple(order)
+
+
+def arguments(order, params):
+    """Значения параметров в порядке $1, $2..."""
+    if not order:
+        return []
+    if isinstance(params, dict):
+        return [params[name] for name in order]
+    params = list(params)
+    if len(params) != len(order):
+        raise ValueError(f"Ожидалось параметров: {len(order)}, передано: {len(params)}")
+    return params
+
+
+class Query:
+    """Запрос реестра: имя, текст с параметрами psycopg2 и статистика выполнения"""
+
+    def __init__(self, name, sql, prepare=True):
+        self.name = name
+        self.sql = sql
+        # False - запрос только учитывается в статистике (EXPLAIN, серверные курсоры)
+        self.prepare = prepare
+        self.text, self.order = numbered(sql)
+        n = len(self.order)
+        self.prepare_sql = f"PREPARE {name} AS {self.text}"
+        self.execute_sql = f"EXECUTE {name}({', '.join(['%s'] * n)})" if n else f"EXECUTE {name}"
+        self.calls = 0
+        self.prepares = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+_registry = {}
+_lock = threading.Lock()
+# Подготовленные запросы каждого соединения в порядке последнего использования:
+# {имя: True}, False - запрос устарел и будет подготовлен заново
+_prepared = weakref.WeakKeyDictionary()
+
+
+def statement(name, sql, prepare=True):
+    """Объявляет запрос под именем; повторное объявление с тем же текстом возвращает его же"""
+    if not _NAME.fullmatch(name):
+        raise ValueError(f"Некорректное имя запроса: {name}")
+    with _lock:
+        query = _registry.get(name)
+        if query is None:
+            query = _registry[name] = Query(name, sql, prepare)
+        elif query.sql != sql:
+            raise ValueError(f"Запрос {name} уже объявлен с другим текстом")
+        return query
+
+
+def dynamic(prefix, sql, prepare=True):
+    """Запрос, текст которого собирается из фильтров и сортировки: имя - префикс и хэш
+    текста. Вариантов немного (набор фильтров, сортировка, направление), каждый
+    готовится отдельно."""
+    return statement(f"{prefix}_{hashlib.sha1(sql.encode()).hexdigest()[:12]}", sql, prepare)
+
+
+def _prepare(cur, query):
+    """Готовит запрос на соединении курсора, если он еще не подготовлен"""
+    conn = cur.connection
+    with _lock:
+        names = _prepared.setdefault(conn, OrderedDict())
+        if names.get(query.name):
+            names.move_to_end(query.name)
+            return
+        deallocate = [query.name] if names.pop(query.name, None) is False else []
+        while len(names) >= PREPARED_PER_CONNECTION:
+            deallocate.append(names.popitem(last=False)[0])
+
+    for name in deallocate:
+        cur.execute(f"DEALLOCATE {name}")
+    # PREPARE не откатывается вместе с транзакцией: запрос остается подготовленным,
+    # даже если транзакция, в которой он впервые выполнен, закончится ошибкой
+    try:
+        cur.execute(query.prepare_sql)
+    except psycopg2.Error as e:
+        if e.pgcode == _DUPLICATE:
+            # Запрос с этим именем (и этим текстом) уже есть в сессии - учет его потерял
+            _mark(conn, query.name, True)
+        raise
+    _mark(conn, query.name, True)
+    with _lock:
+        query.prepares += 1
+
+
+def _mark(conn, name, prepared):
+    with _lock:
+        _prepared.setdefault(conn, OrderedDict())[name] = prepared
+
+
+def forget(conn):
+    """Сбрасывает учет подготовленных запросов соединения"""
+    with _lock:
+        _prepared.pop(conn, None)
+
+
+def execute(cur, query, params=()):
+    """Выполняет запрос реестра на курсоре psycopg2; результат читается из курсора как обычно"""
+    started = time.perf_counter()
+    failed = False
+    error = None
+    try:
+        if PREPARE_ENABLED and query.prepare:
+            _prepare(cur, query)
+            cur.execute(query.execute_sql, arguments(query.order, params))
+        else:
+            cur.execute(query.sql, params)
+    except psycopg2.Error as e:
+        failed = True
+        error = e.pgcode
+        # Транзакция прервана; следующая подготовит запросы соединения заново
+        if e.pgcode == _MISSING:
+            forget(cur.connection)
+        elif e.pgcode == _STALE:
+            _mark(cur.connection, query.name, False)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        with _lock:
+            query.calls += 1
+            query.errors += failed
+            query.total += elapsed
+            query.max = max(query.max, elapsed)
+        metrics.observe_query(query.name, elapsed, failed)
+        slow_queries.record(query, params, elapsed, error)
+
+
+def stats():
+    """Статистика запросов реестра по убыванию общего времени, время в мс"""
+    with _lock:
+        items = sorted(_registry.values(), key=lambda q: q.total, reverse=True)
+        return {
+            "prepare": PREPARE_ENABLED,
+            "connections": len(_prepared),
+            "queries": [{
+                "name": q.name,
+                "calls": q.calls,
+                "prepares": q.prepares,
+                "errors": q.errors,
+                "total_ms": round(q.total * 1000, 3),
+                "mean_ms": round(q.total * 1000 / q.calls, 3) if q.calls else 0.0,
+                "max_ms": round(q.max * 1000, 3),
+            } for q in items if q.calls],
+        }
+
+
+def reset_stats():
+    with _lock:
+        for query in _registry.values():
+            query.calls = query.prepares = query.errors = 0
+            query.total = query.max = 0.0
@@ -0,0 +1,82 @@
+import collections
+import functools
+
+import psycopg2.extensions
+
+# Строки результатов запросов как записи с доступом к полям по имени: row.status,
+# а не row[5] или dict(zip(columns, row)). Класс записи создается один раз на набор
+# колонок; запись - кортеж (__slots__ = ()), поэтому неизменяема и не дороже строки psycopg2.
+
+
+@functools.lru_cache(maxsize=256)
+def record_class(columns):
+    """Класс записи для кортежа имен колонок запроса"""
+    cls = collections.namedtuple("Record", columns, rename=True)
+    # Класс создается динамически и по имени не импортируется - pickle (кэш redis)
+    # собирает запись заново по именам колонок
+    cls.__reduce__ = lambda self: (_rebuild, (self._fields, tuple(self)))
+    return cls
+
+
+def _rebuild(columns, values):
+    return record_class(columns)._make(values)
+
+
+def columns(cur):
+    return tuple(desc[0] for desc in cur.description)
+
+
+class RecordCursor(psycopg2.extensions.cursor):
+    """Курсор, возвращающий записи record_class вместо кортежей"""
+
+    def execute(self, query, vars=None):
+        self._make = None
+        return super().execute(query, vars)
+
+    def _maker(self):
+        if getattr(self, '_make', None) is None:
+            self._make = record_class(columns(self))._make
+        return self._make
+
+    def fetchone(self):
+        row = super().fetchone()
+        return None if row is None else self._maker()(row)
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        return list(map(self._maker(), rows)) if rows else rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        return list(map(self._maker(), rows)) if rows else rows
+
+    def __iter__(self):
+        # iter(cursor) вернул бы этот же генератор - строки берем через next();
+        # именованный курсор знает колонки только после первой порции строк
+        rows = super().__iter__()
+        try:
+            row = next(rows)
+        except StopIteration:
+            return
+        make = self._maker()
+        yield make(row)
+        while True:
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            yield make(row)
+
+
+def dicts(cur):
+    """Все строки результата как словари - для ответов в JSON"""
+    names = columns(cur)
+    return [dict(zip(names, row)) for row in cur.fetchall()]
+
+
+def from_mappings(rows):
+    """Записи из строк драйвера с доступом по имени (asyncpg.Record)"""
+    if not rows:
+        return []
+    make = record_class(tuple(rows[0].keys()))._make
+    return [make(row.values()) for row in rows]
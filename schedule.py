@@ -0,0 +1,306 @@
+import datetime
+import re
+
+try:
+    import numpy as np
+except ImportError:  # графики платежей рассчитываются только при установленном numpy
+    np = None
+
+# annuity - равные платежи, differentiated - равные доли основного долга
+METHODS = ('annuity', 'differentiated')
+
+# Предел итераций и точность при расчете IRR
+IRR_ITERATIONS = 50
+IRR_TOLERANCE = 1e-10
+
+
+def _require_numpy():
+    if np is None:
+        raise ValueError("Для расчета графиков платежей установите пакет numpy")
+
+
+def _check_method(method):
+    if method not in METHODS:
+        raise ValueError(f"Неизвестный способ погашения {method}")
+
+
+def parse_prepayment(value, amount):
+    """Собственное участие из текстового поля сделки: «20%» - процент от стоимости предмета
+    лизинга, число - сумма. Нераспознанное значение считается нулем."""
+    if value is None:
+        return 0.0
+    text = str(value).replace(' ', '').replace(',', '.')
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)(%?)", text)
+    if not match:
+        return 0.0
+    number = float(match.group(1))
+    if match.group(2):
+        if number >= 100:
+            return 0.0
+        # Сумма финансирования - стоимость за вычетом участия
+        return float(amount) * number / (100 - number)
+    return number
+
+
+def _validate(amount, annual_rate, months):
+    if amount is None or float(amount) <= 0:
+        raise ValueError("Для графика нужна положительная сумма финансирования")
+    if annual_rate is None or float(annual_rate) < 0:
+        raise ValueError("Для графика нужна ставка")
+    if not months or int(months) <= 0:
+        raise ValueError("Для графика нужен срок договора")
+
+
+def amortization(amount, annual_rate, months, method='annuity'):
+    """Полный график погашения одной сделки. Возвращает словарь массивов по месяцам:
+    period, payment, interest, principal, balance (остаток после платежа)."""
+    _require_numpy()
+    _check_method(method)
+    _validate(amount, annual_rate, months)
+    amount = float(amount)
+    months = int(months)
+    rate = float(annual_rate) / 1200
+    period = np.arange(1, months + 1)
+
+    if method == 'annuity':
+        if rate == 0:
+            payment = np.full(months, amount / months)
+            balance_before = amount - (period - 1) * amount / months
+        else:
+            growth = (1 + rate) ** (period - 1)
+            pmt = amount * rate / (1 - (1 + rate) ** -months)
+            payment = np.full(months, pmt)
+            balance_before = amount * growth - pmt * (growth - 1) / rate
+        interest = balance_before * rate
+        principal = payment - interest
+    else:
+        principal = np.full(months, amount / months)
+        balance_before = amount - (period - 1) * amount / months
+        interest = balance_before * rate
+        payment = principal + interest
+
+    # Округляем до копеек; погрешность округления основного долга гасится последним платежом
+    principal = np.round(principal, 2)
+    principal[-1] += round(amount - principal.sum(), 2)
+    interest = np.round(interest, 2)
+    payment = principal + interest
+    balance = np.round(amount - np.cumsum(principal), 2)
+    return {
+        'period': period,
+        'payment': payment,
+        'interest': interest,
+        'principal': principal,
+        'balance': balance,
+    }
+
+
+def cash_flow_matrix(amounts, annual_rates, terms, method='annuity'):
+    """Платежи сразу по многим сделкам: матрица (сделки x месяцы) с нулями после окончания
+    срока каждой сделки, и такие же матрицы процентов и основного долга"""
+    _require_numpy()
+    _check_method(method)
+    amounts = np.asarray(amounts, dtype=float)
+    rates = np.asarray(annual_rates, dtype=float) / 1200
+    terms = np.asarray(terms, dtype=int)
+    if amounts.size == 0:
+        empty = np.zeros((0, 0))
+        return empty, empty, empty
+
+    period = np.arange(1, terms.max() + 1)
+    active = period[None, :] <= terms[:, None]
+    steps = period - 1
+    # Нулевая ставка - отдельный случай формулы аннуитета, подставляем 1 и исправляем ниже
+    zero = rates == 0
+    safe_rates = np.where(zero, 1.0, rates)
+    if method == 'annuity':
+        # (1 + r)^k через exp/log1p заметно быстрее возведения в степень поэлементно
+        log_growth = np.log1p(safe_rates)
+        growth = np.exp(steps[None, :] * log_growth[:, None])
+        pmt = amounts * safe_rates / -np.expm1(-terms * log_growth)
+        pmt[zero] = amounts[zero] / terms[zero]
+        balance_before = amounts[:, None] * growth - (pmt / safe_rates)[:, None] * (growth - 1)
+        if zero.any():
+            balance_before[zero] = amounts[zero, None] - steps[None, :] * (amounts / terms)[zero, None]
+        interest = balance_before * rates[:, None]
+        payment = np.broadcast_to(pmt[:, None], balance_before.shape)
+        principal = payment - interest
+    else:
+        principal = np.broadcast_to((amounts / terms)[:, None], active.shape)
+        interest = (amounts[:, None] - steps[None, :] * principal) * rates[:, None]
+        payment = principal + interest
+
+    return payment * active, interest * active, principal * active
+
+
+def _linear_flows(amounts, rates, terms, method):
+    """Платеж месяца t у обоих способов линеен по t: alpha + beta * t"""
+    if method == 'annuity':
+        positive = rates > 0
+        safe_rates = np.where(positive, rates, 1.0)
+        alpha = np.where(positive, amounts * safe_rates / -np.expm1(-terms * np.log1p(safe_rates)),
+                         amounts / terms)
+        return alpha, np.zeros_like(alpha)
+    share = amounts / terms
+    return share + amounts * rates + share * rates, -share * rates
+
+
+def _present_value(x, alpha, beta, terms):
+    """Сумма (alpha + beta * t) / (1 + x)^t за t = 1..terms в замкнутом виде"""
+    small = np.abs(x) < 1e-9
+    x = np.where(small, 1e-9, x)
+    v = 1 / (1 + x)
+    vn = np.exp(-terms * np.log1p(x))
+    s0 = v * (1 - vn) / (1 - v)
+    s1 = v * (1 - (terms + 1) * vn + terms * vn * v) / (1 - v) ** 2
+    s0 = np.where(small, terms, s0)
+    s1 = np.where(small, terms * (terms + 1) / 2, s1)
+    return alpha * s0 + beta * s1
+
+
+def batch_totals(amounts, annual_rates, terms, method='annuity', commission=0.0):
+    """Итоги по многим сделкам одним расчетом: первый платеж, сумма платежей, переплата
+    и эффективная годовая ставка (IRR лизингодателя с учетом разовой комиссии
+    commission, % от суммы финансирования). Матрица платежей не строится: суммы по
+    месяцам берутся в замкнутом виде, поэтому расчет линеен по числу сделок."""
+    _require_numpy()
+    _check_method(method)
+    amounts = np.asarray(amounts, dtype=float)
+    rates = np.asarray(annual_rates, dtype=float) / 1200
+    terms = np.asarray(terms, dtype=float)
+    alpha, beta = _linear_flows(amounts, rates, terms, method)
+    total_payments = alpha * terms + beta * terms * (terms + 1) / 2
+
+    # IRR методом секущих по всем сделкам сразу: выдача (за вычетом комиссии) в месяце 0
+    # равна приведенной стоимости платежей
+    issued = amounts * (1 - commission / 100)
+    previous = rates.copy()
+    current = rates + 1e-3
+    f_previous = _present_value(previous, alpha, beta, terms) - issued
+    result = np.full(amounts.shape, np.nan)
+    pending = np.arange(amounts.size)
+    for _ in range(IRR_ITERATIONS):
+        if not pending.size:
+            break
+        f_current = _present_value(current, alpha[pending], beta[pending], terms[pending]) - issued[pending]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = np.where(f_current != f_previous,
+                            f_current * (current - previous) / (f_current - f_previous), 0.0)
+        previous, f_previous = current, f_current
+        current = np.maximum(current - step, -0.99)
+        done = np.abs(step) < IRR_TOLERANCE
+        result[pending[done]] = current[done]
+        keep = ~done
+        pending, current, previous, f_previous = (pending[keep], current[keep], previous[keep],
+                                                  f_previous[keep])
+
+    return {
+        'first_payment': alpha + beta,
+        'total_payments': total_payments,
+        'total_interest': total_payments - amounts,
+        'irr': (1 + result) ** 12 - 1,
+    }
+
+
+def deal_schedule(deal, method='annuity', commission=0.0, start=None):
+    """График и итоги одной сделки для страницы сделки (JSON-совместимый словарь)"""
+    table = amortization(deal.amount_financing, deal.interest_rate,
+                         deal.contract_term, method)
+    totals = batch_totals([deal.amount_financing], [deal.interest_rate],
+                          [deal.contract_term], method, commission)
+    start = start or deal.m_plan_ship or datetime.date.today()
+    months = add_months(start, table['period'])
+    prepayment = parse_prepayment(deal.prepayment, deal.amount_financing)
+
+    return {
+        'method': method,
+        'currency': deal.currency_contract,
+        'rows': [
+            {
+                'period': int(period),
+                'date': month.isoformat(),
+                'payment': round(float(payment), 2),
+                'interest': round(float(interest), 2),
+                'principal': round(float(principal), 2),
+                'balance': round(float(balance), 2),
+            }
+            for period, month, payment, interest, principal, balance in zip(
+                table['period'], months, table['payment'], table['interest'],
+                table['principal'], table['balance'])
+        ],
+        'totals': {
+            'prepayment': round(prepayment, 2),
+            'total_payments': round(float(table['payment'].sum()), 2),
+            'total_interest': round(float(table['interest'].sum()), 2),
+            'total_cost': round(float(table['payment'].sum()) + prepayment, 2),
+            'irr': None if np.isnan(totals['irr'][0]) else round(float(totals['irr'][0]), 6),
+        },
+    }
+
+
+def add_months(start, periods):
+    """Даты платежей: то же число через period месяцев после start (с поправкой на
+    конец месяца)"""
+    result = []
+    for period in periods:
+        month_index = start.month - 1 + int(period)
+        year = start.year + month_index // 12
+        month = month_index % 12 + 1
+        next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+        last_day = (next_month - datetime.timedelta(days=1)).day
+        result.append(datetime.date(year, month, min(start.day, last_day)))
+    return result
+
+
+def portfolio_cash_flow(deals, method='annuity', horizon=None, today=None):
+    """Прогноз поступлений по портфелю по календарным месяцам и валютам.
+    deals - [(сумма, ставка, срок, валюта, дата начала)]; платежи до текущего месяца
+    не включаются, horizon ограничивает прогноз числом месяцев."""
+    _require_numpy()
+    deals = [deal for deal in deals
+             if deal[0] and deal[0] > 0 and deal[1] is not None and deal[1] >= 0
+             and deal[2] and deal[2] > 0]
+    if not deals:
+        return []
+
+    today = today or datetime.date.today()
+    amounts, rates, terms, currencies, starts = zip(*deals)
+    payment, interest, principal = cash_flow_matrix(amounts, rates, terms, method)
+
+    # Индекс календарного месяца каждого платежа относительно текущего месяца
+    base = today.year * 12 + today.month - 1
+    start_index = np.array([(start or today).year * 12 + (start or today).month - 1
+                            for start in starts]) - base
+    month_index = start_index[:, None] + np.arange(1, payment.shape[1] + 1)[None, :]
+    keep = (month_index >= 0) & (payment > 0)
+    if horizon:
+        keep &= month_index < horizon
+
+    currency_names = sorted({currency or '-' for currency in currencies})
+    currency_index = np.array([currency_names.index(currency or '-') for currency in currencies])
+    months = int(month_index[keep].max()) + 1 if keep.any() else 0
+    shape = (len(currency_names), months)
+    rows = np.broadcast_to(currency_index[:, None], payment.shape)[keep]
+    columns = month_index[keep]
+
+    totals = {}
+    for name, values in (('payment', payment), ('interest', interest), ('principal', principal)):
+        grid = np.zeros(shape)
+        np.add.at(grid, (rows, columns), values[keep])
+        totals[name] = grid
+
+    result = []
+    for c, currency in enumerate(currency_names):
+        for m in range(months):
+            if totals['payment'][c, m] == 0:
+                continue
+            month = datetime.date(today.year + (today.month - 1 + m) // 12,
+                                  (today.month - 1 + m) % 12 + 1, 1)
+            result.append({
+                'month': month.isoformat(),
+                'currency': currency,
+                'payment': round(float(totals['payment'][c, m]), 2),
+                'interest': round(float(totals['interest'][c, m]), 2),
+                'principal': round(float(totals['principal'][c, m]), 2),
+            })
+    result.sort(key=lambda row: (row['month'], row['currency']))
+    return result
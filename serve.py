@@ -0,0 +1,179 @@
+"""Запуск приложения в production: gunicorn, несколько процессов по числу ядер,
+в каждом - несколько потоков.
+
+    python migrate.py          # схема обновляется до запуска, а не при старте каждого воркера
+    python serve.py            # или python serve.py --migrate
+    python serve.py --reload   # перезапуск с новым кодом без простоя
+
+Перезапуск: мастер получает USR2 и запускает новый мастер с новым кодом, тот поднимает
+и прогревает своих воркеров, после чего старый мастер получает TERM и дообслуживает
+начатые запросы (WEB_GRACEFUL_TIMEOUT). HUP при preload-режиме код не обновляет -
+воркеры форкаются от мастера, в котором приложение уже загружено.
+
+Каждый воркер держит свой пул до DB_POOL_MAX соединений: workers * DB_POOL_MAX
+должно помещаться в max_connections Postgres.
+"""
+import argparse
+import os
+import signal
+import tempfile
+import time
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # сервер нужен только для запуска в production
+    BaseApplication = None
+
+import analytics
+import auth
+import cache
+import db
+import metrics
+import migrate
+
+
+def default_workers():
+    """Процессов по числу доступных ядер: 2 * ядра + 1, как рекомендует gunicorn"""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    return cpus * 2 + 1
+
+
+SERVER_CONFIG = {
+    "bind": os.getenv("WEB_BIND", "0.0.0.0:8000"),
+    "workers": int(os.getenv("WEB_CONCURRENCY", 0)) or default_workers(),
+    # Потоки воркера ждут базу параллельно; их не должно быть больше DB_POOL_MAX
+    "threads": int(os.getenv("WEB_THREADS", 4)),
+    "worker_class": "gthread",
+    "timeout": int(os.getenv("WEB_TIMEOUT", 30)),
+    "graceful_timeout": int(os.getenv("WEB_GRACEFUL_TIMEOUT", 30)),
+    "keepalive": int(os.getenv("WEB_KEEPALIVE", 5)),
+    # Плановый перезапуск воркера после N запросов (0 - не перезапускать)
+    "max_requests": int(os.getenv("WEB_MAX_REQUESTS", 0)),
+    "max_requests_jitter": int(os.getenv("WEB_MAX_REQUESTS_JITTER", 0)),
+    # Приложение загружается в мастере один раз, воркеры получают его через fork
+    "preload_app": os.getenv("WEB_PRELOAD", "1") == "1",
+    "pidfile": os.getenv("WEB_PIDFILE") or os.path.join(tempfile.gettempdir(), "crm_leasing.pid"),
+    "accesslog": os.getenv("WEB_ACCESS_LOG") or None,
+    "errorlog": os.getenv("WEB_ERROR_LOG", "-"),
+}
+
+
+def configure_cache(workers):
+    """Сообщает кэшу число воркеров до fork: кэш в памяти процесса при нескольких
+    воркерах отдавал бы карточки сделок, сброшенные в другом воркере"""
+    cache.CACHE_CONFIG["workers"] = workers
+    return cache.resolve_backend()
+
+
+def warm_up(app):
+    """Готовит воркер до первого запроса: соединения пула, скомпилированные шаблоны
+    и процессы хэширования паролей"""
+    try:
+        db.get_pool()
+    except Exception as e:
+        # Воркер все равно запускается: пул досоздаст соединения при первом запросе
+        print(f"Пул соединений не прогрет: {e}")
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    auth.warm_up()
+    analytics.ensure_scheduler()
+
+
+def post_fork(server, worker):
+    # Соединения, открытые в мастере до fork, воркер не использует (db.get_pool тоже
+    # проверяет pid, но ссылку на чужой пул лучше сбросить сразу)
+    db.close_pool()
+
+
+def post_worker_init(worker):
+    warm_up(worker.wsgi)
+
+
+def worker_exit(server, worker):
+    auth.shutdown()
+    db.close_pool()
+
+
+def create_application(options):
+    if BaseApplication is None:
+        raise ValueError("Для запуска в production установите пакет gunicorn")
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for name, value in options.items():
+                self.cfg.set(name, value)
+            self.cfg.set("post_fork", post_fork)
+            self.cfg.set("post_worker_init", post_worker_init)
+            self.cfg.set("worker_exit", worker_exit)
+
+        def load(self):
+            import main
+            return main.app
+
+    return Application()
+
+
+def _read_pid(pidfile):
+    try:
+        with open(pidfile) as f:
+            return int(f.read().strip() or 0) or None
+    except (OSError, ValueError):
+        return None
+
+
+def reload(pidfile, wait=60.0):
+    """Перезапуск без простоя: новый мастер с новым кодом, затем мягкая остановка старого"""
+    old_pid = _read_pid(pidfile)
+    if not old_pid:
+        raise ValueError(f"Сервер не запущен: нет pid в {pidfile}")
+    os.kill(old_pid, signal.SIGUSR2)
+
+    # Новый мастер пишет pid в pidfile.2 и переименовывает его после остановки старого
+    deadline = time.monotonic() + wait
+    new_pid = None
+    while time.monotonic() < deadline:
+        time.sleep(0.5)
+        new_pid = _read_pid(pidfile + ".2")
+        if new_pid:
+            break
+    else:
+        raise ValueError("Новый мастер не запустился, старый продолжает работу")
+
+    # pid записывается до запуска воркеров - даем им подняться и прогреться
+    time.sleep(float(os.getenv("WEB_RELOAD_WARMUP", 5)))
+    os.kill(old_pid, signal.SIGTERM)
+    return new_pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запуск приложения в production (gunicorn)")
+    parser.add_argument("--migrate", action="store_true",
+                        help="применить миграции в мастере перед запуском воркеров")
+    parser.add_argument("--reload", action="store_true",
+                        help="перезапустить работающий сервер с новым кодом без простоя")
+    args = parser.parse_args()
+
+    if args.reload:
+        new_pid = reload(SERVER_CONFIG["pidfile"])
+        print(f"Сервер перезапущен, новый мастер {new_pid}")
+        return
+
+    if args.migrate:
+        applied = migrate.migrate()
+        if applied:
+            print("Применены миграции: " + ", ".join(f"{v:04d}" for v in applied))
+        # Соединения мастера не должны достаться воркерам
+        db.close_pool()
+
+    # Ошибка конфигурации кэша видна сразу, а не в каждом воркере при первом запросе
+    configure_cache(SERVER_CONFIG["workers"])
+    # Значения метрик прежнего запуска не должны попасть в сумму по воркерам
+    metrics.clear_dir()
+    create_application(SERVER_CONFIG).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import hashlib
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import deque
+
+# Журнал медленных запросов: запросы реестра queries дольше SLOW_QUERY_MS пишутся
+# в лог с именем, текстом, отпечатком параметров и временем. Для части из них в
+# фоновом потоке снимается план EXPLAIN (ANALYZE, BUFFERS) - запрос выполняется
+# повторно в отдельной транзакции только для чтения, поэтому планы снимаются
+# выборочно и не чаще раза в SLOW_QUERY_EXPLAIN_INTERVAL секунд на запрос.
+#
+# План снимается для текста запроса с конкретными параметрами (custom plan); через
+# EXECUTE подготовленный запрос может идти по общему плану (generic plan), который
+# виден в EXPLAIN EXECUTE на том же соединении.
+
+# Порог в мс; 0 - журнал выключен
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 500))
+# Доля медленных запросов, для которых снимается план
+EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", 0.1))
+EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", 300))
+# План снимается только для обычных запросов: SELECT без функций с побочными
+# эффектами выполняется заново (EXPLAIN ANALYZE), INSERT/UPDATE/DELETE только
+# планируются, служебные команды (SET, set_config, PREPARE, REFRESH ...) пропускаются.
+
+# Ограничение на повторное выполнение запроса при снятии плана, мс
+EXPLAIN_TIMEOUT = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT", 30000))
+# Сколько последних медленных запросов хранится для /stats/slow_queries
+RECENT_SIZE = int(os.getenv("SLOW_QUERY_RECENT", 100))
+
+_READ = re.compile(r"\s*(SELECT|WITH|VALUES|TABLE)\b", re.IGNORECASE)
+_WRITE = re.compile(r"\s*(INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+# Функции, вызов которых нельзя повторять: настройки сессии, последовательности, блокировки
+_SIDE_EFFECT_CALLS = re.compile(
+    r"\b(set_config|nextval|setval|pg_\w*advisory\w*|pg_notify|pg_cancel_backend|"
+    r"pg_terminate_backend)\s*\(", re.IGNORECASE)
+# Чтение, которое пишет или блокирует строки и в транзакции только для чтения не выполнится
+_WRITING_READ = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|INTO)\b|\bFOR\s+(NO\s+KEY\s+)?(UPDATE|SHARE|KEY\s+SHARE)\b",
+    re.IGNORECASE)
+_SPACES = re.compile(r"\s+")
+
+_recent = deque(maxlen=RECENT_SIZE)
+_last_explain = {}  # имя запроса -> время последнего плана
+_lock = threading.Lock()
+_explain_queue = queue.Queue(maxsize=16)
+_worker_pid = None
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(params):
+    """Отпечаток параметров вместо значений: число, типы и хэш. По нему видно, что
+    медленным был один и тот же набор параметров, а сами значения в лог не попадают."""
+    if not params:
+        return "-"
+    values = list(params.values()) if isinstance(params, dict) else list(params)
+    types = ",".join(type(value).__name__ for value in values)
+    digest = hashlib.sha1(repr(values).encode()).hexdigest()[:12]
+    return f"{len(values)} [{types}] #{digest}"
+
+
+def explain_mode(sql):
+    """Как снимать план запроса: 'analyze' - выполнить заново, 'plan' - только
+    спланировать, None - не снимать (служебная команда или побочные эффекты)"""
+    if _SIDE_EFFECT_CALLS.search(sql):
+        return None
+    if _WRITE.match(sql):
+        return 'plan'
+    if not _READ.match(sql):
+        return None
+    return 'plan' if _WRITING_READ.search(sql) else 'analyze'
+
+
+def record(query, params, elapsed, error=None):
+    """Вызывается реестром после каждого запроса; медленные пишутся в журнал"""
+    if SLOW_QUERY_MS <= 0 or elapsed * 1000 < SLOW_QUERY_MS:
+        return
+    entry = {
+        "time": time.time(),
+        "query": query.name,
+        "duration_ms": round(elapsed * 1000, 1),
+        "params": fingerprint(params),
+        "error": error,
+        "sql": _SPACES.sub(" ", query.sql).strip(),
+        "plan": None,
+    }
+    logger.warning("Медленный запрос %s: %s мс%s, параметры %s\n%s", entry['query'],
+                   entry['duration_ms'], f" (ошибка {error})" if error else "", entry['params'],
+                   entry['sql'])
+    mode = explain_mode(query.sql)
+    with _lock:
+        _recent.append(entry)
+        sampled = mode is not None and _should_explain(query)
+    if sampled:
+        _ensure_worker()
+        try:
+            # Прерванный по statement_timeout запрос повторно не выполняется
+            _explain_queue.put_nowait((entry, query.sql, params, mode == 'analyze' and error is None))
+        except queue.Full:
+            pass
+
+
+def _should_explain(query):
+    if EXPLAIN_SAMPLE <= 0 or random.random() >= EXPLAIN_SAMPLE:
+        return False
+    now = time.monotonic()
+    last = _last_explain.get(query.name)
+    if last is not None and now - last < EXPLAIN_INTERVAL:
+        return False
+    _last_explain[query.name] = now
+    return True
+
+
+def _ensure_worker():
+    global _worker_pid
+    if _worker_pid == os.getpid():
+        return
+    with _lock:
+        if _worker_pid == os.getpid():
+            return
+        threading.Thread(target=_explain_loop, name="slow-query-explain", daemon=True).start()
+        _worker_pid = os.getpid()
+
+
+def _explain_loop():
+    while True:
+        entry, sql, params, analyze = _explain_queue.get()
+        try:
+            entry["plan"] = explain(sql, params, analyze)
+            logger.warning("План медленного запроса %s:\n%s", entry['query'], entry['plan'])
+        except Exception as e:
+            logger.warning("План медленного запроса %s не получен: %s", entry['query'], e)
+
+
+def explain(sql, params, analyze=True):
+    """План запроса на отдельном соединении пула. С analyze запрос выполняется
+    в транзакции только для чтения, которая затем откатывается; прерванные по
+    statement_timeout запросы и запросы на запись только планируются."""
+    import db
+
+    if explain_mode(sql) is None:
+        raise ValueError("План снимается только для SELECT, INSERT, UPDATE и DELETE")
+
+    pool = db.get_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION READ ONLY")
+            cur.execute("SET LOCAL statement_timeout = %s", (EXPLAIN_TIMEOUT,))
+            options = "ANALYZE, BUFFERS" if analyze else "VERBOSE"
+            cur.execute(f"EXPLAIN ({options}) " + sql, params or None)
+            return "\n".join(row[0] for row in cur.fetchall())
+    finally:
+        conn.rollback()
+        pool.putconn(conn)
+
+
+def recent():
+    """Последние медленные запросы, новые первыми"""
+    with _lock:
+        return list(reversed(_recent))
@@ -0,0 +1,84 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')
+
+
+def load_benchmark(name):
+    # Через путь, а не sys.path: в benchmarks есть модули с именами модулей приложения
+    spec = importlib.util.spec_from_file_location(f"benchmarks_{name}", os.path.join(BENCHMARKS, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.connection = conn
+        self.result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.connection.statements.append(sql)
+        self.result = self.connection.pool.respond(self.connection, sql, params)
+
+    def fetchone(self):
+        return self.result
+
+    def fetchall(self):
+        return self.result or []
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.cursor_factory = None
+
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class FakePool:
+    """Пул db без сервера: соединения запоминают выполненный SQL, ответы на запросы
+    задает тест через respond(conn, sql, params)"""
+
+    def __init__(self):
+        self.connections = []
+        self.returned = []
+        self.respond = lambda conn, sql, params: None
+
+    def getconn(self):
+        conn = FakeConnection(self)
+        self.connections.append(conn)
+        return conn
+
+    def putconn(self, conn, close=False):
+        self.returned.append(conn)
+
+
+@pytest.fixture
+def fake_pool(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(db, 'get_pool', lambda: pool)
+    return pool
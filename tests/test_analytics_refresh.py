@@ -0,0 +1,34 @@
+import analytics
+import db
+
+
+def test_each_view_refreshes_in_its_own_transaction(fake_pool):
+    def respond(conn, sql, params):
+        if 'REFRESH MATERIALIZED VIEW CONCURRENTLY analytics_funnel_monthly' in sql:
+            raise RuntimeError("ошибка обновления")
+        if 'pg_try_advisory_xact_lock' in sql:
+            return (True,)
+        return None
+    fake_pool.respond = respond
+
+    # Как /analytics/refresh: вызов внутри единицы работы запроса
+    with db.unit_of_work() as request_uow:
+        refreshed = analytics.refresh_views()
+        assert db._current_uow.get() is request_uow
+        assert request_uow.conn is None
+        assert not request_uow.rollback_only
+
+    assert [view for view, _ in refreshed] == ['analytics_volume_monthly', 'analytics_stage_durations']
+    assert len(fake_pool.connections) == len(analytics.VIEWS)
+    volume, funnel, stages = fake_pool.connections
+    # Каждое представление фиксируется сразу, упавшее откатывается и не мешает следующему
+    assert (volume.commits, funnel.commits, stages.commits) == (1, 0, 1)
+    assert funnel.rollbacks >= 1
+    for conn in fake_pool.connections:
+        assert sum('pg_try_advisory_xact_lock' in sql for sql in conn.statements) == 1
+
+
+def test_view_locked_by_another_process_is_skipped(fake_pool):
+    fake_pool.respond = lambda conn, sql, params: (False,) if 'advisory' in sql else None
+    assert analytics.refresh_views() == []
+    assert not any('REFRESH' in sql for conn in fake_pool.connections for sql in conn.statements)
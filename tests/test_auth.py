@@ -0,0 +1,143 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+import auth
+import db
+from rows import record_class
+
+PASSWORD = "correct horse battery staple"
+
+
+@pytest.fixture(autouse=True)
+def in_thread(monkeypatch):
+    """Хэши считаются в потоке теста, дешевым методом"""
+    monkeypatch.setattr(auth, 'AUTH_WORKERS', 0)
+    monkeypatch.setattr(auth, 'HASH_METHOD', 'pbkdf2:sha256:1000')
+    monkeypatch.setattr(auth, '_current_method', {})
+    auth.shutdown()
+    auth._failures.clear()
+    yield
+    auth.shutdown()
+    auth._failures.clear()
+
+
+@pytest.fixture
+def user(monkeypatch):
+    user = record_class(('id', 'username', 'role', 'password_hash'))(
+        1, 'ivanov', 'manager', generate_password_hash(PASSWORD, 'pbkdf2:sha256:1000'))
+    monkeypatch.setattr(db, 'get_user_by_username', lambda username: user if username == user.username else None)
+    return user
+
+
+def test_backoff_after_free_attempts(user, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(auth.time, 'monotonic', lambda: now[0])
+    for _ in range(auth.AUTH_FREE_ATTEMPTS):
+        assert auth.authenticate('ivanov', 'неверный') is None
+    with pytest.raises(auth.LoginThrottled) as e:
+        auth.authenticate('ivanov', PASSWORD)
+    assert e.value.retry_after == pytest.approx(auth.AUTH_BACKOFF_BASE)
+    now[0] += auth.AUTH_BACKOFF_BASE + 0.1
+    # Успешный вход сбрасывает счетчик
+    assert auth.authenticate('ivanov', PASSWORD) is user
+    assert 'ivanov' not in auth._failures
+
+
+def test_parallel_failed_logins_are_throttled(user, monkeypatch):
+    checked = []
+    release = threading.Event()
+
+    def slow_check(hashed, password):
+        checked.append(password)
+        release.wait(5)
+        return False
+    monkeypatch.setattr(auth, 'check_password_hash', slow_check)
+
+    results = []
+
+    def attempt(number):
+        try:
+            results.append(auth.authenticate('ivanov', f"догадка {number}"))
+        except auth.LoginThrottled:
+            results.append('throttled')
+
+    threads = [threading.Thread(target=attempt, args=(number,)) for number in range(20)]
+    for thread in threads:
+        thread.start()
+    # Все попытки, которые пропущены к проверке, уже идут; остальные отклонены до хэша
+    deadline = time.time() + 5
+    while len(results) < 20 - auth.AUTH_FREE_ATTEMPTS and time.time() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(checked) == auth.AUTH_FREE_ATTEMPTS
+    assert results.count('throttled') == 20 - auth.AUTH_FREE_ATTEMPTS
+
+
+def test_attempt_without_password_check_is_not_counted(user, monkeypatch):
+    def busy(*args):
+        raise auth.AuthBusy("занято")
+    monkeypatch.setattr(auth, '_run', busy)
+    for _ in range(auth.AUTH_FREE_ATTEMPTS + 2):
+        with pytest.raises(auth.AuthBusy):
+            auth.authenticate('ivanov', PASSWORD)
+    assert auth._failures['ivanov'][0] == 0
+
+
+def test_old_hash_is_replaced_after_login(user, monkeypatch):
+    user = user._replace(password_hash=generate_password_hash(PASSWORD, 'pbkdf2:sha256:2000'))
+    monkeypatch.setattr(db, 'get_user_by_username', lambda username: user)
+    updates = []
+    monkeypatch.setattr(db, 'update_password_hash', lambda *args: updates.append(args))
+
+    assert auth.authenticate('ivanov', PASSWORD) is user
+    assert len(updates) == 1
+    user_id, old_hash, new_hash = updates[0]
+    assert (user_id, old_hash) == (1, user.password_hash)
+    assert new_hash.startswith('pbkdf2:sha256:1000$')
+    assert not auth.needs_rehash(new_hash)
+
+
+def test_queue_slot_is_held_until_hash_finishes(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=1)
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(auth, '_get_executor', lambda: (executor, slots))
+    monkeypatch.setattr(auth, 'AUTH_TIMEOUT', 0.1)
+    finish = threading.Event()
+
+    with pytest.raises(auth.AuthBusy):
+        auth._run(finish.wait, 5)
+    # Запрос перестал ждать, но хэш еще считается - место в очереди занято
+    with pytest.raises(auth.AuthBusy):
+        auth._run(lambda: 'ok')
+    finish.set()
+    executor.shutdown(wait=True)
+    assert slots.acquire(timeout=1)
+    slots.release()
+
+
+def test_delay_is_capped_after_many_failures():
+    assert auth._delay(10 ** 6) == auth.AUTH_BACKOFF_MAX
+
+
+def test_connection_is_returned_before_password_check(fake_pool, monkeypatch):
+    row = record_class(('id', 'username', 'role', 'password_hash'))(
+        1, 'ivanov', 'manager', generate_password_hash(PASSWORD, 'pbkdf2:sha256:1000'))
+    fake_pool.respond = lambda conn, sql, params: row if params and 'ivanov' in params else None
+    checked_out = []
+    verify_password = auth.verify_password
+
+    def verify(password_hash, password):
+        checked_out.append(len(fake_pool.connections) - len(fake_pool.returned))
+        return verify_password(password_hash, password)
+
+    monkeypatch.setattr(auth, 'verify_password', verify)
+    with db.unit_of_work():
+        assert auth.authenticate('ivanov', PASSWORD) == row
+    assert checked_out == [0]
@@ -0,0 +1,109 @@
+import csv
+import datetime
+import io
+import random
+
+import pytest
+
+from conftest import load_benchmark
+
+loadtest = load_benchmark('loadtest')
+seed = load_benchmark('seed')
+
+START = datetime.datetime(2023, 1, 1)
+
+
+class CopyCursor:
+    """Курсор без сервера: nextval отдает следующий id, COPY складывает строки по таблицам"""
+
+    def __init__(self):
+        self.next_id = 100
+        self.result = None
+        self.tables = {}
+        # id сделок, загруженных к моменту каждого COPY в deals_expert
+        self.loaded_deals = set()
+        self.expert_refs_ok = True
+
+    def execute(self, sql, params=None):
+        if 'nextval' in sql:
+            self.result = (self.next_id,)
+        elif 'setval' in sql:
+            self.next_id = params[1] + 1
+        else:
+            self.result = (0,)
+
+    def fetchone(self):
+        return self.result
+
+    def copy_expert(self, sql, buffer):
+        table = sql.split()[1]
+        rows = list(csv.reader(io.StringIO(buffer.read())))
+        self.tables.setdefault(table, []).extend(rows)
+        if table == 'deals_managers':
+            self.loaded_deals.update(int(row[0]) for row in rows)
+        elif table == 'deals_expert':
+            self.expert_refs_ok &= all(int(row[1]) in self.loaded_deals for row in rows)
+
+
+def test_rows_match_copy_columns():
+    rng = random.Random(1)
+    deal = seed.deal_row(rng, 1, 2, 3, START)
+    assert len(deal) == len(seed.DEAL_COLUMNS)
+    assert len(seed.expert_row(rng, 1, deal, [7, 8])) == len(seed.EXPERT_DEAL_COLUMNS)
+
+
+def test_rows_are_reproducible():
+    first = [seed.deal_row(random.Random(5), n, 1, 1, START) for n in range(3)]
+    second = [seed.deal_row(random.Random(5), n, 1, 1, START) for n in range(3)]
+    assert first == second
+
+
+def test_seed_deals_loads_deals_before_their_expert_records(monkeypatch):
+    monkeypatch.setattr(seed, 'BATCH_SIZE', 50)
+    cur = CopyCursor()
+    first_deal, first_expert, experts = seed.seed_deals(
+        cur, 1000, 0.6, random.Random(1), START, [1, 2], [3], 10, 100)
+
+    deals = cur.tables['deals_managers']
+    assert [int(row[0]) for row in deals] == list(range(first_deal, first_deal + 1000))
+    assert all(len(row) == len(seed.DEAL_COLUMNS) for row in deals)
+    assert 0 < experts <= 600 and len(cur.tables['deals_expert']) == experts
+    assert cur.expert_refs_ok
+    # NULL передается пустым полем, флажки - t/f
+    assert {row[seed.DEAL_COLUMNS.index('express')] for row in deals} == {'t', 'f'}
+
+
+MANIFEST = {
+    'clients': {'first_id': 10, 'count': 5, 'first_unp': '100000001'},
+    'deals': {'first_id': 1000, 'count': 50},
+    'expert_deals': {'first_id': 2000, 'count': 20},
+}
+
+
+def test_load_requests_are_reproducible_and_use_seeded_ids():
+    paths = list(loadtest.DEFAULT_PATHS)
+    first = loadtest.build_requests(paths, 200, MANIFEST, seed=3)
+    assert first == loadtest.build_requests(paths, 200, MANIFEST, seed=3)
+    assert first != loadtest.build_requests(paths, 200, MANIFEST, seed=4)
+    for route, method, path, body in first:
+        if route == '/deal/{deal}':
+            assert 1000 <= int(path.rsplit('/', 1)[1]) < 1050
+        if method == 'POST':
+            assert b'unp_client=' in body
+
+
+def report(rps, p95):
+    stats = {'rps': rps, 'p50': 10.0, 'p95': p95, 'p99': 50.0}
+    return {'total': stats, 'routes': {'/deals': stats}}
+
+
+@pytest.mark.parametrize('rps, p95, regressed', [
+    (1000, 20.0, set()),
+    (960, 21.0, set()),
+    (800, 20.0, {'rps'}),
+    (1000, 30.0, {'p95'}),
+])
+def test_compare_flags_regressions_beyond_tolerance(rps, p95, regressed, capsys):
+    baseline = {'meta': {}, 'targets': {'sync': report(1000, 20.0)}}
+    regressions = loadtest.compare({'sync': report(rps, p95)}, baseline, tolerance=10)
+    assert {metric for _, _, metric, _ in regressions} == regressed
@@ -0,0 +1,111 @@
+import datetime
+import io
+from decimal import Decimal
+
+import pytest
+
+import bulk_import
+
+USERS = {'ivanov': 1, 'petrov': 2}
+
+
+def validate(**values):
+    raw = {'name_client': 'ООО Ромашка', 'unp_client': '190000001'}
+    raw.update(values)
+    return bulk_import.validate_row(raw, default_user_id=1, users=USERS)
+
+
+def test_minimal_row_gets_defaults():
+    row, errors = validate()
+    assert errors == []
+    assert row['status'] == 'Согласование условий' and row['currency_contract'] == 'BYN'
+    assert row['id_users'] == 1
+    assert row['express'] is False and row['amount_financing'] is None
+
+
+def test_client_is_required():
+    _, errors = validate(unp_client=' ')
+    assert errors == ["УНП и Наименование клиента обязательны для заполнения"]
+
+
+def test_decimal_accepts_comma_and_spaces():
+    row, errors = validate(amount_financing='15 000,50', interest_rate=12.5)
+    assert errors == []
+    assert row['amount_financing'] == Decimal('15000.50')
+    assert row['interest_rate'] == Decimal('12.50')
+
+
+@pytest.mark.parametrize('field, value, stored', [
+    ('interest_rate', '999.99', Decimal('999.99')),
+    ('interest_rate', '999.994', Decimal('999.99')),
+    ('interest_rate', '-999.994', Decimal('-999.99')),
+    ('amount_financing', '9999999999999.994', Decimal('9999999999999.99')),
+])
+def test_decimal_within_limit_is_rounded_to_cents(field, value, stored):
+    row, errors = validate(**{field: value})
+    assert errors == []
+    assert row[field] == stored
+
+
+@pytest.mark.parametrize('field, value', [
+    ('interest_rate', '999.995'),
+    ('interest_rate', '-999.995'),
+    ('interest_rate', '1000'),
+    ('amount_financing', '9999999999999.995'),
+    ('amount_financing', '1e30'),
+])
+def test_decimal_rounding_past_limit_is_rejected(field, value):
+    _, errors = validate(**{field: value})
+    assert errors == [f"{field}: значение вне допустимого диапазона"]
+
+
+@pytest.mark.parametrize('value', ['много', 'NaN', 'Infinity'])
+def test_decimal_must_be_a_number(value):
+    _, errors = validate(amount_financing=value)
+    assert errors == ["amount_financing: ожидается число"]
+
+
+def test_integers_accept_xlsx_floats():
+    row, errors = validate(contract_term=36.0, use_number_cert='12')
+    assert errors == [] and row['contract_term'] == 36 and row['use_number_cert'] == 12
+    _, errors = validate(contract_term='три года')
+    assert errors == ["contract_term: ожидается целое число"]
+
+
+def test_dates_in_both_formats():
+    row, errors = validate(m_plan_ship='2025-06-01', use_date_cert='15.03.2025',
+                           issued_date_cert=datetime.datetime(2025, 4, 2, 10, 30))
+    assert errors == []
+    assert row['m_plan_ship'] == datetime.date(2025, 6, 1)
+    assert row['use_date_cert'] == datetime.date(2025, 3, 15)
+    assert row['issued_date_cert'] == datetime.date(2025, 4, 2)
+    _, errors = validate(m_plan_ship='01/06/2025')
+    assert errors == ["m_plan_ship: ожидается дата ГГГГ-ММ-ДД или ДД.ММ.ГГГГ"]
+
+
+def test_first_contact_keeps_time():
+    row, errors = validate(date_first_contact='01.02.2025 09:15')
+    assert errors == [] and row['date_first_contact'] == datetime.datetime(2025, 2, 1, 9, 15)
+    row, _ = validate(date_first_contact='2025-02-01')
+    assert row['date_first_contact'] == datetime.datetime(2025, 2, 1)
+
+
+def test_booleans_and_manager():
+    row, errors = validate(express='да', electric_car='0', manager='petrov')
+    assert errors == [] and row['express'] is True and row['electric_car'] is False
+    assert row['id_users'] == 2
+    _, errors = validate(express='может быть', manager='sidorov')
+    assert errors == ["express: ожидается да/нет", "manager: пользователь sidorov не найден"]
+
+
+def test_text_limits_and_numeric_unp():
+    row, errors = validate(unp_client=190000001.0, skp_or_bl='x' * 11)
+    assert row['unp_client'] == '190000001'
+    assert errors == ["skp_or_bl: длиннее 10 символов"]
+
+
+def test_csv_with_semicolons_skips_empty_rows():
+    data = "Name_Client;UNP_Client\nООО Ромашка;190000001\n;\nООО Лютик;190000002\n".encode('utf-8-sig')
+    rows = list(bulk_import.read_rows(io.BytesIO(data), 'deals.csv'))
+    assert rows == [(2, {'name_client': 'ООО Ромашка', 'unp_client': '190000001'}),
+                    (4, {'name_client': 'ООО Лютик', 'unp_client': '190000002'})]
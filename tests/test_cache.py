@@ -0,0 +1,162 @@
+import pickle
+
+import pytest
+
+import cache
+import db
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def store():
+    store = cache.MemoryCache(maxsize=3, ttl=10)
+    cache.set_cache(store)
+    yield store
+    cache.set_cache(None)
+
+
+def test_memory_cache_expires_after_ttl(clock):
+    store = cache.MemoryCache(maxsize=10, ttl=10)
+    store.set('a', 1)
+    store.set('b', 2, ttl=30)
+    clock[0] += 15
+    assert store.get('a') is cache.MISS
+    assert store.get('b') == 2
+    assert store.stats()['expirations'] == 1
+
+
+def test_memory_cache_evicts_least_recently_used():
+    store = cache.MemoryCache(maxsize=2, ttl=10)
+    store.set('a', 1)
+    store.set('b', 2)
+    store.get('a')
+    store.set('c', 3)
+    assert store.get('b') is cache.MISS
+    assert (store.get('a'), store.get('c')) == (1, 3)
+    assert store.stats()['evictions'] == 1
+
+
+def test_memory_cache_rejects_write_after_invalidation():
+    store = cache.MemoryCache(maxsize=10, ttl=10)
+    generation = store.generation('deal:1')
+    store.delete('deal:1')
+    assert store.set('deal:1', 'старое', generation=generation) is False
+    assert store.get('deal:1') is cache.MISS
+    # Сброс другого ключа не мешает
+    generation = store.generation('deal:1')
+    store.delete('deal:2')
+    assert store.set('deal:1', 'новое', generation=generation) is True
+    assert store.get('deal:1') == 'новое'
+
+
+def test_memory_cache_remembers_invalidations_of_evicted_keys():
+    store = cache.MemoryCache(maxsize=2, ttl=10)
+    generation = store.generation('deal:1')
+    store.delete('deal:1')
+    store.delete('deal:2', 'deal:3', 'deal:4')
+    assert store.set('deal:1', 'старое', generation=generation) is False
+
+
+def test_cached_does_not_store_value_read_before_concurrent_commit(store):
+    loads = []
+
+    def loader():
+        loads.append(1)
+        if len(loads) == 1:
+            # Пока читатель загружает строку, писатель фиксирует изменение и сбрасывает ключ
+            db.invalidate('deal:1')
+            return 'до изменения'
+        return 'после изменения'
+
+    assert db.cached('deal:1', loader) == 'до изменения'
+    assert store.get('deal:1') is cache.MISS
+    assert db.cached('deal:1', loader) == 'после изменения'
+    assert db.cached('deal:1', loader) == 'после изменения'
+    assert len(loads) == 2
+
+
+def test_invalidate_in_transaction_bypasses_cache_and_resets_after_commit(store, fake_pool):
+    store.set('deal:1', 'старое')
+    with db.unit_of_work(), db.connect_db():
+        db.invalidate('deal:1')
+        assert db.cached('deal:1', lambda: 'незафиксированное') == 'незафиксированное'
+        assert store.get('deal:1') is cache.MISS
+        # Другой читатель до фиксации кладет в кэш прежнее значение
+        store.set('deal:1', 'старое')
+    assert store.get('deal:1') is cache.MISS
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def eval(self, script, numkeys, key, generation_key, generation, value, ttl):
+        if (self.data.get(generation_key) or b'0').decode() != generation:
+            return 0
+        self.data[key] = value
+        return 1
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def delete(self, *keys):
+        self.calls.append(lambda: [self.client.data.pop(key, None) for key in keys])
+
+    def incr(self, key):
+        self.calls.append(lambda: self.client.data.__setitem__(
+            key, str(int(self.client.data.get(key, b'0')) + 1).encode()))
+
+    def expire(self, key, seconds):
+        pass
+
+    def execute(self):
+        for call in self.calls:
+            call()
+
+
+def test_redis_cache_rejects_write_after_invalidation():
+    store = cache.RedisCache(FakeRedis(), ttl=10, prefix='t:')
+    generation = store.generation('deal:1')
+    store.delete('deal:1')
+    assert store.set('deal:1', 'старое', generation=generation) is False
+    generation = store.generation('deal:1')
+    assert store.set('deal:1', 'новое', generation=generation) is True
+    assert pickle.loads(store.client.data['t:deal:1']) == 'новое'
+    assert store.stats()['stale_writes'] == 1
+
+
+def config(backend, workers):
+    return dict(cache.CACHE_CONFIG, backend=backend, workers=workers)
+
+
+def test_auto_backend_is_memory_in_single_process():
+    assert isinstance(cache.create_cache(config('auto', 1)), cache.MemoryCache)
+
+
+def test_auto_backend_is_disabled_with_several_workers():
+    assert isinstance(cache.create_cache(config('auto', 5)), cache.NullCache)
+
+
+def test_memory_backend_is_refused_with_several_workers():
+    with pytest.raises(ValueError):
+        cache.create_cache(config('memory', 5))
+    assert cache.resolve_backend(config('none', 5)) == 'none'
+    assert cache.resolve_backend(config('redis', 5)) == 'redis'
@@ -0,0 +1,68 @@
+"""Проверки на настоящей базе: запускаются, только если задана TEST_DB_NAME - имя
+отдельной базы для тестов (миграции применяются к ней здесь же). Остальные параметры
+соединения берутся из DB_USER, DB_PASSWORD, DB_HOST и DB_PORT. Созданные строки
+проверки удаляют за собой."""
+import os
+import threading
+
+import pytest
+
+import db
+import migrate
+from conftest import load_benchmark
+
+pytestmark = pytest.mark.skipif(not os.getenv("TEST_DB_NAME"), reason="не задана TEST_DB_NAME")
+
+
+@pytest.fixture(scope='module', autouse=True)
+def database():
+    saved = db.DB_CONFIG
+    db.close_pool()
+    db.DB_CONFIG = dict(saved, dbname=os.getenv("TEST_DB_NAME"))
+    try:
+        migrate.migrate()
+        yield
+    finally:
+        db.close_pool()
+        db.DB_CONFIG = saved
+
+
+def test_concurrent_upserts_keep_one_row():
+    upserts = load_benchmark('upserts')
+    upserts.cleanup()
+    try:
+        for number in range(5):
+            assert upserts.run_round(number, threads=8) == []
+    finally:
+        upserts.cleanup()
+
+
+def test_expert_counters_follow_concurrent_changes():
+    counters = load_benchmark('expert_counters')
+    experts = [user.id for user in db.get_users_by_role('expert')]
+    errors = []
+    threads = [threading.Thread(target=counters.worker, args=(experts, 50, errors)) for _ in range(4)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        assert db.check_expert_counters() == []
+    finally:
+        with db.connect_db() as conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM deals_expert WHERE car_brand = %s", (counters.MARKER,))
+    assert db.check_expert_counters() == []
+
+
+def test_expert_deal_lookup_uses_index():
+    lookup = load_benchmark('expert_deal_lookup')
+    with db.unit_of_work() as uow:
+        uow.rollback_only = True
+        with db.connect_db() as conn, conn.cursor() as cur:
+            lookup.grow(cur, 2000)
+            cur.execute("SELECT max(id) FROM deals_expert")
+            deal_id = cur.fetchone()[0]
+            assert db._load_expert_deal_details(deal_id).id == deal_id
+            p50, indexed = lookup.measure(cur, repeat=20)
+    assert indexed
@@ -0,0 +1,145 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+
+import db
+import deal_form
+import main
+from rows import record_class
+
+UPDATED_AT = datetime.datetime(2025, 3, 1, 12, 30, 15, 123456)
+
+
+def make_deal(**values):
+    fields = {field: None for field in deal_form.EDIT_FIELDS}
+    fields.update(id=7, id_users=1, updated_at=UPDATED_AT, status='На рассмотрении',
+                  amount_financing=Decimal('15000.00'), express=True, electric_car=None,
+                  date_first_contact=datetime.datetime(2025, 2, 1, 9, 15, 42),
+                  m_plan_ship=datetime.date(2025, 6, 1), description='Первая')
+    fields.update(values)
+    return record_class(tuple(fields))(*fields.values())
+
+
+def form_for(deal, **changes):
+    """Форма в том виде, в каком ее отправляет edit_deal.html"""
+    form = {'version': deal_form.version(deal)}
+    for field in deal_form.EDIT_FIELDS:
+        value = getattr(deal, field)
+        if field in ('express', 'electric_car'):
+            if value:
+                form[field] = 'on'
+        elif isinstance(value, datetime.datetime):
+            form[field] = value.strftime('%Y-%m-%dT%H:%M')
+        else:
+            form[field] = '' if value is None else str(value)
+    for field, value in changes.items():
+        if value is None:
+            form.pop(field, None)
+        else:
+            form[field] = value
+    return form
+
+
+def test_unchanged_form_has_no_changes():
+    deal = make_deal()
+    assert deal_form.changes(deal, form_for(deal)) == {}
+
+
+def test_only_changed_fields_are_returned():
+    deal = make_deal()
+    form = form_for(deal, amount_financing='16 500,50', express=None, description='')
+    assert deal_form.changes(deal, form) == {
+        'amount_financing': Decimal('16500.50'), 'express': False, 'description': None}
+
+
+def test_fields_missing_from_form_are_kept():
+    deal = make_deal()
+    assert deal_form.changes(deal, {'status': 'Отказ банка', 'express': 'on'}) == {'status': 'Отказ банка'}
+
+
+def test_invalid_value_names_the_field():
+    deal = make_deal()
+    with pytest.raises(ValueError, match='contract_term'):
+        deal_form.changes(deal, form_for(deal, contract_term='три года'))
+
+
+def test_version_round_trip():
+    deal = make_deal()
+    assert deal_form.parse_version(deal_form.version(deal)) == UPDATED_AT
+    assert deal_form.parse_version('') is None
+    with pytest.raises(ValueError):
+        deal_form.parse_version('вчера')
+
+
+@pytest.fixture
+def client(monkeypatch):
+    deal = make_deal()
+    updates = []
+
+    def update_deal_fields(deal_id, changes, version):
+        updates.append((deal_id, changes, version))
+        # Как UPDATE ... WHERE updated_at IS NOT DISTINCT FROM version
+        return UPDATED_AT + datetime.timedelta(seconds=1) if version == current['deal'].updated_at else None
+
+    current = {'deal': deal}
+    monkeypatch.setattr(db, 'get_deal_for_edit', lambda deal_id: current['deal'])
+    monkeypatch.setattr(db, 'update_deal_fields', update_deal_fields)
+    main.app.config['TESTING'] = True
+    client = main.app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=1, username='ivanov', role='manager')
+    client.deal, client.updates, client.current = deal, updates, current
+    return client
+
+
+AJAX = {'X-Requested-With': 'XMLHttpRequest'}
+
+
+def test_edit_saves_only_changed_fields(client):
+    response = client.post('/edit_deal/7', data=form_for(client.deal, status='Отказ банка'), headers=AJAX)
+    assert response.status_code == 200
+    assert response.json['changed'] == ['status']
+    assert client.updates == [(7, {'status': 'Отказ банка'}, UPDATED_AT)]
+
+
+def test_edit_without_changes_does_not_write(client):
+    response = client.post('/edit_deal/7', data=form_for(client.deal), headers=AJAX)
+    assert response.status_code == 200 and response.json['changed'] == []
+    assert client.updates == []
+
+
+def test_edit_with_stale_version_is_a_conflict(client):
+    form = form_for(client.deal, status='Отказ банка')
+    # Пока форма была открыта, сделку сохранил другой пользователь
+    client.current['deal'] = make_deal(updated_at=UPDATED_AT + datetime.timedelta(minutes=5))
+    response = client.post('/edit_deal/7', data=form, headers=AJAX)
+    assert response.status_code == 409
+    assert response.json['message'] == main.DEAL_CONFLICT_MESSAGE
+    assert client.updates == []
+
+
+def test_edit_losing_the_race_is_a_conflict(client, monkeypatch):
+    monkeypatch.setattr(db, 'update_deal_fields', lambda *args: None)
+    response = client.post('/edit_deal/7', data=form_for(client.deal, status='Отказ банка'), headers=AJAX)
+    assert response.status_code == 409
+
+
+def test_edit_without_version_is_a_conflict(client):
+    form = form_for(client.deal, status='Отказ банка', version=None)
+    assert client.post('/edit_deal/7', data=form, headers=AJAX).status_code == 409
+
+
+def test_plain_form_post_saves_and_redirects(client):
+    response = client.post('/edit_deal/7', data=form_for(client.deal, description='Вторая'))
+    assert response.status_code == 302 and response.headers['Location'].endswith('/deal/7')
+    assert client.updates == [(7, {'description': 'Вторая'}, UPDATED_AT)]
+
+
+def test_edit_form_takes_version_from_database(client, monkeypatch):
+    # В кэше карточка до чужого сохранения: форма с такой версией получила бы 409
+    monkeypatch.setattr(db, 'get_deal_details', lambda deal_id: make_deal(updated_at=None))
+    client.current['deal'] = make_deal(updated_at=UPDATED_AT + datetime.timedelta(minutes=5))
+    response = client.get('/edit_deal/7')
+    assert response.status_code == 200
+    assert deal_form.version(client.current['deal']) in response.get_data(as_text=True)
@@ -0,0 +1,56 @@
+import pytest
+
+import explain
+import queries
+
+
+@pytest.fixture(autouse=True)
+def plans(monkeypatch):
+    monkeypatch.setattr(explain, '_plans', {})
+    monkeypatch.setattr(explain, '_new_plans', [])
+    monkeypatch.setattr(queries, 'PREPARE_ENABLED', True)
+
+
+def test_registry_query_is_explained_by_its_text(fake_pool):
+    fake_pool.respond = lambda conn, sql, params: [("Index Scan using clients_pkey",)] \
+        if sql.startswith("EXPLAIN") else None
+    query = queries.statement("test_explain_client", "SELECT name FROM clients WHERE id = %s")
+    conn = fake_pool.getconn()
+    for _ in range(2):
+        with conn.cursor() as cur:
+            explain.explained_execute(cur, query, (1,))
+
+    assert conn.statements == [
+        "EXPLAIN " + query.sql, query.prepare_sql,
+        "EXECUTE test_explain_client(%s)", "EXECUTE test_explain_client(%s)",
+    ]
+    assert explain._new_plans == [" ".join(query.sql.split())]
+    assert explain._plans[explain._new_plans[0]] == ["Index Scan using clients_pkey"]
+
+
+def test_utility_query_is_not_explained(fake_pool):
+    conn = fake_pool.getconn()
+    query = queries.statement("test_explain_timeout", "SELECT set_config('statement_timeout', %s, true)")
+    with conn.cursor() as cur:
+        explain.explained_execute(cur, query, ('1000',))
+    assert not any(sql.startswith("EXPLAIN") for sql in conn.statements)
+
+
+def test_scenario_runs_with_reader_cursors_replaced(fake_pool, monkeypatch):
+    import db
+    import fx
+    from rows import RecordCursor
+
+    seen = {}
+
+    def scenario(conn):
+        seen.update(db=db.RecordCursor, fx=fx.RecordCursor, execute=queries.execute,
+                    factory=conn.cursor_factory)
+    monkeypatch.setattr(explain, 'run_scenario', scenario)
+    monkeypatch.setattr('sys.argv', ['explain.py'])
+    explain.main()
+
+    assert seen == {'db': explain.ExplainCursor, 'fx': explain.ExplainCursor,
+                    'execute': explain.explained_execute, 'factory': explain.ExplainCursor}
+    assert issubclass(explain.ExplainCursor, RecordCursor)
+    assert (db.RecordCursor, fx.RecordCursor, queries.execute) == (RecordCursor, RecordCursor, explain._execute)
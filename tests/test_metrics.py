@@ -0,0 +1,66 @@
+import json
+import os
+
+from flask import Flask, render_template_string
+
+import metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("test_duration_seconds", "Тест", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(('/a"b',), value)
+    lines = list(histogram.lines(histogram.snapshot()))
+    assert lines == [
+        'test_duration_seconds_bucket{route="/a\\"b",le="0.1"} 1',
+        'test_duration_seconds_bucket{route="/a\\"b",le="1.0"} 3',
+        'test_duration_seconds_bucket{route="/a\\"b",le="+Inf"} 4',
+        'test_duration_seconds_sum{route="/a\\"b"} 4.250000',
+        'test_duration_seconds_count{route="/a\\"b"} 4',
+    ]
+
+
+def test_request_metrics_and_server_timing(monkeypatch):
+    monkeypatch.setattr(metrics, 'SERVER_TIMING', True)
+    app = Flask(__name__)
+    metrics.init_app(app)
+
+    @app.route('/test-metrics/<int:item>')
+    def item_page(item):
+        metrics.observe_query('test_metrics_query', 0.002)
+        return render_template_string("{{ item }}", item=item)
+
+    client = app.test_client()
+    response = client.get('/test-metrics/1')
+    client.get('/test-metrics/2')
+    client.get('/test-metrics-missing')
+
+    assert response.status_code == 200
+    timing = response.headers['Server-Timing']
+    assert timing.startswith('app;dur=') and 'db;dur=2.0;desc="1"' in timing and 'tpl;dur=' in timing
+
+    text = metrics.render()
+    # Метка - правило маршрута, а не путь: оба запроса в одной серии
+    assert 'crm_http_requests_total{route="/test-metrics/<int:item>",method="GET",status="200"} 2' in text
+    assert 'route="<unmatched>",method="GET",status="404"' in text
+    assert 'crm_db_query_duration_seconds_count{query="test_metrics_query"} 2' in text
+    assert '# TYPE crm_http_request_duration_seconds histogram' in text
+
+
+def test_render_sums_values_of_all_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path))
+    other = {metric.name: [] for metric in metrics.METRICS}
+    other['crm_db_query_errors_total'] = [[['test_merged_query'], [3]]]
+    with open(os.path.join(tmp_path, '1.json'), 'w') as f:
+        json.dump(other, f)
+    metrics.QUERY_ERRORS.inc(('test_merged_query',), 2)
+
+    assert 'crm_db_query_errors_total{query="test_merged_query"} 5' in metrics.render()
+    assert os.path.exists(os.path.join(tmp_path, f"{os.getpid()}.json"))
+
+
+def test_metrics_token(monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_TOKEN', 'секрет')
+    assert metrics.authorized('Bearer секрет')
+    assert not metrics.authorized(None)
+    assert not metrics.authorized('Bearer другой')
@@ -0,0 +1,127 @@
+import sqlite3
+
+import pytest
+
+import db
+import pagination
+
+# Значения с NULL и повторами, чтобы курсор переходил через границы групп
+VALUES = [None, 'b', 'a', None, 'c', 'b', 'a', None, 'c', 'b', 'd', None, 'a']
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)")
+    conn.executemany("INSERT INTO t VALUES (?, ?)", enumerate(VALUES, start=1))
+    yield conn
+    conn.close()
+
+
+def fetch(conn, cursor, descending, per_page):
+    condition, order, params = pagination.keyset_clause('id', cursor, ('v', 'text'), descending)
+    # sqlite не знает приведения через ::, значения курсора и так строки
+    sql = f"SELECT id, v FROM t {'WHERE ' + condition if condition else ''} ORDER BY {order} LIMIT ?"
+    sql = sql.replace('%s::text::text', '?').replace('%s', '?')
+    rows = conn.execute(sql, params + (per_page + 1,)).fetchall()
+    return pagination.build_page(rows, per_page, cursor, key=pagination.sort_key)
+
+
+def walk(conn, descending, per_page, direction):
+    """Все страницы списка вперед от первой или назад от последней"""
+    cursor = pagination.decode_cursor(pagination.LAST_CURSOR) if direction == 'prev' else None
+    pages = []
+    while True:
+        rows, next_cursor, prev_cursor = fetch(conn, cursor, descending, per_page)
+        pages.append(rows)
+        following = next_cursor if direction == 'next' else prev_cursor
+        if following is None:
+            break
+        cursor = pagination.decode_cursor(following)
+    if direction == 'prev':
+        pages.reverse()
+    return [row for page in pages for row in page]
+
+
+@pytest.mark.parametrize('descending', [True, False])
+@pytest.mark.parametrize('direction', ['next', 'prev'])
+@pytest.mark.parametrize('per_page', [1, 2, 3, 5, 20])
+def test_keyset_walk_matches_full_order(conn, descending, direction, per_page):
+    # NULL - наименьшее значение, как в индексе (v DESC NULLS LAST, id DESC)
+    expected = sorted(enumerate(VALUES, start=1), key=lambda row: (row[1] is not None, row[1] or '', row[0]),
+                      reverse=descending)
+    assert walk(conn, descending, per_page, direction) == expected
+
+
+@pytest.mark.parametrize('descending', [True, False])
+@pytest.mark.parametrize('direction', ['next', 'prev', 'last'])
+def test_order_is_a_scan_of_one_index(descending, direction):
+    _, order, _ = pagination.keyset_clause('id', (direction, None), ('v', 'text'), descending)
+    assert order in ('v DESC NULLS LAST, id DESC', 'v ASC NULLS FIRST, id ASC')
+
+
+def test_bad_cursor():
+    with pytest.raises(ValueError):
+        pagination.keyset_clause('id', ('next', ['a']), ('v', 'text'))
+    with pytest.raises(ValueError):
+        pagination.decode_cursor('не курсор')
+
+
+@pytest.fixture
+def expert_conn():
+    conn = sqlite3.connect(':memory:')
+    conn.executescript("""
+        CREATE TABLE users (id INTEGER PRIMARY KEY, full_name TEXT);
+        CREATE TABLE clients (id INTEGER PRIMARY KEY, name TEXT);
+        CREATE TABLE deals_expert (
+            id INTEGER PRIMARY KEY, date_appearance TEXT, id_manager INT, id_client INT,
+            car_brand TEXT, status TEXT, amount_financing NUMERIC, shipping_date TEXT,
+            id_ce INT, currency_contract TEXT
+        );
+    """)
+    # Сделки по очереди у эксперта 1, эксперта 2 и без эксперта; каждая пятая - в USD
+    conn.executemany(
+        "INSERT INTO deals_expert (id, status, id_ce, currency_contract) VALUES (?, ?, ?, ?)",
+        [(i, VALUES[i % len(VALUES)], (1, 2, None)[i % 3], 'USD' if i % 5 == 0 else 'BYN')
+         for i in range(1, 41)])
+    yield conn
+    conn.close()
+
+
+def fetch_expert_page(conn, cursor, sort, descending, per_page, filters):
+    sql, params, key = db.expert_deals_keyset_query(per_page, cursor, 1, filters, sort, descending)
+    sql = sql.replace('%s::text::varchar', '?').replace('%s', '?')
+    rows = conn.execute(sql, params).fetchall()
+    return pagination.build_page(rows, per_page, cursor, key)
+
+
+@pytest.mark.parametrize('sort', ['id', 'status'])
+@pytest.mark.parametrize('descending', [True, False])
+@pytest.mark.parametrize('per_page', [1, 4, 50])
+def test_expert_list_merges_own_and_unassigned_deals(expert_conn, sort, descending, per_page):
+    filters = {'currency': 'BYN'}
+    rows = expert_conn.execute(
+        "SELECT id, status FROM deals_expert WHERE (id_ce = 1 OR id_ce IS NULL) AND currency_contract = 'BYN'"
+    ).fetchall()
+    if sort == 'id':
+        expected = sorted((row[0] for row in rows), reverse=descending)
+    else:
+        expected = [row[0] for row in sorted(rows, key=lambda row: (row[1] is not None, row[1] or '', row[0]),
+                                             reverse=descending)]
+
+    seen, cursor = [], None
+    while True:
+        page, next_cursor, _ = fetch_expert_page(expert_conn, cursor, sort, descending, per_page, filters)
+        seen.extend(row[0] for row in page)
+        if next_cursor is None:
+            break
+        cursor = pagination.decode_cursor(next_cursor)
+    assert seen == expected
+
+
+def test_expert_list_reads_each_branch_in_index_order():
+    sql, params, _ = db.expert_deals_keyset_query(20, None, 7, {'status': 'Одобрено'}, 'status')
+    # Ни одной ветки с OR: каждая идет по (id_ce, status DESC NULLS LAST, id DESC)
+    assert ' OR ' not in sql
+    assert sql.count('UNION ALL') == 1
+    assert params == ('Одобрено', 7, 21, 'Одобрено', 21, 21)
@@ -0,0 +1,153 @@
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+import pool as pool_module
+from pool import ConnectionPool, PoolTimeout
+
+
+class Info:
+    transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+class Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql):
+        self.conn.executed.append(sql)
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+
+class Connection:
+    """Соединение psycopg2 без сервера"""
+
+    def __init__(self, number):
+        self.number = number
+        self.closed = 0
+        self.broken = False
+        self.info = Info()
+        self.executed = []
+        self.rollbacks = 0
+
+    def cursor(self):
+        return Cursor(self)
+
+    def rollback(self):
+        if self.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.rollbacks += 1
+        self.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    created = []
+
+    def connect(**kwargs):
+        created.append(Connection(len(created) + 1))
+        return created[-1]
+
+    monkeypatch.setattr(pool_module.psycopg2, 'connect', connect)
+    return created
+
+
+def test_min_connections_are_opened_up_front(connections):
+    pool = ConnectionPool({}, minconn=2, maxconn=4)
+    assert len(connections) == 2
+    assert pool.stats()['size'] == 2 and pool.stats()['idle'] == 2
+
+
+def test_returned_connection_is_reused_last_in_first_out(connections):
+    pool = ConnectionPool({}, minconn=0, maxconn=2)
+    first, second = pool.getconn(), pool.getconn()
+    pool.putconn(first)
+    pool.putconn(second)
+    assert pool.getconn() is second
+    stats = pool.stats()
+    assert stats['created'] == 2 and stats['checkouts'] == 3 and stats['in_use'] == 1
+
+
+def test_checkout_times_out_when_pool_is_exhausted(connections):
+    pool = ConnectionPool({}, minconn=0, maxconn=1, timeout=0.05)
+    pool.getconn()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_waiting_checkout_gets_returned_connection(connections):
+    pool = ConnectionPool({}, minconn=0, maxconn=1, timeout=5)
+    conn = pool.getconn()
+    received = []
+    waiter = threading.Thread(target=lambda: received.append(pool.getconn()))
+    waiter.start()
+    while not pool.stats()['waiting']:
+        time.sleep(0.001)
+    pool.putconn(conn)
+    waiter.join(5)
+    assert received == [conn] and len(connections) == 1
+
+
+def test_open_transaction_is_rolled_back_on_return(connections):
+    pool = ConnectionPool({}, minconn=0, maxconn=1)
+    conn = pool.getconn()
+    conn.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    pool.putconn(conn)
+    assert conn.rollbacks == 1 and pool.stats()['idle'] == 1
+
+
+def test_connection_that_cannot_roll_back_is_discarded(connections):
+    pool = ConnectionPool({}, minconn=0, maxconn=1)
+    conn = pool.getconn()
+    conn.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INERROR
+    conn.broken = True
+    pool.putconn(conn)
+    assert conn.closed and pool.stats()['size'] == 0 and pool.stats()['discarded'] == 1
+
+
+def test_fresh_idle_connection_is_not_checked(connections):
+    pool = ConnectionPool({}, minconn=1, maxconn=1, check_idle=30)
+    assert pool.getconn().executed == []
+
+
+def test_long_idle_connection_is_checked_and_replaced_when_dead(connections):
+    pool = ConnectionPool({}, minconn=1, maxconn=1, check_idle=0)
+    dead = connections[0]
+    dead.broken = True
+    conn = pool.getconn()
+    assert dead.executed == ["SELECT 1"] and dead.closed
+    assert conn is connections[1]
+    assert pool.stats()['health_check_failures'] == 1
+
+    pool.putconn(conn)
+    assert pool.getconn() is conn and conn.executed == ["SELECT 1"]
+
+
+def test_closed_pool_refuses_checkouts(connections):
+    pool = ConnectionPool({}, minconn=1, maxconn=2)
+    conn = pool.getconn()
+    pool.closeall()
+    with pytest.raises(psycopg2.pool.PoolError):
+        pool.getconn()
+    # Соединение, выданное до закрытия, при возврате закрывается
+    pool.putconn(conn)
+    assert conn.closed and pool.stats()['size'] == 0
+
+
+def test_invalid_sizes_are_rejected():
+    with pytest.raises(ValueError):
+        ConnectionPool({}, minconn=3, maxconn=2)
@@ -0,0 +1,58 @@
+import pytest
+
+import db
+import queries
+
+
+def test_numbered_positional_and_named_parameters():
+    assert queries.numbered("SELECT * FROM t WHERE a = %s AND b LIKE 'x%%' AND c = %s") == (
+        "SELECT * FROM t WHERE a = $1 AND b LIKE 'x%' AND c = $2", (0, 1))
+    assert queries.numbered("UPDATE t SET a = %(a)s, b = %(b)s WHERE a <> %(a)s") == (
+        "UPDATE t SET a = $1, b = $2 WHERE a <> $1", ('a', 'b'))
+
+
+def test_arguments_checks_parameter_count():
+    assert queries.arguments((0, 1), ('x', 2)) == ['x', 2]
+    assert queries.arguments(('b', 'a'), {'a': 1, 'b': 2, 'c': 3}) == [2, 1]
+    assert queries.arguments((), None) == []
+    with pytest.raises(ValueError):
+        queries.arguments((0,), 'строка')
+    with pytest.raises(ValueError):
+        queries.arguments((0, 1), (1,))
+
+
+def test_statement_is_declared_once():
+    query = queries.statement("test_declared_once", "SELECT %s")
+    assert queries.statement("test_declared_once", "SELECT %s") is query
+    with pytest.raises(ValueError):
+        queries.statement("test_declared_once", "SELECT %s + 1")
+    with pytest.raises(ValueError):
+        queries.statement("Test-Name", "SELECT 1")
+
+
+def test_execute_prepares_once_per_connection(fake_pool, monkeypatch):
+    monkeypatch.setattr(queries, 'PREPARE_ENABLED', True)
+    query = queries.statement("test_prepare_once", "SELECT name FROM clients WHERE id = %s")
+    first, second = fake_pool.getconn(), fake_pool.getconn()
+    for conn in (first, first, second):
+        with conn.cursor() as cur:
+            queries.execute(cur, query, (1,))
+
+    assert first.statements == [query.prepare_sql, "EXECUTE test_prepare_once(%s)",
+                                "EXECUTE test_prepare_once(%s)"]
+    assert second.statements == [query.prepare_sql, "EXECUTE test_prepare_once(%s)"]
+    assert (query.calls, query.prepares) == (3, 2)
+
+
+def test_execute_without_prepare_runs_text(fake_pool, monkeypatch):
+    monkeypatch.setattr(queries, 'PREPARE_ENABLED', False)
+    query = queries.statement("test_no_prepare", "SELECT name FROM clients WHERE id = %s")
+    conn = fake_pool.getconn()
+    with conn.cursor() as cur:
+        queries.execute(cur, query, (1,))
+    assert conn.statements == [query.sql]
+
+
+def test_search_client_passes_name_as_one_parameter(fake_pool):
+    fake_pool.respond = lambda conn, sql, params: (5,) if list(params or ()) == ['ООО «Ромашка»'] else None
+    assert db.search_client('ООО «Ромашка»') == (5,)
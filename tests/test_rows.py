@@ -0,0 +1,93 @@
+import pickle
+
+import psycopg2.extensions
+
+import rows
+from rows import RecordCursor, record_class
+
+
+class ResultCursor(psycopg2.extensions.cursor):
+    """Курсор psycopg2 без соединения: execute(columns, result) задает ответ"""
+
+    description = None
+
+    def execute(self, query, vars=None):
+        self.description = [(name,) for name in query]
+        self.result = list(vars)
+
+    def fetchone(self):
+        return self.result.pop(0) if self.result else None
+
+    def fetchmany(self, size=None):
+        batch, self.result = self.result[:size], self.result[size:]
+        return batch
+
+    def fetchall(self):
+        batch, self.result = self.result, []
+        return batch
+
+    def __iter__(self):
+        while self.result:
+            yield self.result.pop(0)
+
+
+class Cursor(RecordCursor, ResultCursor):
+    pass
+
+
+def cursor(columns, result):
+    # Без __init__: ему нужно настоящее соединение
+    cur = Cursor.__new__(Cursor)
+    cur.arraysize = 1
+    cur.execute(columns, result)
+    return cur
+
+
+def test_fetch_returns_records():
+    cur = cursor(('id', 'status'), [(1, 'Новая'), (2, 'Отказ'), (3, None)])
+    first = cur.fetchone()
+    assert first.id == 1 and first.status == 'Новая' and first == (1, 'Новая')
+    assert cur.fetchmany(1)[0].status == 'Отказ'
+    assert [row.id for row in cur.fetchall()] == [3]
+    assert cur.fetchone() is None and cur.fetchall() == []
+
+
+def test_new_query_gets_its_own_columns():
+    cur = cursor(('id', 'status'), [(1, 'Новая')])
+    assert cur.fetchone()._fields == ('id', 'status')
+    cur.execute(('full_name',), [('Иванов',)])
+    assert cur.fetchone().full_name == 'Иванов'
+
+
+def test_iteration_yields_records():
+    cur = cursor(('id', 'amount'), [(1, 10), (2, 20)])
+    assert [(row.id, row.amount) for row in cur] == [(1, 10), (2, 20)]
+    assert list(cursor(('id',), [])) == []
+
+
+def test_record_class_is_shared_per_column_set():
+    assert record_class(('id', 'status')) is record_class(('id', 'status'))
+    # Повторяющиеся и недопустимые имена колонок переименовываются, а не роняют запрос
+    assert record_class(('id', '?column?', 'id'))._fields == ('id', '_1', '_2')
+
+
+def test_records_survive_pickling():
+    record = record_class(('id', 'client_name'))(7, 'ООО Ромашка')
+    restored = pickle.loads(pickle.dumps(record))
+    assert restored == record and restored.client_name == 'ООО Ромашка'
+    assert type(restored) is type(record)
+
+
+def test_records_survive_pickling_after_class_cache_eviction():
+    data = pickle.dumps([record_class(('id', 'car_brand'))(1, 'Geely')])
+    record_class.cache_clear()
+    restored, = pickle.loads(data)
+    assert restored.car_brand == 'Geely'
+
+
+def test_dicts_and_mappings():
+    cur = cursor(('id', 'status'), [(1, 'Новая')])
+    assert rows.dicts(cur) == [{'id': 1, 'status': 'Новая'}]
+    converted = rows.from_mappings([{'id': 2, 'status': 'Отказ'}])
+    assert converted[0].status == 'Отказ'
+    assert rows.from_mappings([]) == []
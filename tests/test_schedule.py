@@ -0,0 +1,86 @@
+import datetime
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import schedule  # noqa: E402
+
+
+def test_annuity_payment_is_constant():
+    table = schedule.amortization(10000, 12, 12)
+    assert list(table['period']) == list(range(1, 13))
+    assert table['payment'][0] == pytest.approx(888.49)
+    # Проценты и основной долг округляются по отдельности: платеж может отличаться на копейку
+    assert np.allclose(table['payment'], 888.49, rtol=0, atol=0.011)
+    # Погрешность округления основного долга уходит в последний платеж
+    assert table['principal'].sum() == pytest.approx(10000)
+    assert table['balance'][-1] == pytest.approx(0)
+
+
+def test_differentiated_principal_is_constant():
+    table = schedule.amortization(10000, 12, 12, 'differentiated')
+    assert np.allclose(table['principal'][:-1], 833.33, rtol=0, atol=0.001)
+    assert table['payment'][0] == pytest.approx(933.33)
+    assert table['payment'][1] == pytest.approx(925.00)
+    assert table['interest'].sum() == pytest.approx(650, abs=0.05)
+    assert table['balance'][-1] == pytest.approx(0)
+
+
+def test_zero_rate_splits_amount_evenly():
+    for method in schedule.METHODS:
+        table = schedule.amortization(12000, 0, 12, method)
+        assert np.allclose(table['payment'], 1000)
+        assert table['interest'].sum() == 0
+
+
+def test_single_month_repays_everything_at_once():
+    table = schedule.amortization(5000, 12, 1)
+    assert list(table['payment']) == [pytest.approx(5050)]
+    assert list(table['balance']) == [0]
+
+
+@pytest.mark.parametrize('amount, rate, months', [(0, 12, 12), (10000, None, 12), (10000, -1, 12), (10000, 12, 0)])
+def test_invalid_terms_are_rejected(amount, rate, months):
+    with pytest.raises(ValueError):
+        schedule.amortization(amount, rate, months)
+
+
+def test_batch_totals_match_amortization():
+    totals = schedule.batch_totals([10000, 10000, 5000], [12, 0, 12], [12, 12, 1])
+    assert totals['first_payment'] == pytest.approx([888.4879, 833.3333, 5050], abs=1e-4)
+    assert totals['total_payments'] == pytest.approx([10661.85, 10000, 5050], abs=0.01)
+    assert totals['total_interest'] == pytest.approx([661.85, 0, 50], abs=0.01)
+
+    differentiated = schedule.batch_totals([10000], [12], [12], 'differentiated')
+    assert differentiated['first_payment'] == pytest.approx([933.3333], abs=1e-4)
+    assert differentiated['total_interest'] == pytest.approx([650])
+
+
+def test_irr_is_effective_annual_rate():
+    totals = schedule.batch_totals([10000, 10000, 5000], [12, 0, 12], [12, 12, 1])
+    # 1% в месяц: (1 + 0.01) ** 12 - 1
+    assert totals['irr'] == pytest.approx([0.1268, 0, 0.1268], abs=1e-4)
+    assert schedule.batch_totals([10000], [12], [12], 'differentiated')['irr'] == pytest.approx([0.1268], abs=1e-4)
+    # Комиссия уменьшает выдачу, доходность растет
+    assert schedule.batch_totals([10000], [12], [12], commission=2)['irr'][0] > 0.1268
+
+
+def test_cash_flow_matrix_has_zeros_after_term():
+    payment, interest, principal = schedule.cash_flow_matrix([10000, 5000], [12, 0], [12, 6])
+    assert payment.shape == (2, 12)
+    assert payment[0] == pytest.approx([888.4879] * 12, abs=1e-4)
+    assert list(payment[1, 6:]) == [0] * 6
+    assert principal.sum(axis=1) == pytest.approx([10000, 5000])
+
+
+def test_parse_prepayment():
+    assert schedule.parse_prepayment('20%', 8000) == pytest.approx(2000)
+    assert schedule.parse_prepayment('1 500,50', 8000) == pytest.approx(1500.5)
+    assert schedule.parse_prepayment('аванс', 8000) == 0
+    assert schedule.parse_prepayment(None, 8000) == 0
+
+
+def test_add_months_keeps_end_of_month():
+    dates = schedule.add_months(datetime.date(2025, 1, 31), [1, 2, 13])
+    assert dates == [datetime.date(2025, 2, 28), datetime.date(2025, 3, 31), datetime.date(2026, 2, 28)]
@@ -0,0 +1,25 @@
+import pytest
+
+import cache
+import serve
+
+
+@pytest.fixture(autouse=True)
+def cache_config(monkeypatch):
+    monkeypatch.setitem(cache.CACHE_CONFIG, 'workers', 1)
+    monkeypatch.setitem(cache.CACHE_CONFIG, 'backend', 'auto')
+
+
+def test_several_workers_turn_the_default_cache_off():
+    assert serve.configure_cache(5) == 'none'
+    assert cache.CACHE_CONFIG['workers'] == 5
+
+
+def test_single_worker_keeps_the_memory_cache():
+    assert serve.configure_cache(1) == 'memory'
+
+
+def test_memory_cache_with_several_workers_stops_startup():
+    cache.CACHE_CONFIG['backend'] = 'memory'
+    with pytest.raises(ValueError):
+        serve.configure_cache(3)
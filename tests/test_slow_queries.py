@@ -0,0 +1,88 @@
+import logging
+
+import pytest
+
+import db
+import main
+import queries
+import slow_queries
+
+
+@pytest.mark.parametrize('sql, mode', [
+    ("SELECT d.id FROM deals_managers d WHERE d.updated_at > %s", 'analyze'),
+    ("WITH t AS (SELECT 1) SELECT * FROM t", 'analyze'),
+    ("UPDATE deals_managers SET status = %s WHERE id = %s", 'plan'),
+    ("INSERT INTO clients (name, unp) VALUES (%s, %s) ON CONFLICT (unp) DO NOTHING", 'plan'),
+    ("WITH gone AS (DELETE FROM clients RETURNING id) SELECT count(1) FROM gone", 'plan'),
+    ("SELECT id FROM deals_expert WHERE id = %s FOR UPDATE", 'plan'),
+    ("SELECT set_config('statement_timeout', %s, true)", None),
+    ("SELECT pg_try_advisory_xact_lock(%s, %s)", None),
+    ("SELECT nextval(%s)", None),
+    ("SET LOCAL statement_timeout = 1000", None),
+    ("REFRESH MATERIALIZED VIEW CONCURRENTLY analytics_volume_monthly", None),
+    ("PREPARE q AS SELECT 1", None),
+])
+def test_explain_mode(sql, mode):
+    assert slow_queries.explain_mode(sql) == mode
+
+
+@pytest.fixture
+def sampled(monkeypatch):
+    """Каждый медленный запрос отбирается на план; планы копятся в очереди без потока"""
+    monkeypatch.setattr(slow_queries, 'SLOW_QUERY_MS', 100)
+    monkeypatch.setattr(slow_queries, 'EXPLAIN_SAMPLE', 1.0)
+    monkeypatch.setattr(slow_queries, '_last_explain', {})
+    monkeypatch.setattr(slow_queries, '_ensure_worker', lambda: None)
+    queue = slow_queries.queue.Queue()
+    monkeypatch.setattr(slow_queries, '_explain_queue', queue)
+    return queue
+
+
+def test_slow_query_is_logged_without_parameter_values(sampled, caplog):
+    query = queries.Query("test_slow_deals", "SELECT id FROM deals_managers WHERE car_brand = %s")
+    with caplog.at_level(logging.WARNING, logger='slow_queries'):
+        slow_queries.record(query, ('Секретный клиент',), 0.05)
+        slow_queries.record(query, ('Секретный клиент',), 0.25)
+    assert len(caplog.records) == 1
+    message = caplog.records[0].getMessage()
+    assert 'test_slow_deals' in message and '250.0 мс' in message
+    assert 'Секретный клиент' not in message
+    assert sampled.get_nowait()[3] is True
+
+
+def test_utility_statement_is_not_explained(sampled):
+    slow_queries.record(queries.Query("test_set_timeout", "SELECT set_config('statement_timeout', %s, true)"),
+                        ('1000',), 0.5)
+    slow_queries.record(queries.Query("test_update", "UPDATE clients SET name = %s WHERE id = %s"),
+                        ('x', 1), 0.5)
+    entry, sql, params, analyze = sampled.get_nowait()
+    assert entry['query'] == 'test_update' and analyze is False
+    assert sampled.empty()
+
+
+def test_explain_refuses_utility_statements():
+    with pytest.raises(ValueError):
+        slow_queries.explain("SET statement_timeout = 0", None)
+
+
+STATS_ROUTES = ['/stats/pool', '/stats/cache', '/stats/queries', '/stats/slow_queries']
+
+
+def stats_client(role):
+    main.app.config['TESTING'] = True
+    client = main.app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=1, username='ivanov', role=role)
+    return client
+
+
+@pytest.mark.parametrize('path', STATS_ROUTES)
+@pytest.mark.parametrize('role', ['manager', 'expert'])
+def test_stats_are_closed_to_other_roles(path, role):
+    assert stats_client(role).get(path).status_code == 403
+
+
+@pytest.mark.parametrize('path', STATS_ROUTES)
+def test_stats_are_open_to_boss(path, monkeypatch):
+    monkeypatch.setattr(db, 'pool_stats', lambda: {"size": 0})
+    assert stats_client('boss').get(path).status_code == 200
@@ -0,0 +1,142 @@
+import pytest
+
+import db
+import main
+from rows import record_class
+
+
+def touch():
+    """Обращение к БД внутри текущей единицы работы"""
+    with db.connect_db() as conn, conn.cursor() as cur:
+        cur.execute("SELECT 1")
+        return conn
+
+
+def test_one_connection_and_one_commit_per_unit(fake_pool):
+    with db.unit_of_work():
+        first = touch()
+        with db.unit_of_work():
+            assert touch() is first
+    assert fake_pool.connections == [first] and fake_pool.returned == [first]
+    assert first.commits == 1 and first.rollbacks == 0
+
+
+def test_unit_without_queries_takes_no_connection(fake_pool):
+    with db.unit_of_work():
+        pass
+    assert fake_pool.connections == []
+
+
+def test_error_rolls_back_and_skips_after_commit(fake_pool):
+    called = []
+    with pytest.raises(RuntimeError):
+        with db.unit_of_work():
+            db.on_commit(lambda: called.append('commit'))
+            with db.connect_db():
+                raise RuntimeError("сбой")
+    conn, = fake_pool.connections
+    assert conn.commits == 0 and conn.rollbacks >= 1
+    assert fake_pool.returned == [conn] and called == []
+
+
+def test_caught_error_still_rolls_back(fake_pool):
+    with db.unit_of_work():
+        try:
+            with db.connect_db():
+                raise RuntimeError("сбой")
+        except RuntimeError:
+            pass
+    conn, = fake_pool.connections
+    assert conn.commits == 0 and conn.rollbacks == 1
+
+
+def test_rollback_only(fake_pool):
+    with db.unit_of_work() as uow:
+        uow.rollback_only = True
+        touch()
+    conn, = fake_pool.connections
+    assert conn.commits == 0 and conn.rollbacks == 1
+
+
+def test_after_commit_runs_after_commit(fake_pool):
+    called = []
+    with db.unit_of_work():
+        conn = touch()
+        db.on_commit(lambda: called.append(conn.commits))
+        assert called == []
+    assert called == [1]
+    db.on_commit(lambda: called.append('сразу'))
+    assert called == [1, 'сразу']
+
+
+def test_separate_unit_uses_own_connection(fake_pool):
+    with db.unit_of_work() as outer:
+        outer_conn = touch()
+        with db.separate_unit_of_work():
+            inner_conn = touch()
+            assert inner_conn is not outer_conn
+        assert inner_conn.commits == 1 and fake_pool.returned == [inner_conn]
+        assert touch() is outer_conn
+    assert outer_conn.commits == 1
+
+
+def test_statement_timeout_is_set_on_first_query(fake_pool):
+    params = []
+    fake_pool.respond = lambda conn, sql, p: params.append(p)
+    with db.unit_of_work() as uow:
+        uow.statement_timeout = 1500
+        touch()
+        touch()
+    # Один раз на транзакцию, а не на каждое обращение
+    assert [tuple(p) for p in params if p].count(('1500',)) == 1
+
+
+Deal = record_class(('id', 'id_users', 'id_client', 'car_brand', 'sales_car', 'skp_or_bl',
+                     'shipment_or_signing', 'prepayment', 'contract_term', 'currency_contract',
+                     'interest_rate', 'use_number_cert', 'use_date_cert', 'express',
+                     'electric_car', 'status'))
+
+
+@pytest.fixture
+def client(fake_pool, monkeypatch):
+    def get_deal_details(deal_id):
+        touch()
+        return Deal(deal_id, 1, *[None] * 14) if deal_id == 7 else None
+
+    monkeypatch.setattr(db, 'get_deal_details', get_deal_details)
+    main.app.config['TESTING'] = True
+    client = main.app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=1, username='ivanov', role='manager')
+    return client
+
+
+def request_connection(fake_pool):
+    conn, = fake_pool.connections
+    assert fake_pool.returned == [conn]
+    return conn
+
+
+def test_successful_request_commits(client, fake_pool, monkeypatch):
+    monkeypatch.setattr(db, 'update_or_create_expert_deal', lambda **fields: {"success": True})
+    assert client.post('/transfer_to_expert/7').status_code == 200
+    conn = request_connection(fake_pool)
+    assert conn.commits == 1 and conn.rollbacks == 0
+
+
+def test_error_response_rolls_back(client, fake_pool):
+    assert client.post('/transfer_to_expert/8').status_code == 404
+    conn = request_connection(fake_pool)
+    assert conn.commits == 0 and conn.rollbacks == 1
+
+
+def test_unhandled_exception_rolls_back(client, fake_pool, monkeypatch):
+    def fail(deal_id):
+        touch()
+        raise RuntimeError("сбой")
+
+    monkeypatch.setattr(db, 'get_deal_details', fail)
+    monkeypatch.setitem(main.app.config, 'PROPAGATE_EXCEPTIONS', False)
+    assert client.get('/deal/7').status_code == 500
+    conn = request_connection(fake_pool)
+    assert conn.commits == 0 and conn.rollbacks >= 1